@@ -1,30 +1,120 @@
 import argparse
 import json
 import os
+import sys
 from modules.ExportFetcher import ExportFetcher
 from modules.Utils import identify_build_system, find_shared_libraries
-from modules.Coverage import LibCoverage
+from modules.Coverage import LibCoverage, GCOV_BACKENDS, merge_callgraphs
+from modules.CallGraphParser import CallGraphParser
+from modules.DiffCoverage import (DiffError, get_changed_lines, find_changed_functions, find_affected_apis,
+                                  select_delta_apis, coverage_deltas)
+from modules.GcovCache import GcovCache
+from modules.ExportCache import ExportCache
+from modules.GcovReader import GcovReader
+from modules.FileScanner import FileScanner, DEFAULT_PRUNE, DEFAULT_IGNORE
+from modules.Metrics import Metrics
+from modules.Shard import ShardError, write_shard, read_shard, merge_shards
 from modules.logging_config import logging 
 
 def main():
-    parser = argparse.ArgumentParser(description="CodeSA API Coverage Tool")
+    # `apicov.py merge SHARD...` combines the shards of a sharded run
+    if sys.argv[1:2] == ["merge"]:
+        return merge_main(sys.argv[2:])
+    parser = argparse.ArgumentParser(description="CodeSA API Coverage Tool",
+                                     epilog="Shards written with --shard-output are combined with: "
+                                            "%(prog)s merge SHARD... [--output FILE]")
     parser.add_argument('project_dir', type=str, help='Path to the root directory')
     parser.add_argument('install_dir', type=str, help='Path to where the built library is installed')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count() or 1,
+                        help='Number of libraries read or gcov processes run in parallel (default: number of CPUs)')
+    parser.add_argument('--gcov-backend', choices=GCOV_BACKENDS, default='text',
+                        help="How gcov results are collected: 'text' saves gcov -f output as .gcov_log files, "
+                             "'json' decodes gcov's JSON intermediate format in memory, "
+                             "'native' reads .gcno/.gcda files directly without running gcov (default: text)")
+    parser.add_argument('--cache-dir', type=str, default=None,
+                        help='Directory for results reused across runs, e.g. a CI cache (default: no caching)')
+    parser.add_argument('--clear-cache', action='store_true',
+                        help='Invalidate the cache in --cache-dir before running')
+    parser.add_argument('--prune', action='append', default=list(DEFAULT_PRUNE), metavar='PATTERN',
+                        help='Directory name pattern not to descend into, may be repeated '
+                             '(default: %s)' % ' '.join(DEFAULT_PRUNE))
+    parser.add_argument('--ignore', action='append', default=list(DEFAULT_IGNORE), metavar='PATTERN',
+                        help='File name pattern to skip, may be repeated (default: %s)' % ' '.join(DEFAULT_IGNORE))
+    parser.add_argument('--metrics', type=str, default=None, metavar='FILE',
+                        help='Write the wall/CPU time, subprocesses, bytes read and counters of every stage '
+                             'to this JSON file')
+    parser.add_argument('--profile', type=str, default=None, metavar='DIR',
+                        help='Profile every stage with cProfile and tracemalloc and write the results to DIR '
+                             '(slows the run down considerably)')
+    parser.add_argument('--since', type=str, default=None, metavar='REF',
+                        help='Compare with --baseline and write api_coverage_delta.json for the APIs whose '
+                             'functions changed since the git ref REF (or that reach a changed function, with '
+                             '--callgraph) and for every API whose coverage moved. api_coverage.json is still '
+                             'computed for all APIs. Needs the json or native gcov backend')
+    parser.add_argument('--baseline', type=str, default=None, metavar='FILE',
+                        help='api_coverage.json of an earlier run for --since (default: the one in project_dir)')
+    parser.add_argument('--callgraph', action='append', default=[], metavar='FILE',
+                        help='Call graph dump of opt -print-callgraph, may be repeated; with --since, changes '
+                             'are traced back through it to the APIs that call the changed functions')
+    parser.add_argument('--shard-count', type=int, default=1, metavar='N',
+                        help='Split the .gcno files into N shards and only process one of them')
+    parser.add_argument('--shard-index', type=int, default=0, metavar='I',
+                        help='The shard to process, 0 to N-1 (default: 0)')
+    parser.add_argument('--shard-output', type=str, default=None, metavar='FILE',
+                        help="Write this run's per-line coverage as a shard to FILE (gzip-compressed if it ends "
+                             "in .gz) instead of writing api_coverage.json. Default with --shard-count: "
+                             "project_dir/apicov_shard_I_of_N.json.gz")
 
     args = parser.parse_args()
+    if args.shard_count > 1 and args.shard_output is None:
+        args.shard_output = os.path.join(args.project_dir, 'apicov_shard_%d_of_%d.json.gz' %
+                                         (args.shard_index, args.shard_count))
+    if not 0 <= args.shard_index < max(args.shard_count, 1):
+        parser.error('--shard-index must be between 0 and --shard-count - 1')
+    if args.shard_output and args.gcov_backend == 'text':
+        parser.error('shards need per-line counts, use --gcov-backend json or native')
+    if args.shard_output and args.since:
+        parser.error('--since works on the merged result, not on shards')
+    metrics = Metrics(profile_dir=args.profile)
+    try:
+        run(args, metrics)
+    finally:
+        if args.metrics:
+            metrics.write(args.metrics)
 
 
-    logging.info("Looking for shared libraries in the project directory")
-    shared_libs = find_shared_libraries(args.install_dir)
+def run(args, metrics):
+    # Every tree is walked once and the file lists are shared by all stages
+    with metrics.stage("scan"):
+        install_scanner = FileScanner(args.install_dir, prune=args.prune, ignore=args.ignore).scan()
+        metrics.count("files_scanned", install_scanner.files_seen)
+        if os.path.abspath(args.project_dir) == install_scanner.root_dir:
+            project_scanner = install_scanner
+        else:
+            project_scanner = FileScanner(args.project_dir, prune=args.prune, ignore=args.ignore).scan()
+            metrics.count("files_scanned", project_scanner.files_seen)
+        metrics.count("headers", len(install_scanner.headers))
+        metrics.count("gcno_files", len(project_scanner.gcno_files))
+
+    with metrics.stage("export_discovery"):
+        export_cache = None
+        if args.cache_dir:
+            export_cache = ExportCache(os.path.join(args.cache_dir, 'exports'))
+            if args.clear_cache:
+                export_cache.invalidate()
+
+        logging.info("Looking for shared libraries in the project directory")
+        shared_libs = find_shared_libraries(args.install_dir, install_scanner)
 
-    logging.debug("Shared libraries found: %s", shared_libs)
+        logging.debug("Shared libraries found: %s", shared_libs)
 
-    logging.info("Identifying exports from shared libraries")
-    lib_exports = ExportFetcher(args.project_dir)
-    for lib in shared_libs:
-        lib_exports.get_exports_from_lib(lib)
+        logging.info("Identifying exports from shared libraries")
+        lib_exports = ExportFetcher(args.project_dir, scanner=project_scanner, export_cache=export_cache)
+        lib_exports.get_exports_from_libs(shared_libs, jobs=args.jobs)
 
-    logging.info("Total number of symbols found: %d", len(lib_exports.symbols))
+        logging.info("Total number of symbols found: %d", len(lib_exports.symbols))
+        metrics.count("shared_libs", len(shared_libs))
+        metrics.count("symbols", len(lib_exports.symbols))
 
     # build_system = identify_build_system(args.project_dir)
     # if build_system == 'unknown':
@@ -34,25 +124,84 @@ def main():
     # lib_exports.run_install_command(build_system)
 
     # lib_exports.get_install_headers(build_system)
-    logging.info("Filtering non-API exports")
-    lib_exports.filter_non_apis(args.install_dir)
+    with metrics.stage("api_filtering"):
+        logging.info("Filtering non-API exports")
+        lib_exports.filter_non_apis(args.install_dir, install_scanner.headers)
+        if export_cache is not None:
+            logging.info("Export cache: %d hits, %d misses", export_cache.hits, export_cache.misses)
+            metrics.count("export_cache_hits", export_cache.hits)
+            metrics.count("export_cache_misses", export_cache.misses)
+            export_cache.save()
+
+        logging.info("Total number of APIs found: %d", len(lib_exports.apis))
+        metrics.count("apis", len(lib_exports.apis))
 
-    logging.info("Total number of APIs found: %d", len(lib_exports.apis))
     json_data = {"apis": lib_exports.apis}
     api_file = os.path.join(args.project_dir, 'apis.json')
     logging.debug("Writing APIs to:  %s", api_file)
     with open(api_file, 'w') as fh:
         json.dump(json_data, fh)
+    # The library each API comes from, for per-library breakdowns
+    api_libraries = {api: os.path.relpath(lib_exports.symbol_libraries[api], args.install_dir)
+                     for api in lib_exports.apis if api in lib_exports.symbol_libraries}
+    with open(os.path.join(args.project_dir, 'api_libraries.json'), 'w') as fh:
+        json.dump(api_libraries, fh)
     
-    entry_cov = LibCoverage(lib_exports.apis, args.project_dir)
-    logging.info("Running gcov to identify API sizes and coverage")
-    entry_cov.run_gcov_on_gcno_files()
-    logging.info("Populate API sizes and coverage")
-    entry_cov.populate_entry_api_cov()
+    with metrics.stage("gcov"):
+        gcov_cache = None
+        if args.cache_dir:
+            gcov_version = GcovReader.VERSION if args.gcov_backend == 'native' else None
+            gcov_cache = GcovCache(os.path.join(args.cache_dir, 'gcov-' + args.gcov_backend), gcov_version)
+            if args.clear_cache:
+                gcov_cache.invalidate()
+
+        entry_cov = LibCoverage(lib_exports.apis, args.project_dir, gcov_cache=gcov_cache,
+                                gcov_backend=args.gcov_backend, scanner=project_scanner)
+        logging.info("Running gcov to identify API sizes and coverage")
+        entry_cov.run_gcov_on_gcno_files(jobs=args.jobs, shard_index=args.shard_index,
+                                         shard_count=args.shard_count)
+        metrics.count("gcov_failures", len(entry_cov.gcov_failures))
+        if gcov_cache is not None:
+            metrics.count("gcov_cache_hits", gcov_cache.hits)
+            metrics.count("gcov_cache_misses", gcov_cache.misses)
+    if args.shard_output:
+        with metrics.stage("shard_output"):
+            write_shard(args.shard_output, lib_exports.apis, entry_cov.coverage_index, args.project_dir,
+                        args.shard_index, args.shard_count, entry_cov.gcno_files_processed)
+        return
+
+    with metrics.stage("coverage_lookup"):
+        logging.info("Populate API sizes and coverage")
+        entry_cov.populate_entry_api_cov()
+        json_data = collect_api_coverage(lib_exports.apis, entry_cov)
+
+    baseline = None
+    affected_apis = None
+    if args.since:
+        # Before api_coverage.json is overwritten, it's the default baseline
+        with metrics.stage("diff"):
+            baseline, affected_apis = find_apis_since(args, entry_cov, lib_exports.apis, metrics)
+    apicov_file = os.path.join(args.project_dir, 'api_coverage.json')
+    logging.info("Writing API coverage to: %s",apicov_file)
+    with open(apicov_file, 'w') as fh:
+        json.dump(json_data, fh)
+
+    if baseline is not None:
+        changed = select_delta_apis(lib_exports.apis, baseline, json_data, affected_apis)
+        metrics.count("delta_apis", len(changed))
+        delta_file = os.path.join(args.project_dir, 'api_coverage_delta.json')
+        logging.info("Writing API coverage deltas to: %s", delta_file)
+        with open(delta_file, 'w') as fh:
+            json.dump(coverage_deltas(baseline, json_data, changed), fh)
 
+
+def collect_api_coverage(apis, entry_cov):
+    """
+    Returns the api_coverage.json entries of `apis` once `entry_cov` has been populated.
+    """
     json_data = {}
     failed_apis = []
-    for api in lib_exports.apis:
+    for api in apis:
         if api in entry_cov.api_sizes:
             json_data[api] = {}
             json_data[api]["Size"] = entry_cov.api_sizes[api]
@@ -60,10 +209,78 @@ def main():
         else:
             logging.error("Failed to find size for API: %s", api)
             failed_apis.append(api)
-    apicov_file = os.path.join(args.project_dir, 'api_coverage.json')
-    logging.info("Writing API coverage to: %s",apicov_file)
-    with open(apicov_file, 'w') as fh:
-        json.dump(json_data, fh)
+    return json_data
+
+
+def merge_main(argv):
+    parser = argparse.ArgumentParser(prog="apicov.py merge",
+                                     description="Combine the shards of a sharded ApiCov run into api_coverage.json")
+    parser.add_argument('shards', nargs='+', help='Shard files written with --shard-output')
+    parser.add_argument('--output', '-o', type=str, default='api_coverage.json',
+                        help='Where to write the API coverage (default: api_coverage.json)')
+    parser.add_argument('--metrics', type=str, default=None, metavar='FILE',
+                        help='Write the timings and counters of the merge to this JSON file')
+    args = parser.parse_args(argv)
+
+    metrics = Metrics()
+    try:
+        with metrics.stage("merge"):
+            try:
+                shards = [read_shard(path) for path in args.shards]
+            except ShardError as e:
+                parser.error(str(e))
+            apis, index = merge_shards(shards)
+            metrics.count("shards", len(shards))
+            metrics.count("apis", len(apis))
+        with metrics.stage("coverage_lookup"):
+            entry_cov = LibCoverage(apis, os.getcwd(), coverage_index=index)
+            entry_cov.populate_entry_api_cov()
+            json_data = collect_api_coverage(apis, entry_cov)
+        logging.info("Writing API coverage to: %s", args.output)
+        with open(args.output, 'w') as fh:
+            json.dump(json_data, fh)
+    finally:
+        if args.metrics:
+            metrics.write(args.metrics)
+
+
+def find_apis_since(args, entry_cov, apis, metrics):
+    """
+    Returns (baseline coverage, the APIs the diff affects) for --since.
+
+    An API is affected when the diff touches its own lines or, with --callgraph,
+    a function it reaches. The baseline is None if it can't be read, and all APIs
+    are affected if the diff can't be read or the gcov backend has no line numbers.
+    """
+    baseline_file = args.baseline or os.path.join(args.project_dir, 'api_coverage.json')
+    try:
+        with open(baseline_file, 'r') as fh:
+            baseline = json.load(fh)
+    except (OSError, ValueError) as e:
+        logging.error("Failed to read baseline %s, not writing coverage deltas. Error: %s", baseline_file, e)
+        return None, None
+    if not entry_cov.coverage_index.has_line_counts:
+        logging.error("--since needs function locations from the json or native gcov backend, "
+                      "reporting all APIs")
+        return baseline, None
+    try:
+        changed_lines = get_changed_lines(args.project_dir, args.since)
+    except DiffError as e:
+        logging.error("%s, reporting all APIs", e)
+        return baseline, None
+
+    changed_functions = find_changed_functions(changed_lines, entry_cov.coverage_index)
+    matrix = None
+    if args.callgraph:
+        callgraph = merge_callgraphs([CallGraphParser(f).load_callgraph() for f in args.callgraph])
+        matrix = entry_cov.get_reachability_matrix(callgraph, apis)
+    affected_apis = find_affected_apis(apis, changed_functions, matrix)
+    logging.info("%d files and %d functions changed since %s, affecting %d of %d APIs",
+                 len(changed_lines), len(changed_functions), args.since, len(affected_apis), len(apis))
+    metrics.count("changed_files", len(changed_lines))
+    metrics.count("changed_functions", len(changed_functions))
+    metrics.count("affected_apis", len(affected_apis))
+    return baseline, affected_apis
 
 
 
@@ -0,0 +1,168 @@
+"""
+Benchmark of every ApiCov stage on a synthetic project of a given size.
+
+Generates (or reuses) a project with `SyntheticProject`, then runs the
+stages of `apicov.py` one after the other and measures each on its own
+with `Metrics`: wall and CPU time, bytes read, peak RSS and the number of
+subprocesses it started.
+The results are printed as JSON; pass the JSON of an earlier commit with
+--compare to see the change per stage.
+
+Usage:
+    python benchmark.py --libs 8 --exports 500 --output after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+from modules.logging_config import logging
+from modules.FileScanner import FileScanner
+from modules.Utils import find_shared_libraries
+from modules.ExportFetcher import ExportFetcher
+from modules.Coverage import LibCoverage, GCOV_BACKENDS, merge_callgraphs
+from modules.CallGraphParser import CallGraphParser
+from modules.Metrics import Metrics
+from synthetic_project import SyntheticProject, SyntheticProjectError
+
+RESULTS_VERSION = 2
+STAGES = ("scan", "export_discovery", "api_filtering", "gcov", "coverage_lookup", "callgraph_parse",
+          "closure_aggregation")
+
+def run_stages(project, gcov_backend, jobs):
+    """
+    Runs the ApiCov pipeline on `project` once and returns ({stage: measurements}, counts).
+    """
+    metrics = Metrics()
+    with metrics.stage("scan"):
+        install_scanner = FileScanner(project.install_dir).scan()
+        project_scanner = FileScanner(project.project_dir).scan()
+
+    fetcher = ExportFetcher(project.project_dir, scanner=project_scanner)
+    with metrics.stage("export_discovery"):
+        fetcher.get_exports_from_libs(find_shared_libraries(project.install_dir, install_scanner), jobs=jobs)
+    with metrics.stage("api_filtering"):
+        fetcher.filter_non_apis(project.install_dir, install_scanner.headers)
+
+    coverage = LibCoverage(fetcher.apis, project.project_dir, gcov_backend=gcov_backend, scanner=project_scanner)
+    with metrics.stage("gcov"):
+        coverage.run_gcov_on_gcno_files(jobs=jobs)
+    with metrics.stage("coverage_lookup"):
+        coverage.populate_entry_api_cov()
+
+    with metrics.stage("callgraph_parse"):
+        callgraph = merge_callgraphs([CallGraphParser(project.callgraph_file(lib_name)).load_callgraph(use_cache=False)
+                                      for lib_name in project.lib_names])
+    with metrics.stage("closure_aggregation"):
+        coverage.populate_full_api_cov(callgraph)
+
+    counts = {"symbols": len(fetcher.symbols), "apis": len(fetcher.apis),
+              "gcno_files": len(project_scanner.gcno_files), "functions": len(coverage.get_function_reach())}
+    return metrics.stages, counts
+
+
+def summarize(runs):
+    """
+    Combines the measurements of several runs: median times, the highest peak RSS.
+    """
+    stages = {}
+    for stage in STAGES:
+        samples = [run[stage] for run in runs]
+        stages[stage] = {
+            "wall": statistics.median(s["wall"] for s in samples),
+            "wall_min": min(s["wall"] for s in samples),
+            "cpu": statistics.median(s["cpu"] for s in samples),
+            "subprocess_cpu": statistics.median(s["subprocess_cpu"] for s in samples),
+            "bytes_read": statistics.median(s["bytes_read"] for s in samples),
+            "peak_rss": max(s["peak_rss"] for s in samples),
+            "children_peak_rss": max(s["children_peak_rss"] for s in samples),
+            "subprocesses": samples[-1]["subprocesses"],
+        }
+    return stages
+
+
+def git_commit():
+    try:
+        p = subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                           capture_output=True, text=True)
+    except OSError:
+        return None
+    return p.stdout.strip() or None
+
+
+def compare(results, baseline_file):
+    with open(baseline_file) as fh:
+        baseline = json.load(fh)
+    if baseline.get("params") != results["params"] or baseline.get("gcov_backend") != results["gcov_backend"]:
+        print("warning: %s was measured with different parameters" % baseline_file, file=sys.stderr)
+    print("%-20s %10s %10s %8s" % ("stage", "before", "after", "ratio"), file=sys.stderr)
+    for stage in STAGES:
+        before = baseline["stages"].get(stage, {}).get("wall")
+        after = results["stages"][stage]["wall"]
+        ratio = "%.2fx" % (after / before) if before else "-"
+        print("%-20s %9.3fs %9.3fs %8s" % (stage, before or 0, after, ratio), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the ApiCov stages on a synthetic project")
+    parser.add_argument('--work-dir', type=str, default=os.path.join("/tmp", "apicov-benchmark"),
+                        help='Where the synthetic project is generated, reused while the parameters are '
+                             'unchanged. Must be empty or a project generated here before')
+    parser.add_argument('--libs', type=int, default=4, help='Number of shared libraries')
+    parser.add_argument('--exports', type=int, default=100, help='Exported symbols per library')
+    parser.add_argument('--headers', type=int, default=8, help='Installed headers in total')
+    parser.add_argument('--gcov-sets', type=int, default=16, help='.gcno/.gcda pairs in total')
+    parser.add_argument('--depth', type=int, default=3, help='Levels of the call graph below each API')
+    parser.add_argument('--fanout', type=int, default=2, help='Calls made by each function')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the call graph')
+    parser.add_argument('--gcov-backend', choices=GCOV_BACKENDS, default='text', help='See apicov.py')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count() or 1, help='See apicov.py')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of the pipeline, the median is reported')
+    parser.add_argument('--output', type=str, default=None, help='Also write the results to this JSON file')
+    parser.add_argument('--compare', type=str, default=None, metavar='JSON',
+                        help='Results of an earlier run to compare with, printed to stderr')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    project = SyntheticProject(args.work_dir, libs=args.libs, exports=args.exports, headers=args.headers,
+                               gcov_sets=args.gcov_sets, depth=args.depth, fanout=args.fanout, seed=args.seed)
+    start = time.perf_counter()
+    try:
+        project.generate()
+    except SyntheticProjectError as e:
+        parser.error(str(e))
+    generate_time = time.perf_counter() - start
+
+    runs = []
+    for _ in range(args.repeat):
+        stages, counts = run_stages(project, args.gcov_backend, args.jobs)
+        runs.append(stages)
+
+    results = {
+        "version": RESULTS_VERSION,
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "params": project.params,
+        "gcov_backend": args.gcov_backend,
+        "jobs": args.jobs,
+        "repeat": args.repeat,
+        "generate_time": generate_time,
+        "counts": counts,
+        "stages": summarize(runs),
+    }
+    results["total_wall"] = sum(stage["wall"] for stage in results["stages"].values())
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+Load test of the webhook server against a local stub of the GitHub API.
+
+Starts a stub GitHub REST API (with a configurable response latency) and the
+webhook app pointed at it, each in its own process so the measurement isn't
+skewed by sharing the GIL with the load generator, then sends signed `check_suite` events with the
+given concurrency and reports the throughput and latency percentiles of the
+webhook, and how long the background workers took to process every event.
+
+Usage:
+    python load_test.py --requests 500 --concurrency 50 --latency 0.2
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import multiprocessing
+import socket
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+
+WEBHOOK_SECRET = "load-test-secret"
+
+
+def make_stub_github(latency):
+    stub = FastAPI()
+    stub.state.requests = 0
+
+    @stub.get("/_stats")
+    async def stats():
+        return {"requests": stub.state.requests}
+
+    async def respond(body):
+        stub.state.requests += 1
+        await asyncio.sleep(latency)
+        return body
+
+    @stub.get("/app/installations")
+    async def installations():
+        return await respond([{"id": 1}])
+
+    @stub.post("/app/installations/{installation_id}/access_tokens")
+    async def access_token(installation_id: int):
+        expires_at = (datetime.utcnow() + timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        return await respond({"token": f"stub-token-{installation_id}", "expires_at": expires_at})
+
+    @stub.post("/repos/{owner}/{repo}/check-runs")
+    async def create_check_run(owner: str, repo: str, request: Request):
+        data = await request.json()
+        return await respond({"id": 1, "head_sha": data.get("head_sha"), "status": data.get("status")})
+
+    @stub.patch("/repos/{owner}/{repo}/check-runs/{check_run_id}")
+    async def update_check_run(owner: str, repo: str, check_run_id: int, request: Request):
+        data = await request.json()
+        return await respond({"id": check_run_id, "status": data.get("status")})
+
+    return stub
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run_stub(port, latency):
+    uvicorn.run(make_stub_github(latency), host="127.0.0.1", port=port, log_level="warning")
+
+
+def run_app(port, env):
+    # The app reads its configuration when it is imported
+    os.environ.update(env)
+    from app import app as webhook_app
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    uvicorn.run(webhook_app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def serve_in_process(target, port, *args):
+    # Not a daemon: the app starts worker processes of its own
+    process = multiprocessing.get_context("spawn").Process(target=target, args=(port,) + args)
+    process.start()
+    while True:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return process
+        except OSError:
+            if not process.is_alive():
+                raise RuntimeError("server on port %d failed to start" % port)
+            time.sleep(0.1)
+
+
+def generate_private_key():
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                             serialization.NoEncryption()).decode()
+
+
+def make_event(i, commits):
+    return json.dumps({
+        "action": "requested",
+        "installation": {"id": 1 + i % 3},
+        "check_suite": {"id": i, "head_sha": "%040x" % (i % commits)},
+        "repository": {"full_name": "owner/repo"},
+    }).encode()
+
+
+async def send_events(url, count, concurrency, commits, drain=True):
+    latencies = []
+    failures = 0
+    outcomes = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        async def send(i):
+            nonlocal failures
+            body = make_event(i, commits)
+            signature = "sha256=" + hmac.new(WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+            headers = {"X-GitHub-Event": "check_suite", "X-Hub-Signature-256": signature,
+                       "X-GitHub-Delivery": "delivery-%d" % i, "Content-Type": "application/json"}
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post(url, content=body, headers=headers)
+                latencies.append(time.perf_counter() - start)
+            if response.status_code >= 300:
+                failures += 1
+            else:
+                status = response.json()["status"]
+                outcomes[status] = outcomes.get(status, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(send(i) for i in range(count)))
+        elapsed = time.perf_counter() - start
+
+        # Wait for the workers to drain the queue
+        jobs_url = url.rsplit("/", 1)[0] + "/jobs"
+        counts = (await client.get(jobs_url)).json()
+        while drain:
+            counts = (await client.get(jobs_url)).json()
+            if not counts.get("queued") and not counts.get("running"):
+                break
+            await asyncio.sleep(0.1)
+        processed = time.perf_counter() - start
+    return elapsed, processed, counts, outcomes, sorted(latencies), failures
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook server load test against a stub GitHub API")
+    parser.add_argument('--requests', type=int, default=200, help='Number of webhook events to send')
+    parser.add_argument('--concurrency', type=int, default=20, help='Number of events in flight at once')
+    parser.add_argument('--latency', type=float, default=0.1, help='Stub GitHub API response time in seconds')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='Number of worker processes; with 0 only the webhook itself is measured')
+    parser.add_argument('--commits', type=int, default=None,
+                        help='Number of distinct head SHAs the events are spread over (default: one per event)')
+    parser.add_argument('--output', type=str, default=None, help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    stub_port = free_port()
+    stub = serve_in_process(run_stub, stub_port, args.latency)
+
+    env = {
+        "GITHUB_API_URL": f"http://127.0.0.1:{stub_port}",
+        "GITHUB_WEBHOOK_SECRET": WEBHOOK_SECRET,
+        "GITHUB_APP_IDENTIFIER": "1",
+        "GITHUB_PRIVATE_KEY": generate_private_key(),
+        "APICOV_WORKERS": str(args.workers),
+        "APICOV_JOB_DB": os.path.join(tempfile.mkdtemp(prefix="apicov-load-test-"), "jobs.db"),
+    }
+    app_port = free_port()
+    server = serve_in_process(run_app, app_port, env)
+
+    try:
+        elapsed, processed, job_counts, outcomes, latencies, failures = asyncio.run(
+            send_events(f"http://127.0.0.1:{app_port}/webhook", args.requests, args.concurrency,
+                        args.commits or args.requests, args.workers > 0))
+        github_requests = httpx.get(f"http://127.0.0.1:{stub_port}/_stats").json()["requests"]
+    finally:
+        server.terminate()
+        stub.terminate()
+    results = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "workers": args.workers,
+        "stub_latency": args.latency,
+        "failures": failures,
+        "elapsed": elapsed,
+        "throughput": args.requests / elapsed,
+        "latency_p50": percentile(latencies, 0.50),
+        "latency_p95": percentile(latencies, 0.95),
+        "latency_p99": percentile(latencies, 0.99),
+        "processing_time": processed,
+        "outcomes": outcomes,
+        "jobs": job_counts,
+        "github_requests": github_requests,
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh)
+
+
+if __name__ == "__main__":
+    main()
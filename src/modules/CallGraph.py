@@ -0,0 +1,188 @@
+from array import array
+
+from modules.logging_config import logging
+
+
+class CallGraph():
+    """
+    A compact call graph: function names interned to integer IDs and
+    de-duplicated edges stored in compressed sparse row (CSR) arrays.
+
+    The callees of function `i` are `targets[offsets[i]:offsets[i + 1]]`.
+    Only functions that had a node of their own in the call graph dump are
+    "defined"; functions that only ever appear as callees get an ID but are
+    not members of the graph, mirroring the keys of the dict form returned by
+    `CallGraphParser.parse_callgraph`.
+
+    The class also offers the read-only mapping interface of that dict form
+    (`in`, `[]`, iteration, `items()`), so it can be used wherever a
+    function -> callees mapping was used before.
+    """
+
+    def __init__(self, names, defined, offsets, targets):
+        self.names = names
+        self.defined = defined
+        self.offsets = offsets
+        self.targets = targets
+        self._ids = {name: fn_id for fn_id, name in enumerate(names)}
+
+    @classmethod
+    def from_mapping(cls, callgraph):
+        """
+        Builds a CallGraph from a function -> list of callees mapping.
+        """
+        builder = CallGraphBuilder()
+        for function, callees in callgraph.items():
+            builder.add_function(function)
+            for callee in callees:
+                builder.add_call(function, callee)
+        return builder.build()
+
+    @property
+    def num_nodes(self):
+        return len(self.names)
+
+    @property
+    def num_edges(self):
+        return len(self.targets)
+
+    def id_of(self, function):
+        return self._ids.get(function)
+
+    def name_of(self, fn_id):
+        return self.names[fn_id]
+
+    def successor_ids(self, fn_id):
+        return self.targets[self.offsets[fn_id]:self.offsets[fn_id + 1]]
+
+    def __contains__(self, function):
+        fn_id = self._ids.get(function)
+        return fn_id is not None and bool(self.defined[fn_id])
+
+    def __getitem__(self, function):
+        fn_id = self._ids.get(function)
+        if fn_id is None or not self.defined[fn_id]:
+            raise KeyError(function)
+        return [self.names[callee] for callee in self.successor_ids(fn_id)]
+
+    def __iter__(self):
+        for fn_id, name in enumerate(self.names):
+            if self.defined[fn_id]:
+                yield name
+
+    def __len__(self):
+        return sum(self.defined)
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        for name in self:
+            yield name, self[name]
+
+
+class CallGraphBuilder():
+    """
+    Accumulates functions and calls and produces a CallGraph.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._names = []
+        self._defined = bytearray()
+        self._callees = []
+
+    def _intern(self, function):
+        fn_id = self._ids.get(function)
+        if fn_id is None:
+            fn_id = len(self._names)
+            self._ids[function] = fn_id
+            self._names.append(function)
+            self._defined.append(0)
+            self._callees.append(None)
+        return fn_id
+
+    def add_function(self, function):
+        """
+        Starts (or restarts) the node of `function`, dropping calls recorded for it before.
+        """
+        fn_id = self._intern(function)
+        self._defined[fn_id] = 1
+        self._callees[fn_id] = None
+        return fn_id
+
+    def add_call(self, caller, callee):
+        caller_id = self._intern(caller)
+        callee_id = self._intern(callee)
+        callees = self._callees[caller_id]
+        if callees is None:
+            callees = self._callees[caller_id] = {}
+        callees[callee_id] = None
+
+    def build(self):
+        offsets = array("q", [0])
+        targets = array("i")
+        for callees in self._callees:
+            if callees:
+                targets.extend(callees)
+            offsets.append(len(targets))
+        graph = CallGraph(self._names, self._defined, offsets, targets)
+        logging.debug("Built call graph with %d functions and %d calls", graph.num_nodes, graph.num_edges)
+        return graph
+
+
+class MergedCallGraph(CallGraph):
+    """
+    A read-only union of several CallGraphs.
+
+    Names are re-interned into one shared ID space, but the CSR arrays of the
+    merged graphs are not copied: each part keeps its own edges and a table
+    mapping its local IDs to the shared ones, and successors are gathered
+    from every part a function appears in.
+    """
+
+    def __init__(self, graphs):
+        self.parts = []
+        names = []
+        ids = {}
+        defined = bytearray()
+        for graph in graphs:
+            to_global = array("i")
+            for fn_id, name in enumerate(graph.names):
+                global_id = ids.get(name)
+                if global_id is None:
+                    global_id = ids[name] = len(names)
+                    names.append(name)
+                    defined.append(0)
+                if graph.defined[fn_id]:
+                    defined[global_id] = 1
+                to_global.append(global_id)
+            self.parts.append((graph, to_global))
+        self.names = names
+        self.defined = defined
+        self._ids = ids
+        self._to_local = None
+
+    @property
+    def num_edges(self):
+        return sum(graph.num_edges for graph, _ in self.parts)
+
+    def _local_ids(self):
+        # Per part: shared ID -> local ID (or -1), built on first traversal
+        if self._to_local is None:
+            self._to_local = []
+            for graph, to_global in self.parts:
+                to_local = array("i", [-1]) * len(self.names)
+                for fn_id, global_id in enumerate(to_global):
+                    to_local[global_id] = fn_id
+                self._to_local.append(to_local)
+        return self._to_local
+
+    def successor_ids(self, fn_id):
+        successors = {}
+        for (graph, to_global), to_local in zip(self.parts, self._local_ids()):
+            local_id = to_local[fn_id]
+            if local_id != -1 and graph.defined[local_id]:
+                for callee in graph.successor_ids(local_id):
+                    successors[to_global[callee]] = None
+        return list(successors)
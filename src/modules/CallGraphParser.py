@@ -1,7 +1,22 @@
-import re
+import os
+import sys
+import mmap
+import struct
+import hashlib
 import logging
+from array import array
 from collections import defaultdict
 from modules.logging_config import logging 
+from modules.CallGraph import CallGraph, CallGraphBuilder
+
+# Binary cache written next to each *_callgraph.txt:
+# magic, format version, source size, source mtime (ns), source SHA-256,
+# number of functions, number of calls, size of the names blob;
+# followed by the NUL-separated names, the defined flags, and the CSR
+# offsets (int64) and targets (int32) in little-endian order.
+CACHE_MAGIC = b"APICOVCG"
+CACHE_VERSION = 1
+CACHE_HEADER = struct.Struct("<8sIQQ32sQQQ")
 
 
 class CallGraphParser():
@@ -21,20 +36,57 @@ class CallGraphParser():
     #     parse_callgraph():
     #         Parses the call graph file and creates a mapping of functions and their callees, excluding LLVM internal functions.
 
+    # Callee prefixes of LLVM internal functions ('llvm.*', '__llvm_*') and C++ mangled names ('_Z*')
+    LLVM_PREFIXES = ("llvm.", "__llvm_", "_Z")
+
+    _NODE_PREFIX = b"Call graph node for function: '"
+    _CALL_PREFIX = b"  CS<"
+    _CALL_MARKER = b"> calls function '"
+
     def __init__(self, callgraph_file):
         self._callgraph_file = callgraph_file
+        self.cache_file = callgraph_file + ".cache"
 
     def is_llvm_function(self, function_name):
         """
         Determines if a function is an LLVM internal function based on its name.
         """
-        llvm_patterns = [
-            r"^llvm\.",    # Matches 'llvm.*' functions
-            r"^__llvm_",   # Matches '__llvm_*' functions
-            r"^_Z",        # Matches C++ mangled names starting with '_Z'
-        ]
-        return any(re.match(pattern, function_name) for pattern in llvm_patterns)
+        return function_name.startswith(self.LLVM_PREFIXES)
 
+    def _quoted_name(self, line, start):
+        # Equivalent of the greedy '(.+)' in the opt output regexes
+        end = line.rfind(b"'")
+        if end <= start:
+            return None
+        return line[start:end].decode("utf-8", errors="replace")
+
+    def iter_records(self):
+        """
+        Streams the call graph file and yields ("node", function) and ("call", callee) records.
+
+        The file is memory-mapped and every line is classified with plain prefix
+        checks; LLVM internal callees are already dropped.
+        """
+        with open(self._callgraph_file, "rb") as fh:
+            if os.fstat(fh.fileno()).st_size == 0:
+                return
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                node_prefix = self._NODE_PREFIX
+                call_prefix = self._CALL_PREFIX
+                call_marker = self._CALL_MARKER
+                for line in iter(mm.readline, b""):
+                    if line.startswith(call_prefix):
+                        marker = line.find(call_marker, len(call_prefix))
+                        # CS<...> must not contain '>' before the marker
+                        if marker <= len(call_prefix) or line.find(b">", len(call_prefix)) != marker:
+                            continue
+                        callee = self._quoted_name(line, marker + len(call_marker))
+                        if callee and not self.is_llvm_function(callee):
+                            yield "call", callee
+                    elif line.startswith(node_prefix):
+                        function = self._quoted_name(line, len(node_prefix))
+                        if function:
+                            yield "node", function
 
     def parse_callgraph(self):
         """
@@ -42,21 +94,101 @@ class CallGraphParser():
         """
         callgraph = defaultdict(list)
         current_function = None
+        for kind, name in self.iter_records():
+            if kind == "node":
+                current_function = name
+                callgraph[current_function] = []
+            elif current_function:
+                callgraph[current_function].append(name)
+
+        return callgraph
+
+    def build_callgraph(self):
+        """
+        Parses the call graph file straight into a compact CallGraph.
+        """
+        builder = CallGraphBuilder()
+        current_function = None
+        for kind, name in self.iter_records():
+            if kind == "node":
+                current_function = name
+                builder.add_function(current_function)
+            elif current_function:
+                builder.add_call(current_function, name)
+        return builder.build()
+
+    def load_callgraph(self, use_cache=True):
+        """
+        Returns the call graph as a compact CallGraph.
+
+        With `use_cache` the graph is loaded from the binary cache written next to
+        the call graph file when the file is unchanged since the cache was written
+        (same size and mtime, or same size and SHA-256), and the cache is
+        (re)written after parsing otherwise.
+        """
+        if not use_cache:
+            return self.build_callgraph()
+        stat = os.stat(self._callgraph_file)
+        graph = self._read_cache(stat)
+        if graph is not None:
+            logging.debug("Loaded call graph from cache: %s", self.cache_file)
+            return graph
+        graph = self.build_callgraph()
+        self._write_cache(graph, stat)
+        return graph
+
+    def _source_digest(self):
+        digest = hashlib.sha256()
+        with open(self._callgraph_file, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.digest()
+
+    def _read_cache(self, stat):
+        try:
+            with open(self.cache_file, "rb") as fh:
+                header = fh.read(CACHE_HEADER.size)
+                if len(header) != CACHE_HEADER.size:
+                    return None
+                (magic, version, size, mtime_ns, digest, num_nodes, num_edges,
+                 names_size) = CACHE_HEADER.unpack(header)
+                if magic != CACHE_MAGIC or version != CACHE_VERSION or size != stat.st_size:
+                    return None
+                if mtime_ns != stat.st_mtime_ns and digest != self._source_digest():
+                    return None
+                names = fh.read(names_size).decode("utf-8").split("\0") if num_nodes else []
+                defined = bytearray(fh.read(num_nodes))
+                offsets = array("q")
+                offsets.frombytes(fh.read((num_nodes + 1) * offsets.itemsize))
+                targets = array("i")
+                targets.frombytes(fh.read(num_edges * targets.itemsize))
+        except (OSError, ValueError, struct.error) as e:
+            logging.debug("Ignoring call graph cache %s: %s", self.cache_file, e)
+            return None
+        if sys.byteorder != "little":
+            offsets.byteswap()
+            targets.byteswap()
+        if len(names) != num_nodes or len(offsets) != num_nodes + 1 or len(targets) != num_edges:
+            return None
+        return CallGraph(names, defined, offsets, targets)
 
-        with open(self._callgraph_file, "r") as file:
-            for line in file:
-                # Match the function definition
-                match_func = re.match(r"^Call graph node for function: '(.+)'", line)
-                if match_func:
-                    current_function = match_func.group(1)
-                    callgraph[current_function] = []
-                    continue
-
-                # Match the functions called by the current function
-                match_called = re.match(r"^  CS<[^>]+> calls function '(.+)'", line)
-                if match_called and current_function:
-                    callee = match_called.group(1)
-                    if not self.is_llvm_function(callee):  # Exclude LLVM functions
-                        callgraph[current_function].append(callee)                
-
-        return callgraph
\ No newline at end of file
+    def _write_cache(self, graph, stat):
+        names = "\0".join(graph.names).encode("utf-8")
+        offsets = array("q", graph.offsets)
+        targets = array("i", graph.targets)
+        if sys.byteorder != "little":
+            offsets.byteswap()
+            targets.byteswap()
+        header = CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, stat.st_size, stat.st_mtime_ns,
+                                   self._source_digest(), graph.num_nodes, graph.num_edges, len(names))
+        tmp_file = self.cache_file + ".tmp"
+        try:
+            with open(tmp_file, "wb") as fh:
+                fh.write(header)
+                fh.write(names)
+                fh.write(bytes(graph.defined))
+                fh.write(offsets.tobytes())
+                fh.write(targets.tobytes())
+            os.replace(tmp_file, self.cache_file)
+        except OSError as e:
+            logging.warning("Failed to write call graph cache: %s. Error: %s", self.cache_file, e)
@@ -3,63 +3,88 @@ import subprocess
 import sys
 import re
 import json
+import struct
+import tempfile
+import time
 import logging
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from modules.logging_config import logging 
+from modules.GcovIndex import GcovLogIndex, parse_gcov_log, parse_gcov_json
+from modules.GcovReader import GcovReader, GcovFormatError
+from modules.Reachability import ReachabilityIndex
+from modules.LineCoverage import LineCoverage
+from modules.ReachabilityMatrix import ReachabilityMatrix
+from modules.CallGraph import CallGraph, MergedCallGraph
+from modules.CallGraphParser import CallGraphParser
+from modules.FileScanner import FileScanner
+from modules.Shard import select_shard
+from modules.Metrics import run_process, record_processes
+
+# gcov backends: "text" scrapes `gcov -f` output saved as .gcov_log files,
+# "json" decodes gcov's JSON intermediate format in memory and "native" reads
+# the .gcno/.gcda files directly without running gcov.
+GCOV_BACKENDS = ("text", "json", "native")
+
+# Number of .gcno files passed to a single gcov process by the json backend
+GCOV_BATCH_SIZE = 256
 
 
 class LibCoverage():
 
-    def __init__(self, apis, lib_path):
+    def __init__(self, apis, lib_path, gcov_cache=None, gcov_backend="text", scanner=None, coverage_index=None):
         self._apis = apis
         self.api_coverage = {}
         self._root_dir = os.path.abspath(lib_path)
         self.api_sizes = {}
         self._fn_sizes = {}
+        # Given when the results come from elsewhere, e.g. merged shards
+        self._coverage_index = coverage_index
+        self._reachability = None
+        self._line_coverage = None
+        self.reachability_matrix = None
+        self.gcov_failures = []
+        self.gcno_files_processed = 0
+        self.gcov_cache = gcov_cache
+        self.gcov_backend = gcov_backend
+        self._scanner = scanner
     
+    @property
+    def coverage_index(self):
+        if self._coverage_index is None:
+            self._coverage_index = GcovLogIndex().build(self._root_dir)
+        return self._coverage_index
+
+    @property
+    def line_coverage(self):
+        """
+        The LineCoverage of the coverage index, or None if it has no per-line counts (text backend).
+        """
+        if self._line_coverage is None and self.coverage_index.has_line_counts:
+            self._line_coverage = LineCoverage(self.coverage_index)
+        return self._line_coverage
+
     def get_fn_size_and_cov(self, fn):
         logging.debug("Processing function: %s", fn)
-        cmd = ["grep", "-A1", "-rw", fn, "--include=*.gcov_log", self._root_dir]
-        results = subprocess.run(cmd, capture_output=True, text=True)
-        if results.returncode != 0:
-            # logging.warning("Error - grep failed for function: %s", fn)
+        records = self.coverage_index.get_union(fn)
+        if not records:
             return 0, 0
+        if all(record.executed is not None for record in records):
+            # Exact line counts are available, no need to estimate from percentages
+            return max(record.executed for record in records), max(record.lines for record in records)
         final_coverage = 0
         final_size = 0
-        temp_coverage = None
-        ignore_patterns = {"Cannot"}
-        for line in results.stdout.split('\n'):
-            if any(pattern in line for pattern in ignore_patterns):
-                continue 
-            if "Lines executed" in line:
-                # logging.debug("Line: %s", line)
-                t = line.split("Lines executed")[-1]
-                # logging.debug("T: %s", t)
-                try:
-                    coverage = t.split("%")[0].split(":")[-1].strip()
-                    # logging.debug("coverage: %s", t.split("of")[0].strip())
-                    temp_coverage = float(coverage.strip())
-                except ValueError as e:
-                    logging.warning("Failed to parse coverage from line: %s. Error: %s", line, e)
-                    temp_coverage = None
-                
-                if temp_coverage:
-                    final_coverage = max(final_coverage, temp_coverage)
-                    temp_coverage = None
-            
-            if " of " in line:
-                s_size = line.split("of")[-1].strip()
-                # logging.debug("size: %s", t.split("of")[-1].strip())
-                size = int(s_size)
-                final_size = max(final_size, size)
+        for record in records:
+            if record.percent:
+                final_coverage = max(final_coverage, record.percent)
+            final_size = max(final_size, record.lines)
 
         if final_size == 0:
             logging.error("Zero size for function: %s", fn)
 
-
         if final_coverage > 100.00:
             logging.debug("Coverage greater than 100%")
-            logging.debug("%s", results.stdout)
+            logging.debug("%s", records)
 
             covered_lines = final_size
         else:
@@ -67,22 +92,27 @@ class LibCoverage():
         
         return covered_lines, final_size
 
-    def dfs(self, function, callgraph, all_callees):
-        all_callees.append(function)
-        for callee in callgraph[function]:
-            if callee not in all_callees:
-                self.dfs(callee, callgraph, all_callees)
+    def get_reachability(self, callgraph):
+        if self._reachability is None or self._reachability.callgraph is not callgraph:
+            self._reachability = ReachabilityIndex(callgraph)
+        return self._reachability
 
     def get_api_callgraph(self, api, callgraph):
-        all_callees = []
-        if api in callgraph:
-            self.dfs(api, callgraph, all_callees)
-        
-        return all_callees
+        if api not in callgraph:
+            return []
+        return self.get_reachability(callgraph).callees(api)
 
-    def get_full_api_cov(self, api, callees):
-        total_covered_lines = 0 
-        total_size = 0 
+    def get_closure_size_and_cov(self, callees):
+        """
+        Returns (covered lines, total lines) of a set of functions.
+
+        With per-line counts the lines of all functions are unioned, so shared
+        lines count once; otherwise the per-function totals are added up.
+        """
+        if self.line_coverage is not None:
+            return self.line_coverage.coverage(callees)
+        total_covered_lines = 0
+        total_size = 0
         for call in callees:
             if call not in self._fn_sizes:
                 covered_lines, size = self.get_fn_size_and_cov(call)
@@ -92,7 +122,13 @@ class LibCoverage():
                 size = self._fn_sizes[call][1]
             total_covered_lines += covered_lines
             total_size += size
-        
+        return total_covered_lines, total_size
+
+    def get_full_api_cov(self, api, callees):
+        total_covered_lines, total_size = self.get_closure_size_and_cov(callees)
+        self.record_full_api_cov(api, total_covered_lines, total_size)
+
+    def record_full_api_cov(self, api, total_covered_lines, total_size):
         try:
             float_cov = (total_covered_lines/total_size) * 100
         except ZeroDivisionError:
@@ -116,47 +152,82 @@ class LibCoverage():
             self.api_sizes[api] = total_size        
         
     def get_api_coverage(self, api):
-        cmd = ["grep", "-A1", "-rw", api, "--include=*.gcov_log", self._root_dir]
-        results = subprocess.run(cmd, capture_output=True, text=True)
-        for line in results.stdout.split('\n'):
-            if "Cannot" in line:
-                continue
-            if "Lines executed" in line:
-                t = line.split(":")[-1]
-                coverage = t.split("of")[0].strip()
-                size = int(t.split("of")[-1].strip())
-                # logging.debug("Coverage string: %s", coverage.strip("%"))
-                float_cov = float(coverage.strip("%"))
-                # logging.debug("Float value: %r", float_cov)
-                if float_cov > 100.00:
-                    logging.warning("Error - coverage greater than 100%")
-                    logging.debug("%s", results.stdout)
-                    float_cov = 100.00
-
-                if api.endswith("_REAL"):
-                    api = api.replace("_REAL","")
-                if api in self.api_coverage:
-                    new_val = float_cov
-                    if new_val > self.api_coverage[api][0]:
-                        self.api_coverage[api] = (new_val, size)
-                else:
-                    self.api_coverage[api] = (float_cov, size)
-                
-                if api in self.api_sizes:
-                    if self.api_sizes[api] < size:
-                        self.api_sizes[api] = size
-                else:
+        for record in self.coverage_index.get_union(api):
+            float_cov = record.percent
+            size = record.lines
+            if float_cov > 100.00:
+                logging.warning("Error - coverage greater than 100%")
+                logging.debug("%s", record)
+                float_cov = 100.00
+
+            if api.endswith("_REAL"):
+                api = api.replace("_REAL","")
+            if api in self.api_coverage:
+                new_val = float_cov
+                if new_val > self.api_coverage[api][0]:
+                    self.api_coverage[api] = (new_val, size)
+            else:
+                self.api_coverage[api] = (float_cov, size)
+            
+            if api in self.api_sizes:
+                if self.api_sizes[api] < size:
                     self.api_sizes[api] = size
-            # if "No executable lines" in line:
-            #     return
+            else:
+                self.api_sizes[api] = size
     
+    def get_reachability_matrix(self, callgraph, apis):
+        """
+        Returns the API x function ReachabilityMatrix of `apis` in `callgraph`.
+        """
+        return ReachabilityMatrix.from_reachability(self.get_reachability(callgraph), apis)
+
     def populate_full_api_cov(self, callgraph, sdl=False):
+        """
+        Computes the coverage of every API over its whole call-graph closure.
+
+        All APIs are aggregated together from one API x function reachability
+        matrix: with per-line counts each row's functions are unioned line by
+        line, otherwise per-function covered lines and sizes are summed with
+        one sparse matrix-vector product each.
+        """
+        apis = []
         for api in self._apis:
             if sdl:
-                callees = self.get_api_callgraph(api+"_REAL", callgraph)
-                self.get_full_api_cov(api+"_REAL", callees)
-            callees = self.get_api_callgraph(api, callgraph)
-            self.get_full_api_cov(api, callees)
+                apis.append(api+"_REAL")
+            apis.append(api)
+        matrix = self.get_reachability_matrix(callgraph, apis)
+        self.reachability_matrix = matrix
+        names = matrix.columns
+
+        if self.line_coverage is not None:
+            results = {}
+            totals = []
+            for i in range(len(apis)):
+                # Rows of APIs sharing a closure are identical, score them once
+                row = matrix.row(i)
+                key = row.tobytes()
+                if key not in results:
+                    results[key] = self.line_coverage.coverage([names[j] for j in row])
+                totals.append(results[key])
+        else:
+            covered_vector = [0] * len(names)
+            size_vector = [0] * len(names)
+            for j in set(matrix.indices):
+                if names[j] not in self._fn_sizes:
+                    self._fn_sizes[names[j]] = self.get_fn_size_and_cov(names[j])
+                covered_vector[j], size_vector[j] = self._fn_sizes[names[j]]
+            totals = zip(matrix.matvec(covered_vector), matrix.matvec(size_vector))
+
+        for api, (total_covered_lines, total_size) in zip(apis, totals):
+            self.record_full_api_cov(api, total_covered_lines, total_size)
+
+    def get_function_reach(self):
+        """
+        Returns {function: number of APIs that reach it} from the last `populate_full_api_cov`.
+        """
+        if self.reachability_matrix is None:
+            return {}
+        return self.reachability_matrix.transpose().row_counts()
 
     def populate_entry_api_cov(self, sdl=False):
         # SDL uses macros for all APIs almost
@@ -168,12 +239,9 @@ class LibCoverage():
             self.get_api_coverage(api)
             
     def get_gcno_files(self):
-        gcno_files = []
-        for root, dirs, files in os.walk(self._root_dir):
-            for file in files:
-                if file.endswith(".gcno"):
-                    gcno_files.append(os.path.join(root, file))
-        return gcno_files
+        if self._scanner is None:
+            self._scanner = FileScanner(self._root_dir).scan()
+        return list(self._scanner.gcno_files)
 
     def filter_errors(self, lines):
         filtered_lines = []
@@ -183,23 +251,218 @@ class LibCoverage():
             filtered_lines.append(line)
         return "\n".join(filtered_lines)
 
-    def run_gcov_on_gcno_files(self):
-        gcno_files =self.get_gcno_files()
+    def run_gcov_in_dir(self, file_dir, filenames, scratch=False):
+        """
+        Runs gcov on the given `.gcno` files inside `file_dir`.
+
+        gcov -f writes its `.gcov` output into the working directory. With
+        `scratch`, the text backend runs gcov in a private temporary directory
+        with `-o file_dir` instead, so that several batches of one directory can
+        run at the same time; the `.gcov` files are thrown away, the `.gcov_log`
+        files are the same. Files whose inputs are unchanged since they were
+        cached are not run through gcov again.
+
+        Returns:
+            tuple: (failures, results) where failures are (gcno file, error) tuples
+            for every file gcov failed on and results are the gcov results (see
+            `parse_gcov_json`) of every file, both in the order of `filenames`.
+        """
+        failures = []
+        results = {}
+        pending = []
+        for filename in filenames:
+            file = os.path.join(file_dir, filename)
+            if self.gcov_cache is not None:
+                cached = self.gcov_cache.lookup(file)
+                if cached is not None:
+                    logging.debug("Using cached gcov results for: %s", file)
+                    if cached["log"] is not None:
+                        self._restore_log(file.replace(".gcno", ".gcov_log"), cached["log"])
+                    results[file] = cached
+                    continue
+            pending.append(filename)
+
+        if self.gcov_backend == "json":
+            for i in range(0, len(pending), GCOV_BATCH_SIZE):
+                self._run_gcov_json(file_dir, pending[i:i + GCOV_BATCH_SIZE], failures, results)
+        elif self.gcov_backend == "native":
+            for filename in pending:
+                self._run_gcov_native(file_dir, filename, failures, results)
+        elif scratch and pending:
+            with tempfile.TemporaryDirectory(prefix="apicov-gcov-") as cwd:
+                for filename in pending:
+                    self._run_gcov_text(file_dir, filename, failures, results, cwd)
+        else:
+            for filename in pending:
+                self._run_gcov_text(file_dir, filename, failures, results)
+        order = {os.path.join(file_dir, filename): i for i, filename in enumerate(filenames)}
+        failures.sort(key=lambda failure: order.get(failure[0], len(order)))
+        return failures, [results[file] for file in sorted(results, key=lambda file: order.get(file, len(order)))]
+
+    def _run_gcov_text(self, file_dir, filename, failures, results, cwd=None):
+        file = os.path.join(file_dir, filename)
+        logging.debug("Processing gcno file: %s", file)
+        log_file = file.replace(".gcno", ".gcov_log")
+        if cwd is None:
+            cmd = ["gcov", "-f", filename]
+        else:
+            cmd = ["gcov", "-f", "-o", file_dir, filename]
+        try:
+            p = run_process(cmd, cwd=cwd or file_dir, capture_output=True, text=True)
+        except OSError as e:
+            failures.append((file, str(e)))
+            return
+        log = self.filter_errors(p.stdout)
+        with open(log_file, "w") as fh:
+            fh.write(log)
+        result = {
+            "log": log,
+            "functions": [[function, log_file, percent, size, None]
+                          for function, percent, size in parse_gcov_log(log.splitlines())],
+            "lines": [],
+        }
+        if p.returncode != 0:
+            failures.append((file, p.stderr.strip() or "gcov exited with %d" % p.returncode))
+        elif self.gcov_cache is not None:
+            self.gcov_cache.store(file, result)
+        results[file] = result
+
+    def _run_gcov_native(self, file_dir, filename, failures, results):
+        file = os.path.join(file_dir, filename)
+        logging.debug("Reading gcno file: %s", file)
+        try:
+            result = GcovReader(file).read()
+        except (OSError, GcovFormatError, struct.error) as e:
+            failures.append((file, str(e)))
+            return
+        if self.gcov_cache is not None:
+            self.gcov_cache.store(file, result)
+        results[file] = result
+
+    def _run_gcov_json(self, file_dir, filenames, failures, results):
+        """
+        Runs one gcov process in JSON intermediate mode over `filenames` and decodes
+        its output as it is streamed, one JSON document per object file.
+        """
+        logging.debug("Processing %d gcno files in: %s", len(filenames), file_dir)
+        cmd = ["gcov", "--json-format", "--stdout"] + filenames
+        seen = set()
+        with tempfile.TemporaryFile(mode="w+") as stderr:
+            start = time.perf_counter()
+            try:
+                proc = subprocess.Popen(cmd, cwd=file_dir, stdout=subprocess.PIPE, stderr=stderr, text=True)
+            except OSError as e:
+                failures.extend((os.path.join(file_dir, filename), str(e)) for filename in filenames)
+                return
+            with proc:
+                for line in proc.stdout:
+                    if not line.strip():
+                        continue
+                    try:
+                        doc = json.loads(line)
+                    except ValueError as e:
+                        logging.warning("Failed to decode gcov JSON output in %s: %s", file_dir, e)
+                        continue
+                    file = os.path.join(file_dir, doc.get("data_file", ""))
+                    seen.add(file)
+                    result = parse_gcov_json(doc, file_dir)
+                    if self.gcov_cache is not None:
+                        self.gcov_cache.store(file, result)
+                    results[file] = result
+            record_processes(time.perf_counter() - start)
+            stderr.seek(0)
+            errors = stderr.read()
+        for filename in filenames:
+            file = os.path.join(file_dir, filename)
+            if file not in seen:
+                error = "\n".join(line for line in errors.splitlines() if line.startswith(filename[:-len(".gcno")]))
+                failures.append((file, error or "gcov exited with %d" % proc.returncode))
+
+    def _restore_log(self, log_file, log):
+        try:
+            with open(log_file, "r") as fh:
+                if fh.read() == log:
+                    return
+        except OSError:
+            pass
+        with open(log_file, "w") as fh:
+            fh.write(log)
+
+    def run_gcov_on_gcno_files(self, jobs=1, shard_index=0, shard_count=1):
+        """
+        Runs gcov on every `.gcno` file under the root directory and writes a `.gcov_log` next to each.
+
+        The function summaries of every log are indexed as they are produced, so
+        the coverage lookups that follow don't need to read the logs back.
+
+        Args:
+            jobs (int): The number of gcov batches to run at the same time, see `split_gcno_dirs`.
+            shard_index (int), shard_count (int): Only process this shard of the `.gcno` files,
+                see `select_shard`.
+        """
+        gcno_files = self.get_gcno_files()
+        if shard_count > 1:
+            gcno_files = select_shard(gcno_files, self._root_dir, shard_index, shard_count)
+            logging.info("Shard %d/%d: %d gcno files", shard_index, shard_count, len(gcno_files))
+        self.gcno_files_processed = len(gcno_files)
+        gcno_dirs = {}
         for file in gcno_files:
-            file_dir = os.path.split(file)[0]
-            filename = os.path.split(file)[-1]
+            file_dir, filename = os.path.split(file)
             logging.debug("FileName: %s", filename)
             if filename.startswith("."):
                 continue
-            logging.debug("Processing gcno file: %s", file)
-            log_file = file.replace(".gcno", ".gcov_log")
-            cmd = ["gcov", "-f", filename]
-            p = subprocess.run(cmd, cwd=file_dir, capture_output=True, text=True)
-            with open(log_file, "w") as fh:
-                fh.write(self.filter_errors(p.stdout))
+            gcno_dirs.setdefault(file_dir, []).append(filename)
+
+        self.gcov_failures = []
+        index = GcovLogIndex()
+        tasks = split_gcno_dirs(gcno_dirs, jobs)
+        if jobs > 1 and len(tasks) > 1:
+            logging.info("Running gcov in %d batches from %d directories with %d jobs", len(tasks), len(gcno_dirs),
+                         jobs)
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                dir_results = list(executor.map(lambda task: self.run_gcov_in_dir(*task), tasks))
+        else:
+            dir_results = [self.run_gcov_in_dir(file_dir, filenames) for file_dir, filenames in gcno_dirs.items()]
+        for failures, results in dir_results:
+            self.gcov_failures.extend(failures)
+            for result in results:
+                index.add_result(result)
+
+        if self.gcov_failures:
+            logging.warning("gcov failed on %d of %d gcno files",
+                            len(self.gcov_failures), sum(len(f) for f in gcno_dirs.values()))
+            for file, error in self.gcov_failures:
+                logging.warning("  %s: %s", file, error)
+        if self.gcov_cache is not None:
+            logging.info("gcov cache: %d hits, %d misses", self.gcov_cache.hits, self.gcov_cache.misses)
+            self.gcov_cache.save()
+        self._coverage_index = index
+
+
+def split_gcno_dirs(gcno_dirs, jobs):
+    """
+    Splits {directory: [.gcno file names]} into (directory, file names, scratch) batches for `jobs` workers.
+
+    A directory with more than its share of the files (all of them divided by
+    `jobs`), e.g. the one CMake puts all objects of a target in, is split into
+    batches of that size, which run gcov in scratch directories (see
+    `LibCoverage.run_gcov_in_dir`). Batches keep the order of the files.
+    """
+    total = sum(len(filenames) for filenames in gcno_dirs.values())
+    size = max(1, -(-total // max(jobs, 1)))
+    tasks = []
+    for file_dir, filenames in gcno_dirs.items():
+        if len(filenames) <= size:
+            tasks.append((file_dir, filenames, False))
+            continue
+        for i in range(0, len(filenames), size):
+            tasks.append((file_dir, filenames[i:i + size], True))
+    return tasks
 
 
 def merge_callgraphs(callgraphs):
+    if callgraphs and all(isinstance(graph, CallGraph) for graph in callgraphs):
+        return MergedCallGraph(callgraphs)
     merged = {}
     for graph in callgraphs:
         for api in graph:
@@ -222,7 +485,7 @@ if __name__ == "__main__":
         if os.path.exists(callgraph_file):
             logging.debug("Processing callgraph file: %s", callgraph_file)
             g = CallGraphParser(callgraph_file)
-            callgraphs.append(g.parse_callgraph())
+            callgraphs.append(g.load_callgraph())
     
     callgraph = merge_callgraphs(callgraphs)
 
@@ -240,3 +503,5 @@ if __name__ == "__main__":
         json.dump(c.api_coverage, fh)
     with open('api_sizes.json', 'w') as fh:
         json.dump(c.api_sizes, fh)
+    with open('function_reach.json', 'w') as fh:
+        json.dump(c.get_function_reach(), fh)
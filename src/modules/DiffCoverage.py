@@ -0,0 +1,142 @@
+import os
+import re
+import bisect
+import subprocess
+from collections import defaultdict
+
+from modules.logging_config import logging
+from modules.Metrics import run_process
+
+# "@@ -12,3 +14,5 @@": the new side starts at line 14 and spans 5 lines (1 when the count is left out)
+_HUNK_RE = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@")
+
+
+class DiffError(Exception):
+    pass
+
+
+def get_changed_lines(repo_dir, ref):
+    """
+    Returns {absolute source path: [(first line, last line), ...]} of what changed in the working tree since `ref`.
+
+    Line numbers are those of the current files, which are what the coverage data
+    refers to. A hunk that only deletes lines marks the lines on both sides of
+    the deletion. Deleted files are left out.
+
+    Raises:
+        DiffError: If `repo_dir` isn't in a git repository or `ref` doesn't exist.
+    """
+    try:
+        toplevel = run_process(["git", "rev-parse", "--show-toplevel"], cwd=repo_dir,
+                               capture_output=True, text=True, check=True).stdout.strip()
+        diff = run_process(["git", "diff", "--no-color", "--no-ext-diff", "--unified=0", ref, "--"],
+                           cwd=repo_dir, capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise DiffError("git diff against %s failed: %s" % (ref, getattr(e, "stderr", None) or e))
+
+    changes = defaultdict(list)
+    current = None
+    for line in diff.splitlines():
+        if line.startswith("+++ "):
+            path = line[4:]
+            current = None if path == "/dev/null" else os.path.realpath(os.path.join(toplevel, path[2:]))
+            continue
+        if current is None:
+            continue
+        match = _HUNK_RE.match(line)
+        if match:
+            start = int(match.group(1))
+            count = int(match.group(2)) if match.group(2) is not None else 1
+            if count == 0:
+                changes[current].append((start, start + 1))
+            else:
+                changes[current].append((start, start + count - 1))
+    return dict(changes)
+
+
+def find_changed_functions(changed_lines, coverage_index):
+    """
+    Returns the functions of `coverage_index` whose lines overlap `changed_lines` (see `get_changed_lines`).
+
+    A function spans its first to its last executable line as recorded by gcov.
+    """
+    extents = defaultdict(list)
+    for function, source, first, last in coverage_index.function_extents():
+        path = os.path.realpath(source)
+        if path in changed_lines:
+            extents[path].append((first, last, function))
+
+    changed = set()
+    for path, functions in extents.items():
+        functions.sort()
+        starts = [first for first, _, _ in functions]
+        for first, last in changed_lines[path]:
+            # Functions starting after the change can't overlap it
+            for f_first, f_last, function in functions[:bisect.bisect_right(starts, last)]:
+                if f_last >= first:
+                    changed.add(function)
+    return changed
+
+
+def find_affected_apis(apis, changed_functions, reachability_matrix=None):
+    """
+    Returns the APIs, in the order of `apis`, that are changed or reach a changed function.
+
+    Args:
+        apis (list): All APIs.
+        changed_functions (set): Functions whose implementation changed.
+        reachability_matrix (ReachabilityMatrix): API x function matrix of the call graph, whose
+            transpose maps each changed function back to every API that reaches it. Without it
+            only the changed APIs themselves are affected.
+    """
+    affected = set(api for api in apis if api in changed_functions)
+    if reachability_matrix is not None:
+        reverse = reachability_matrix.transpose()
+        column_of = {name: j for j, name in enumerate(reachability_matrix.columns)}
+        for function in changed_functions:
+            j = column_of.get(function)
+            if j is not None:
+                affected.update(reachability_matrix.rows[i] for i in reverse.row(j))
+    return [api for api in apis if api in affected]
+
+
+def select_delta_apis(apis, baseline, current, affected_apis=None):
+    """
+    Returns the APIs that belong in api_coverage_delta.json: those of `apis`, in order, that are in
+    `affected_apis`, missing from `baseline` or whose coverage or size differs from it, followed by
+    the APIs of `baseline` that are no longer APIs. `affected_apis` None selects every API.
+    """
+    affected = set(apis if affected_apis is None else affected_apis)
+    listed = set(apis)
+    selected = []
+    for api in apis:
+        new = current.get(api)
+        old = baseline.get(api)
+        if api in affected or not new or not old or \
+                new["Cov"][0] != old["Cov"][0] or new["Size"] != old["Size"]:
+            selected.append(api)
+    dropped = sorted(api for api in baseline if api not in listed)
+    return selected + dropped
+
+
+def coverage_deltas(baseline, current, apis):
+    """
+    Returns {api: {"Cov", "Size", "BaselineCov", "BaselineSize", "Delta"}} for `apis`, comparing
+    `api_coverage.json` entries of the current run with those of the baseline. APIs missing on
+    either side have None there and no delta.
+    """
+    deltas = {}
+    for api in apis:
+        new = current.get(api)
+        old = baseline.get(api)
+        entry = {
+            "Cov": new["Cov"][0] if new else None,
+            "Size": new["Size"] if new else None,
+            "BaselineCov": old["Cov"][0] if old else None,
+            "BaselineSize": old["Size"] if old else None,
+        }
+        entry["Delta"] = entry["Cov"] - entry["BaselineCov"] if new and old else None
+        deltas[api] = entry
+    logging.info("Coverage changed for %d of %d reported APIs",
+                 sum(1 for entry in deltas.values() if entry["Delta"]), len(deltas))
+    return deltas
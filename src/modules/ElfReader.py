@@ -0,0 +1,217 @@
+import mmap
+import struct
+from collections import namedtuple
+
+# Section header types
+SHT_NOTE = 7
+SHT_DYNSYM = 11
+SHT_GNU_VERDEF = 0x6ffffffd
+SHT_GNU_VERSYM = 0x6fffffff
+
+# Section header flags
+SHF_EXECINSTR = 0x4
+
+# Special section indexes
+SHN_UNDEF = 0
+SHN_LORESERVE = 0xff00
+
+# Symbol bindings and types
+STB_GLOBAL = 1
+STT_GNU_IFUNC = 10
+
+# Note types
+NT_GNU_BUILD_ID = 3
+
+VERSYM_HIDDEN = 0x8000
+VER_NDX_GLOBAL = 1
+
+ElfSymbol = namedtuple("ElfSymbol", ["name", "value", "size", "type", "bind", "shndx", "version", "hidden"])
+
+
+class ElfError(ValueError):
+    pass
+
+
+class ElfReader():
+    """
+    A minimal reader for the dynamic symbol table of ELF shared objects.
+
+    The file is memory-mapped and `.dynsym`, `.dynstr` and the GNU symbol
+    versioning sections are decoded in place, so listing the exports of a
+    library needs neither `nm` nor any other external process.
+
+    Usage:
+        with ElfReader("libfoo.so") as elf:
+            for name, version, hidden in elf.iter_exported_functions():
+                ...
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fh = None
+        self._mm = None
+        self._sections = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self):
+        self._fh = open(self.path, "rb")
+        try:
+            self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.close()
+            raise ElfError("%s: empty file" % self.path)
+        self._parse_header()
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def _parse_header(self):
+        mm = self._mm
+        if len(mm) < 16 or mm[:4] != b"\x7fELF":
+            raise ElfError("%s: not an ELF file" % self.path)
+        ei_class, ei_data = mm[4], mm[5]
+        if ei_class not in (1, 2) or ei_data not in (1, 2):
+            raise ElfError("%s: unsupported ELF class or data encoding" % self.path)
+        self._is64 = ei_class == 2
+        self._endian = "<" if ei_data == 1 else ">"
+        e = self._endian
+        if self._is64:
+            self._shoff, = struct.unpack_from(e + "Q", mm, 0x28)
+            self._shentsize, self._shnum, self._shstrndx = struct.unpack_from(e + "HHH", mm, 0x3A)
+            self._shdr_fmt = e + "IIQQQQIIQQ"
+            self._sym_fmt = e + "IBBHQQ"
+        else:
+            self._shoff, = struct.unpack_from(e + "I", mm, 0x20)
+            self._shentsize, self._shnum, self._shstrndx = struct.unpack_from(e + "HHH", mm, 0x2E)
+            self._shdr_fmt = e + "IIIIIIIIII"
+            self._sym_fmt = e + "IIIBBH"
+
+    @property
+    def sections(self):
+        """
+        The section headers as (type, flags, offset, size, link, entsize) tuples.
+        """
+        if self._sections is None:
+            self._sections = []
+            if self._shoff and self._shoff + self._shnum * self._shentsize > len(self._mm):
+                raise ElfError("%s: truncated section header table" % self.path)
+            for i in range(self._shnum if self._shoff else 0):
+                (_, sh_type, sh_flags, _, sh_offset, sh_size, sh_link, _, _,
+                 sh_entsize) = struct.unpack_from(self._shdr_fmt, self._mm, self._shoff + i * self._shentsize)
+                self._sections.append((sh_type, sh_flags, sh_offset, sh_size, sh_link, sh_entsize))
+        return self._sections
+
+    def _find_section(self, sh_type):
+        for section in self.sections:
+            if section[0] == sh_type:
+                return section
+        return None
+
+    def _string(self, strtab_offset, offset):
+        start = strtab_offset + offset
+        end = self._mm.find(b"\0", start)
+        return self._mm[start:end].decode("utf-8", errors="replace")
+
+    def get_build_id(self):
+        """
+        Returns the GNU build ID of the file as a hex string, or None if it has none.
+        """
+        e = self._endian
+        for sh_type, _, offset, size, _, _ in self.sections:
+            if sh_type != SHT_NOTE:
+                continue
+            end = offset + size
+            while offset + 12 <= end:
+                namesz, descsz, n_type = struct.unpack_from(e + "III", self._mm, offset)
+                name_start = offset + 12
+                desc_start = name_start + ((namesz + 3) & ~3)
+                if n_type == NT_GNU_BUILD_ID and self._mm[name_start:name_start + namesz] == b"GNU\0":
+                    return self._mm[desc_start:desc_start + descsz].hex()
+                offset = desc_start + ((descsz + 3) & ~3)
+        return None
+
+    def _version_names(self):
+        """
+        Maps version indexes to the names defined in `.gnu.version_d`.
+        """
+        names = {}
+        verdef = self._find_section(SHT_GNU_VERDEF)
+        if verdef is None:
+            return names
+        _, _, offset, size, link, _ = verdef
+        strtab_offset = self.sections[link][2]
+        e = self._endian
+        end = offset + size
+        while offset < end:
+            _, _, vd_ndx, vd_cnt, _, vd_aux, vd_next = struct.unpack_from(e + "HHHHIII", self._mm, offset)
+            if vd_cnt:
+                vda_name, = struct.unpack_from(e + "I", self._mm, offset + vd_aux)
+                names[vd_ndx] = self._string(strtab_offset, vda_name)
+            if not vd_next:
+                break
+            offset += vd_next
+        return names
+
+    def iter_dynamic_symbols(self):
+        """
+        Yields an ElfSymbol for every entry of `.dynsym` except the null symbol.
+        """
+        dynsym = self._find_section(SHT_DYNSYM)
+        if dynsym is None:
+            return
+        _, _, offset, size, link, entsize = dynsym
+        strtab_offset = self.sections[link][2]
+        entsize = entsize or struct.calcsize(self._sym_fmt)
+        count = size // entsize
+
+        versym = self._find_section(SHT_GNU_VERSYM)
+        versions = None
+        if versym is not None:
+            versions = struct.unpack_from("%s%dH" % (self._endian, count), self._mm, versym[2])
+        version_names = self._version_names()
+
+        for i in range(1, count):
+            if self._is64:
+                st_name, st_info, _, st_shndx, st_value, st_size = struct.unpack_from(
+                    self._sym_fmt, self._mm, offset + i * entsize)
+            else:
+                st_name, st_value, st_size, st_info, _, st_shndx = struct.unpack_from(
+                    self._sym_fmt, self._mm, offset + i * entsize)
+            version = None
+            hidden = False
+            if versions is not None:
+                ndx = versions[i] & ~VERSYM_HIDDEN
+                if ndx > VER_NDX_GLOBAL:
+                    version = version_names.get(ndx)
+                    hidden = bool(versions[i] & VERSYM_HIDDEN)
+            yield ElfSymbol(self._string(strtab_offset, st_name), st_value, st_size,
+                            st_info & 0xf, st_info >> 4, st_shndx, version, hidden)
+
+    def iter_exported_functions(self):
+        """
+        Yields (name, version, hidden) for every global symbol defined in an executable section.
+
+        This is the set of symbols `nm -D --defined-only` reports with type "T".
+        `version` is None for unversioned symbols and `hidden` is True for
+        non-default versions (printed by nm as `name@VER` rather than `name@@VER`).
+        """
+        sections = self.sections
+        for sym in self.iter_dynamic_symbols():
+            if sym.bind != STB_GLOBAL or sym.type == STT_GNU_IFUNC:
+                continue
+            if sym.shndx == SHN_UNDEF or sym.shndx >= SHN_LORESERVE or sym.shndx >= len(sections):
+                continue
+            if not sections[sym.shndx][1] & SHF_EXECINSTR:
+                continue
+            yield sym.name, sym.version, sym.hidden
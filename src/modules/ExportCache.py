@@ -0,0 +1,173 @@
+import os
+import json
+import struct
+import hashlib
+import threading
+
+from modules.logging_config import logging
+from modules.ElfReader import ElfReader, ElfError
+
+
+class ExportCache():
+    """
+    A persistent cache of library exports and of the APIs filtered from them.
+
+    The exports of a library are stored under its ELF build ID (or, for
+    libraries without one, the SHA-256 of the file), so an unchanged binary is
+    not read again. The API list is stored under a hash of the exported
+    symbols together with the path and content of every installed header,
+    so when neither the libraries nor the headers changed the API list is
+    reused without indexing the headers. Header hashes are remembered with
+    the size and mtime of each header and only recomputed for headers whose
+    size or mtime changed. Only the entries used by the last run are saved, so
+    the cache doesn't grow with every change.
+
+    Attributes:
+        hits (int): Number of lookups answered from the cache.
+        misses (int): Number of lookups that had to be computed.
+    """
+
+    MANIFEST = "manifest.json"
+    FORMAT_VERSION = 1
+
+    def __init__(self, cache_dir):
+        self._cache_dir = os.path.abspath(cache_dir)
+        self._manifest_file = os.path.join(self._cache_dir, self.MANIFEST)
+        self._libraries = {}
+        self._apis = {}
+        self._headers = {}
+        self._used = set()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def load(self):
+        try:
+            with open(self._manifest_file, "r") as fh:
+                manifest = json.load(fh)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.warning("Ignoring unreadable export cache manifest: %s. Error: %s", self._manifest_file, e)
+            return
+        if manifest.get("format") != self.FORMAT_VERSION:
+            logging.info("Export cache format changed, invalidating export cache")
+            self._dirty = True
+            return
+        self._libraries = manifest.get("libraries", {})
+        self._apis = manifest.get("apis", {})
+        self._headers = manifest.get("headers", {})
+
+    def save(self):
+        if not self._dirty:
+            return
+        os.makedirs(self._cache_dir, exist_ok=True)
+        used = self._used
+        manifest = {
+            "format": self.FORMAT_VERSION,
+            "libraries": {key: value for key, value in self._libraries.items() if key in used},
+            "apis": {key: value for key, value in self._apis.items() if key in used},
+            "headers": {key: value for key, value in self._headers.items() if key in used},
+        }
+        tmp_file = self._manifest_file + ".tmp"
+        with open(tmp_file, "w") as fh:
+            json.dump(manifest, fh)
+        os.replace(tmp_file, self._manifest_file)
+        self._dirty = False
+
+    def invalidate(self):
+        """
+        Drops every cached result, on disk as well as in memory.
+        """
+        with self._lock:
+            self._libraries = {}
+            self._apis = {}
+            self._headers = {}
+            self._dirty = False
+        try:
+            os.remove(self._manifest_file)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _hash_file(path):
+        digest = hashlib.sha256()
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def library_key(self, shared_lib):
+        """
+        Returns the key of `shared_lib`: its build ID, or the hash of its content.
+        """
+        try:
+            with ElfReader(shared_lib) as elf:
+                build_id = elf.get_build_id()
+        except (OSError, ElfError, struct.error):
+            build_id = None
+        if build_id is not None:
+            return "build-id:" + build_id
+        return "sha256:" + self._hash_file(shared_lib)
+
+    def _header_hash(self, header):
+        st = os.stat(header)
+        with self._lock:
+            self._used.add(header)
+        recorded = self._headers.get(header)
+        if recorded is not None and recorded[:2] == [st.st_size, st.st_mtime_ns]:
+            return recorded[2]
+        digest = self._hash_file(header)
+        with self._lock:
+            self._headers[header] = [st.st_size, st.st_mtime_ns, digest]
+            self._dirty = True
+        return digest
+
+    def api_key(self, symbols, headers):
+        """
+        Returns the key of an API filtering run over `symbols` with the given installed `headers`.
+        """
+        digest = hashlib.sha256()
+        for symbol in symbols:
+            digest.update(symbol.encode() + b"\0")
+        digest.update(b"\0")
+        for header in headers:
+            digest.update(header.encode() + b"\0")
+            digest.update(self._header_hash(header).encode())
+        return digest.hexdigest()
+
+    def _lookup(self, entries, key):
+        result = entries.get(key)
+        with self._lock:
+            self._used.add(key)
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result
+
+    def _store(self, entries, key, value):
+        with self._lock:
+            entries[key] = value
+            self._used.add(key)
+            self._dirty = True
+
+    def lookup_exports(self, key):
+        """
+        Returns the cached exported symbols of the library with `key`, or None.
+        """
+        return self._lookup(self._libraries, key)
+
+    def store_exports(self, key, symbols):
+        self._store(self._libraries, key, list(symbols))
+
+    def lookup_apis(self, key):
+        """
+        Returns the cached {"apis": [...], "api_headers": {...}} of an API filtering run, or None.
+        """
+        return self._lookup(self._apis, key)
+
+    def store_apis(self, key, apis, api_headers):
+        self._store(self._apis, key, {"apis": list(apis), "api_headers": dict(api_headers)})
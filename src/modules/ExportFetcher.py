@@ -3,33 +3,104 @@ import os
 import sys
 import logging
 import json
+import struct
 import subprocess
+import time
 
 from modules.logging_config import logging 
+from modules.HeaderIndex import HeaderIndex
+from modules.FileScanner import FileScanner
+from modules.ElfReader import ElfReader, ElfError
+from modules.Metrics import record_processes
+from concurrent.futures import ProcessPoolExecutor
+
+# Libraries are read serially below this total size: starting and stopping a process pool
+# takes ~15ms, what reading ~4 MiB of libraries takes (~300 MB/s), so smaller sets can't win much
+PARALLEL_MIN_BYTES = 32 * 1024 * 1024
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def read_exports(shared_lib):
+    """
+    Reads the exported functions of `shared_lib` as `ExportFetcher.get_exports_from_lib` keeps them.
+
+    Returns:
+        tuple: (list of symbols, None), or (None, error message) if the library can't be read.
+    """
+    logging.debug("Reading dynamic symbols of: %s", shared_lib)
+    symbols = []
+    try:
+        with ElfReader(shared_lib) as elf:
+            # Keep the order `nm` listed the symbols in (sorted by name)
+            exports = sorted(elf.iter_exported_functions(), key=lambda sym: sym[0].encode())
+            for symbol, version, hidden in exports:
+                if symbol.find("operator") != -1:
+                    continue
+                if symbol.find("mangle_path") != -1:
+                    continue
+                if version and hidden:
+                    symbol = symbol + "@" + version
+                symbols.append(symbol)
+    except (OSError, ElfError, struct.error) as e:
+        return None, str(e)
+    return symbols, None
 
 class ExportFetcher(object):
-    def __init__(self, project_dir):
+    def __init__(self, project_dir, scanner=None, export_cache=None):
         self.symbols = []
+        self._symbol_set = set()
+        # Symbol -> shared library it was first found in
+        self.symbol_libraries = {}
         self.apis = []
         self._root_dir = os.path.abspath(project_dir)
+        self._scanner = scanner
+        self.export_cache = export_cache
         self.headers = []
+        self.api_headers = {}
+        self._header_indexes = {}
+
+    def get_header_index(self, install_dir, headers=None):
+        install_dir = os.path.abspath(install_dir)
+        if install_dir not in self._header_indexes:
+            self._header_indexes[install_dir] = HeaderIndex(install_dir).build(headers)
+        return self._header_indexes[install_dir]
 
     def grep_for_symbol(self, symbol, install_dir):
-        for root, _, files in os.walk(install_dir):
-            for file in files:
-                if file.endswith(".h") or file.endswith(".hpp") or file.endswith(".hxx"):
-                    header = os.path.join(root, file)
-                    logging.debug("Searching for symbol: %s in header: %s", symbol, header)
-                    cmd = ["grep", "-rw", symbol, header]
-                    result = subprocess.run(cmd, capture_output=True, text=True)
-                    if result.returncode == 0:
-                        logging.debug("Adding Api: %s", symbol)
-                        self.apis.append(symbol)
-                        return
-
-    def filter_non_apis(self, install_dir):
+        header = self.get_header_index(install_dir).find_header(symbol)
+        if header:
+            logging.debug("Adding Api: %s (declared in %s)", symbol, header)
+            self.apis.append(symbol)
+            self.api_headers[symbol] = header
+
+    def filter_non_apis(self, install_dir, headers=None):
+        key = None
+        if self.export_cache is not None:
+            if headers is None:
+                headers = FileScanner(install_dir).scan().headers
+            key = self.export_cache.api_key(self.symbols, headers)
+            cached = self.export_cache.lookup_apis(key)
+            if cached is not None:
+                logging.info("Using cached API list (%d APIs)", len(cached["apis"]))
+                self.apis.extend(cached["apis"])
+                self.api_headers.update(cached["api_headers"])
+                return
+        self._filter_non_apis(install_dir, headers)
+        if key is not None:
+            self.export_cache.store_apis(key, self.apis, self.api_headers)
+
+    def _filter_non_apis(self, install_dir, headers):
+        index = self.get_header_index(install_dir, headers)
+        start = time.perf_counter()
         for symbol in self.symbols:
-            self.grep_for_symbol(symbol, os.path.abspath(install_dir))
+            self.grep_for_symbol(symbol, install_dir)
+        logging.info("Looked up %d symbols in %.2fs (header indexing took %.2fs)",
+                     len(self.symbols), time.perf_counter() - start, index.index_time)
 
     def find_functions_in_file(self, file_data):
         pattern = r'(?:\s*(static\s+|inline\s+|virtual\s+)?)?([\w\s*]+?)\s+([\w_]+)\s*\(([^)]*)\)\s*(?:const)?\s*(?:volatile)?\s*;'
@@ -68,61 +139,102 @@ class ExportFetcher(object):
     def crawl_dir(self, dir, compile_commands):
         self._walk_dir(dir, compile_commands)
 
-    def _add_symbol(self, symbol):
-        if symbol not in self.symbols:
+    def _add_symbol(self, symbol, shared_lib=None):
+        # `symbols` keeps the order symbols were found in, the set makes this O(1)
+        if symbol not in self._symbol_set:
+            self._symbol_set.add(symbol)
             self.symbols.append(symbol)
- 
+            if shared_lib is not None:
+                self.symbol_libraries[symbol] = shared_lib
+
+    def _lookup_cached_exports(self, shared_lib):
+        """
+        Returns (cache key, cached exports or None); the key is None without a cache and False if `shared_lib`
+        can't be read.
+        """
+        if self.export_cache is None:
+            return None, None
+        try:
+            key = self.export_cache.library_key(shared_lib)
+        except OSError as e:
+            logging.warning("Failed to read exports from: %s. Error: %s", shared_lib, e)
+            return False, None
+        return key, self.export_cache.lookup_exports(key)
+
     def get_exports_from_lib(self, shared_lib):
         """
-        Extracts exported symbols from a shared library using the `nm` and `grep` commands.
+        Extracts exported symbols from a shared library by reading its ELF dynamic symbol table.
 
         Args:
             shared_lib (str): The path to the shared library file.
 
         Returns:
-            str: The output from the `grep` command containing the filtered symbols.
-
-        Raises:
-            subprocess.CalledProcessError: If either the `nm` or `grep` command fails.
+            int: 0 if the library was read successfully, 1 otherwise.
 
         Notes:
-            - This function uses the `nm` command to list symbols from the shared library.
-            - The `grep` command filters the symbols to include only those with a " T " type.
-            - C++ symbols are further processed to extract demangled names.
+            - Only global symbols defined in an executable section are kept (`nm -D` type "T").
+            - Default symbol versions are dropped, non-default ones are kept as `name@VERSION`.
             - Symbols containing "operator" or "mangle_path" are ignored.
         """
-        nm_command = ["nm", "-D", "--defined-only", shared_lib]
-        grep_command = ["grep", " T "]
-        logging.debug("Running: %s", ' '.join(nm_command))
-        proc1 = subprocess.run(nm_command, stdout=subprocess.PIPE)
-        logging.debug("Running: %s", ''.join(grep_command))
-        proc2 = subprocess.run(grep_command, input=proc1.stdout.decode('utf-8'), capture_output=True, text=True)
-        for line in proc2.stdout.split('\n'):
-            if line.find("operator") != -1:
+        return self.get_exports_from_libs([shared_lib])[0]
+
+    def get_exports_from_libs(self, shared_libs, jobs=1):
+        """
+        Extracts the exported symbols of several shared libraries, reading up to `jobs` of them at once.
+
+        With `jobs` > 1, libraries adding up to PARALLEL_MIN_BYTES or more are read in
+        a process pool; with `jobs` <= 1 they are always read in this process. Their
+        symbols are added in the order of `shared_libs`, so the result is the same as
+        reading them one by one.
+        Each new symbol is recorded in `symbol_libraries` with the library it was
+        first found in.
+
+        Returns:
+            list: 0 or 1 per library, as returned by `get_exports_from_lib`.
+        """
+        keys = []
+        exports = [None] * len(shared_libs)
+        pending = []
+        for i, shared_lib in enumerate(shared_libs):
+            key, cached = self._lookup_cached_exports(shared_lib)
+            keys.append(key)
+            if cached is not None:
+                logging.debug("Using cached exports of: %s", shared_lib)
+                exports[i] = cached
+            elif key is not False:
+                pending.append(i)
+
+        pending_libs = [shared_libs[i] for i in pending]
+        if jobs <= 1 or len(pending_libs) < 2:
+            parallel = False
+        else:
+            parallel = sum(_file_size(shared_lib) for shared_lib in pending_libs) >= PARALLEL_MIN_BYTES
+        if parallel:
+            logging.info("Reading exports of %d libraries with %d jobs", len(pending_libs), jobs)
+            workers = min(jobs, len(pending_libs))
+            start = time.perf_counter()
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(read_exports, pending_libs))
+            record_processes((time.perf_counter() - start) * workers, count=workers)
+        else:
+            results = [read_exports(shared_lib) for shared_lib in pending_libs]
+        for i, (symbols, error) in zip(pending, results):
+            if error is not None:
+                logging.warning("Failed to read exports from: %s. Error: %s", shared_libs[i], error)
                 continue
-            if line.find("mangle_path") != -1:
+            exports[i] = symbols
+            if keys[i] is not None:
+                self.export_cache.store_exports(keys[i], symbols)
+
+        status = []
+        for shared_lib, symbols in zip(shared_libs, exports):
+            if symbols is None:
+                status.append(1)
                 continue
-            # This is a c++ symbol
-            if line.find("@@") != -1:
-                line = line.split("@@")[0]
-
-            line = line.strip()
-            if "::" in line:
-                # if line.find("operator") != -1:
-                #     continue
-                pattern= r'\w+::(\w+)[\(\[]'
-                regex = re.compile(pattern, re.M)
-                matches = regex.findall(line)
-                for symbol in matches:
-                    self._add_symbol(symbol)
-            elif line:
-                symbol = line.split()[-1]
-                if symbol == '':
-                    continue
-                self._add_symbol(symbol)
-       # proc2 = subprocess.Popen(grep_command, stdin=proc1.stdout, stdout=subprocess.PIPE)
-        # proc1.stdout.close()
-        return proc2.returncode
+            for symbol in symbols:
+                self._add_symbol(symbol, shared_lib)
+            status.append(0)
+        return status
 
     def find_build_dir(self):
         """
@@ -138,9 +250,10 @@ class ExportFetcher(object):
                 return potential_dir
 
         # Recursively search for specific build system files
-        for dirpath, _, filenames in os.walk(self._root_dir):
-            if 'CMakeCache.txt' in filenames or 'build.ninja' in filenames:
-                return dirpath
+        if self._scanner is None:
+            self._scanner = FileScanner(self._root_dir).scan()
+        if self._scanner.build_dirs:
+            return self._scanner.build_dirs[0]
 
         return self._root_dir
                     
@@ -0,0 +1,118 @@
+import os
+import re
+import time
+from fnmatch import fnmatch
+
+from modules.logging_config import logging
+
+HEADER_EXTENSIONS = (".h", ".hpp", ".hxx")
+BUILD_MARKERS = ("CMakeCache.txt", "build.ninja")
+# libfoo.so, libfoo.so.1, libfoo.so.1.2.3
+SHARED_LIB_RE = re.compile(r"\.so(\.\d+)*$")
+
+# Directories that never hold anything of interest and can be huge
+DEFAULT_PRUNE = (".git", ".hg", ".svn", "node_modules", "__pycache__")
+# gcov's annotated sources, written next to every object it processed
+DEFAULT_IGNORE = ("*.gcov",)
+
+
+class FileScanner():
+    """
+    Walks a directory tree once with `os.scandir` and sorts the files every stage needs by kind.
+
+    Directories are visited top-down like `os.walk` (without following
+    symlinked directories), with hidden directories after the others.
+    Directories whose name matches a prune pattern are not entered and files
+    whose name matches an ignore pattern are skipped.
+
+    Usage:
+        scanner = FileScanner(project_dir).scan()
+        for gcno_file in scanner.gcno_files:
+            ...
+
+    Attributes:
+        shared_libs (list): Shared libraries, `.so` files with or without a version suffix.
+        headers (list): `.h`, `.hpp` and `.hxx` files.
+        gcno_files (list): `.gcno` files.
+        gcda_files (list): `.gcda` files.
+        gcov_logs (list): `.gcov_log` files.
+        build_dirs (list): Directories containing a build system marker (`CMakeCache.txt`, `build.ninja`).
+        scan_time (float): Seconds the last scan took.
+        files_seen (int): Files the last scan looked at, not counting ignored ones.
+    """
+
+    def __init__(self, root_dir, prune=DEFAULT_PRUNE, ignore=DEFAULT_IGNORE):
+        self.root_dir = os.path.abspath(root_dir)
+        self.prune = tuple(prune)
+        self.ignore = tuple(ignore)
+        self.scan_time = 0.0
+        self.files_seen = 0
+        self._reset()
+
+    def _reset(self):
+        self.shared_libs = []
+        self.headers = []
+        self.gcno_files = []
+        self.gcda_files = []
+        self.gcov_logs = []
+        self.build_dirs = []
+
+    def _matches(self, name, patterns):
+        return any(fnmatch(name, pattern) for pattern in patterns)
+
+    def scan(self):
+        """
+        (Re)scans the tree and returns self.
+        """
+        start = time.perf_counter()
+        self._reset()
+        files_seen = 0
+        todo = [self.root_dir]
+        while todo:
+            dirpath = todo.pop()
+            try:
+                with os.scandir(dirpath) as it:
+                    entries = list(it)
+            except OSError as e:
+                logging.debug("Skipping unreadable directory: %s. Error: %s", dirpath, e)
+                continue
+            subdirs = []
+            has_marker = False
+            for entry in entries:
+                name = entry.name
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    if not entry.is_symlink() and not self._matches(name, self.prune):
+                        subdirs.append(entry.path)
+                    continue
+                if self.ignore and self._matches(name, self.ignore):
+                    continue
+                files_seen += 1
+                self._classify(entry.path, name)
+                if name in BUILD_MARKERS:
+                    has_marker = True
+            if has_marker:
+                self.build_dirs.append(dirpath)
+            # Visited in reverse from the stack: the others first, then hidden ones
+            hidden = [d for d in subdirs if os.path.basename(d).startswith(".")]
+            visible = [d for d in subdirs if not os.path.basename(d).startswith(".")]
+            todo.extend(reversed(visible + hidden))
+        self.scan_time = time.perf_counter() - start
+        self.files_seen = files_seen
+        logging.info("Scanned %d files under %s in %.2fs", files_seen, self.root_dir, self.scan_time)
+        return self
+
+    def _classify(self, path, name):
+        if SHARED_LIB_RE.search(name):
+            self.shared_libs.append(path)
+        elif name.endswith(HEADER_EXTENSIONS):
+            self.headers.append(path)
+        elif name.endswith(".gcno"):
+            self.gcno_files.append(path)
+        elif name.endswith(".gcda"):
+            self.gcda_files.append(path)
+        elif name.endswith(".gcov_log"):
+            self.gcov_logs.append(path)
@@ -0,0 +1,216 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+
+from modules.logging_config import logging
+from modules.Metrics import run_process
+
+
+class GcovCache():
+    """
+    A persistent cache of gcov results keyed on the content of each object's `.gcno`/`.gcda` pair.
+
+    The manifest records, per `.gcno` file, the size, mtime and SHA-256 of the
+    `.gcno` and its `.gcda`. The gcov result for it (the log and the
+    per-function and per-line records parsed from it) is kept in a file of its
+    own under `objects/`, written when it is stored and read when it is looked
+    up, so a run only rewrites the results that changed. An object is a hit
+    when both files still have the recorded size and mtime, or the same size
+    and hash; gcov then doesn't need to run again. Only the objects looked up
+    or stored by the last run are saved, so entries of deleted or no longer
+    built objects are dropped. The whole cache is dropped when the gcov
+    version changes.
+
+    Attributes:
+        hits (int): Number of lookups answered from the cache.
+        misses (int): Number of lookups that need gcov to run.
+    """
+
+    MANIFEST = "manifest.json"
+    OBJECTS_DIR = "objects"
+    FORMAT_VERSION = 3
+
+    def __init__(self, cache_dir, gcov_version=None):
+        self._cache_dir = os.path.abspath(cache_dir)
+        self._manifest_file = os.path.join(self._cache_dir, self.MANIFEST)
+        self._objects_dir = os.path.join(self._cache_dir, self.OBJECTS_DIR)
+        self.gcov_version = gcov_version or self.get_gcov_version()
+        self._entries = {}
+        self._used = set()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    @staticmethod
+    def get_gcov_version():
+        try:
+            p = run_process(["gcov", "--version"], capture_output=True, text=True)
+        except OSError:
+            return "unknown"
+        return p.stdout.split("\n")[0].strip()
+
+    def load(self):
+        try:
+            with open(self._manifest_file, "r") as fh:
+                manifest = json.load(fh)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.warning("Ignoring unreadable gcov cache manifest: %s. Error: %s", self._manifest_file, e)
+            return
+        if manifest.get("format") != self.FORMAT_VERSION or manifest.get("gcov_version") != self.gcov_version:
+            logging.info("gcov version or cache format changed, invalidating gcov cache")
+            self._dirty = True
+            return
+        self._entries = manifest.get("entries", {})
+
+    def save(self):
+        entries = {gcno_file: entry for gcno_file, entry in self._entries.items() if gcno_file in self._used}
+        if not self._dirty and len(entries) == len(self._entries):
+            return
+        os.makedirs(self._cache_dir, exist_ok=True)
+        manifest = {
+            "format": self.FORMAT_VERSION,
+            "gcov_version": self.gcov_version,
+            "entries": entries,
+        }
+        tmp_file = self._manifest_file + ".tmp"
+        with open(tmp_file, "w") as fh:
+            json.dump(manifest, fh)
+        os.replace(tmp_file, self._manifest_file)
+        self._entries = entries
+        self._dirty = False
+        self._remove_unused_objects()
+
+    def _remove_unused_objects(self):
+        keep = set(self._object_name(gcno_file) for gcno_file in self._entries)
+        try:
+            names = os.listdir(self._objects_dir)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if name not in keep:
+                try:
+                    os.remove(os.path.join(self._objects_dir, name))
+                except OSError as e:
+                    logging.debug("Failed to remove cached gcov result %s: %s", name, e)
+
+    def invalidate(self):
+        """
+        Drops every cached result, on disk as well as in memory.
+        """
+        with self._lock:
+            self._entries = {}
+            self._dirty = False
+        try:
+            os.remove(self._manifest_file)
+        except FileNotFoundError:
+            pass
+        shutil.rmtree(self._objects_dir, ignore_errors=True)
+
+    @staticmethod
+    def _object_name(gcno_file):
+        return hashlib.sha256(gcno_file.encode()).hexdigest() + ".json"
+
+    def _read_object(self, gcno_file):
+        try:
+            with open(os.path.join(self._objects_dir, self._object_name(gcno_file)), "r") as fh:
+                return json.load(fh)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning("Ignoring unreadable cached gcov result of %s: %s", gcno_file, e)
+            return None
+
+    def _write_object(self, gcno_file, result):
+        os.makedirs(self._objects_dir, exist_ok=True)
+        object_file = os.path.join(self._objects_dir, self._object_name(gcno_file))
+        tmp_file = object_file + ".tmp"
+        with open(tmp_file, "w") as fh:
+            json.dump(result, fh)
+        os.replace(tmp_file, object_file)
+
+    @staticmethod
+    def _hash_file(path):
+        digest = hashlib.sha256()
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _stat(path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return [st.st_size, st.st_mtime_ns]
+
+    def _fingerprint(self, path, stat):
+        if stat is None:
+            return None
+        return stat + [self._hash_file(path)]
+
+    def _check(self, path, recorded):
+        """
+        Compares `path` with its `recorded` fingerprint.
+
+        Returns:
+            tuple: (unchanged, current fingerprint). The file is only hashed when
+            its size matches but its mtime doesn't.
+        """
+        stat = self._stat(path)
+        if stat is None or recorded is None:
+            return stat is None and recorded is None, None
+        if stat[0] != recorded[0]:
+            return False, None
+        if stat[1] == recorded[1]:
+            return True, recorded
+        fingerprint = self._fingerprint(path, stat)
+        return fingerprint[2] == recorded[2], fingerprint
+
+    def lookup(self, gcno_file):
+        """
+        Returns the cached gcov result of `gcno_file`, or None if its inputs changed.
+        """
+        gcda_file = gcno_file[:-len(".gcno")] + ".gcda"
+        entry = self._entries.get(gcno_file)
+        result = None
+        if entry is not None:
+            gcno_ok, gcno = self._check(gcno_file, entry["gcno"])
+            gcda_ok, gcda = self._check(gcda_file, entry["gcda"]) if gcno_ok else (False, None)
+            if gcno_ok and gcda_ok:
+                result = self._read_object(gcno_file)
+            if result is not None:
+                if gcno is not entry["gcno"] or gcda is not entry["gcda"]:
+                    # Touched but identical content: remember the new mtimes
+                    with self._lock:
+                        entry["gcno"], entry["gcda"] = gcno, gcda
+                        self._dirty = True
+        with self._lock:
+            self._used.add(gcno_file)
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result
+
+    def store(self, gcno_file, result):
+        """
+        Records the gcov result of `gcno_file`: its log (if any) and the per-function
+        and per-line records parsed from it.
+        """
+        gcda_file = gcno_file[:-len(".gcno")] + ".gcda"
+        entry = {
+            "gcno": self._fingerprint(gcno_file, self._stat(gcno_file)),
+            "gcda": self._fingerprint(gcda_file, self._stat(gcda_file)),
+        }
+        self._write_object(gcno_file, result)
+        with self._lock:
+            self._entries[gcno_file] = entry
+            self._used.add(gcno_file)
+            self._dirty = True
@@ -0,0 +1,195 @@
+import os
+import time
+from collections import defaultdict, namedtuple
+
+from modules.logging_config import logging
+from modules.FileScanner import FileScanner
+
+# The gcov summary of one function in one object file. `source` is the source
+# file of the function (or, for gcov -f logs, the log file the entry was read
+# from), `percent` the executed line percentage, `lines` the number of
+# executable lines and `executed` the exact number of executed lines when the
+# backend reports it (None for gcov -f logs, which only give a percentage).
+FunctionRecord = namedtuple("FunctionRecord", ["source", "percent", "lines", "executed"], defaults=(None,))
+
+_FUNCTION_PREFIX = "Function '"
+_LINES_PREFIX = "Lines executed:"
+
+
+def parse_gcov_log(lines):
+    """
+    Yields (function, percent, lines) for every "Function '<name>'" entry of a gcov -f log.
+    """
+    function = None
+    for line in lines:
+        if line.startswith(_FUNCTION_PREFIX):
+            function = line[len(_FUNCTION_PREFIX):line.rfind("'")]
+            continue
+        if function is None:
+            continue
+        if line.startswith(_LINES_PREFIX):
+            t = line[len(_LINES_PREFIX):]
+            try:
+                percent = float(t.split("%")[0].strip())
+                size = int(t.split(" of ")[-1].strip())
+            except ValueError as e:
+                logging.warning("Failed to parse coverage from line: %s. Error: %s", line.strip(), e)
+            else:
+                yield function, percent, size
+        function = None
+
+
+def parse_gcov_json(doc, file_dir):
+    """
+    Converts one document of `gcov --json-format --stdout` into a gcov result.
+
+    Returns:
+        dict: {"log": None, "functions": [[function, source, percent, lines, executed], ...],
+        "lines": [[function, source, [[line, count], ...]], ...]} with absolute source paths.
+    """
+    cwd = doc.get("current_working_directory") or file_dir
+    functions = []
+    line_counts = []
+    for file in doc.get("files", []):
+        source = os.path.normpath(os.path.join(cwd, file["file"]))
+        per_function = defaultdict(dict)
+        for line in file.get("lines", []):
+            name = line.get("function_name")
+            if name is None:
+                continue
+            counts = per_function[name]
+            counts[line["line_number"]] = counts.get(line["line_number"], 0) + line["count"]
+        for function in file.get("functions", []):
+            counts = per_function.get(function["name"])
+            if not counts:
+                continue
+            executed = sum(1 for count in counts.values() if count > 0)
+            functions.append([function["name"], source, executed * 100.0 / len(counts), len(counts), executed])
+        for name, counts in per_function.items():
+            line_counts.append([name, source, sorted(counts.items())])
+    return {"log": None, "functions": functions, "lines": line_counts}
+
+
+class GcovLogIndex():
+    """
+    An in-memory index of every function summary in the `.gcov_log` files of a tree.
+
+    The logs are streamed once and each "Function '<name>'" / "Lines executed" pair
+    is stored under the function name, so coverage lookups are dictionary lookups
+    instead of a `grep -r` over the whole project per function. Results of the
+    gcov JSON backend are added with `add_result`, which also keeps per-line
+    execution counts.
+    """
+
+    def __init__(self):
+        self._records = defaultdict(list)
+        self._line_counts = defaultdict(dict)
+        self.logs_indexed = 0
+        self.index_time = 0.0
+
+    def build(self, root_dir):
+        """
+        Indexes all `.gcov_log` files found under `root_dir`.
+        """
+        gcov_logs = FileScanner(root_dir).scan().gcov_logs
+        start = time.perf_counter()
+        for log_file in gcov_logs:
+            self.add_log(log_file)
+        self.index_time = time.perf_counter() - start
+        logging.info("Indexed %d gcov logs (%d functions) in %.2fs",
+                     self.logs_indexed, len(self._records), self.index_time)
+        return self
+
+    def add_log(self, log_file):
+        try:
+            with open(log_file, "r", errors="replace") as fh:
+                self.add_log_lines(fh, log_file)
+        except OSError as e:
+            logging.warning("Failed to read gcov log: %s. Error: %s", log_file, e)
+
+    def add_log_lines(self, lines, source):
+        """
+        Parses the lines of a gcov -f log and records the function summaries it contains.
+        """
+        self.add_records(source, parse_gcov_log(lines))
+
+    def add_records(self, source, records):
+        """
+        Records (function, percent, lines) summaries that were read from `source`.
+        """
+        self.logs_indexed += 1
+        for function, percent, size in records:
+            self._records[function].append(FunctionRecord(source, percent, size))
+
+    def add_result(self, result):
+        """
+        Records a gcov result (see `parse_gcov_json`) of one object file.
+        """
+        self.logs_indexed += 1
+        for function, source, percent, size, executed in result["functions"]:
+            self._records[function].append(FunctionRecord(source, percent, size, executed))
+        for function, source, counts in result["lines"]:
+            file_counts = self._line_counts[function].setdefault(source, {})
+            for line, count in counts:
+                file_counts[line] = file_counts.get(line, 0) + count
+
+    @property
+    def has_line_counts(self):
+        """
+        True if per-line execution counts were recorded (json and native backends).
+        """
+        return bool(self._line_counts)
+
+    def get_line_counts(self, function):
+        """
+        Returns {source: {line: execution count}} for `function`, summed over all objects.
+        """
+        return self._line_counts.get(function, {})
+
+    def iter_line_counts(self):
+        """
+        Yields (function, {source: {line: execution count}}) for every function with per-line counts.
+        """
+        return iter(self._line_counts.items())
+
+    def function_extents(self):
+        """
+        Yields (function, source, first line, last line) of the executable lines of every function
+        with per-line counts, once per source file it has lines in.
+        """
+        for function, sources in self._line_counts.items():
+            for source, counts in sources.items():
+                if counts:
+                    yield function, source, min(counts), max(counts)
+
+    def get(self, function):
+        """
+        Returns all records for `function`, one per log it appears in.
+        """
+        return self._records.get(function, [])
+
+    def get_union(self, function):
+        """
+        Returns the records of `function` with its lines unioned over all objects.
+
+        With per-line counts there is one record per source file of the function,
+        in which a line is executed if any object executed it, so a function
+        compiled into several objects (e.g. a static function of a header) gets
+        the coverage of all of them together rather than that of the best one.
+        Without them these are the records of `get`.
+        """
+        sources = self._line_counts.get(function)
+        if not sources:
+            return self.get(function)
+        records = []
+        for source, counts in sorted(sources.items()):
+            if counts:
+                executed = sum(1 for count in counts.values() if count > 0)
+                records.append(FunctionRecord(source, executed * 100.0 / len(counts), len(counts), executed))
+        return records
+
+    def __contains__(self, function):
+        return function in self._records
+
+    def __len__(self):
+        return len(self._records)
@@ -0,0 +1,430 @@
+import os
+import struct
+from collections import namedtuple
+
+from modules.logging_config import logging
+
+GCNO_MAGIC = 0x67636e6f  # "gcno"
+GCDA_MAGIC = 0x67636461  # "gcda"
+
+TAG_FUNCTION = 0x01000000
+TAG_BLOCKS = 0x01410000
+TAG_ARCS = 0x01430000
+TAG_LINES = 0x01450000
+TAG_ARC_COUNTS = 0x01a10000
+
+ARC_ON_TREE = 1
+ARC_FAKE = 2
+
+ENTRY_BLOCK = 0
+EXIT_BLOCK = 1
+
+Arc = namedtuple("Arc", ["src", "dst", "flags"])
+
+
+class GcovFormatError(ValueError):
+    pass
+
+
+class GcovFunction():
+    """
+    One function of a `.gcno` file: its basic blocks, the arcs between them and
+    the source lines of each block.
+    """
+
+    def __init__(self, ident, lineno_checksum, cfg_checksum, name, artificial, source, start_line, end_line):
+        self.ident = ident
+        self.lineno_checksum = lineno_checksum
+        self.cfg_checksum = cfg_checksum
+        self.name = name
+        self.artificial = artificial
+        self.source = source
+        self.start_line = start_line
+        self.end_line = end_line
+        self.num_blocks = 0
+        self.arcs = []
+        # block -> list of (source, [line, ...])
+        self.block_lines = {}
+        self.counts = None
+
+
+class _RecordFile():
+    """
+    Reads the word-oriented gcov note/data file format.
+
+    Since GCC 12 record lengths and string lengths are in bytes; before that
+    they are in 4-byte words and strings are padded to a word boundary.
+    """
+
+    def __init__(self, path, magic):
+        with open(path, "rb") as fh:
+            self.data = fh.read()
+        self.path = path
+        self.pos = 0
+        if len(self.data) < 12:
+            raise GcovFormatError("%s: truncated file" % path)
+        for endian in ("<", ">"):
+            if struct.unpack_from(endian + "I", self.data, 0)[0] == magic:
+                self.endian = endian
+                break
+        else:
+            raise GcovFormatError("%s: bad magic" % path)
+        self.pos = 4
+        version = self.unsigned()
+        self.gcc_major = self.version_major(version)
+        self.byte_lengths = self.gcc_major >= 12
+        self.stamp = self.unsigned()
+        if self.byte_lengths:
+            self.checksum = self.unsigned()
+
+    @staticmethod
+    def version_major(version):
+        # Versions are encoded as e.g. "B22*" for GCC 12.2
+        c1 = (version >> 24) & 0xff
+        c2 = (version >> 16) & 0xff
+        if c1 >= ord("A"):
+            return (c1 - ord("A")) * 10 + c2 - ord("0")
+        return c1 - ord("0")
+
+    def at_end(self):
+        return self.pos + 8 > len(self.data)
+
+    def unsigned(self):
+        value, = struct.unpack_from(self.endian + "I", self.data, self.pos)
+        self.pos += 4
+        return value
+
+    def signed(self):
+        value, = struct.unpack_from(self.endian + "i", self.data, self.pos)
+        self.pos += 4
+        return value
+
+    def counter(self):
+        lo, hi = struct.unpack_from(self.endian + "II", self.data, self.pos)
+        self.pos += 8
+        value = lo | (hi << 32)
+        return value - (1 << 64) if value >= 1 << 63 else value
+
+    def string(self):
+        length = self.unsigned()
+        if not length:
+            return None
+        size = length if self.byte_lengths else length * 4
+        raw = self.data[self.pos:self.pos + size]
+        self.pos += size
+        return raw.split(b"\0", 1)[0].decode("utf-8", errors="replace")
+
+    def record_length(self, length):
+        return length if self.byte_lengths else length * 4
+
+
+class GcovReader():
+    """
+    Computes per-function line coverage directly from a `.gcno`/`.gcda` pair.
+
+    This reads the same records gcov does (functions, blocks, arcs, lines and
+    arc counters), solves the flow graph for the arcs that are not
+    instrumented, and counts executable and executed lines per function the
+    way `gcov -f` does, without starting gcov or writing any files.
+
+    Usage:
+        result = GcovReader("foo.gcno").read()
+    """
+
+    # Stands in for the gcov version in the gcov cache; bump it when results change
+    VERSION = "apicov-gcov-reader 2"
+
+    def __init__(self, gcno_file):
+        self.gcno_file = gcno_file
+        self.gcda_file = gcno_file[:-len(".gcno")] + ".gcda"
+        self.cwd = None
+        self.functions = []
+
+    def read(self):
+        """
+        Returns the gcov result of the object in the same form as `parse_gcov_json`.
+        """
+        self.read_notes()
+        if os.path.exists(self.gcda_file):
+            self.read_data()
+        else:
+            logging.debug("%s: no data file, assuming not executed", self.gcda_file)
+        return self.summarize()
+
+    def _absolute(self, source):
+        return os.path.normpath(os.path.join(self.cwd or os.path.dirname(self.gcno_file), source))
+
+    def read_notes(self):
+        f = _RecordFile(self.gcno_file, GCNO_MAGIC)
+        if f.gcc_major >= 8:
+            self.cwd = f.string()
+            f.unsigned()  # has_unexecuted_blocks
+        fn = None
+        while not f.at_end():
+            tag = f.unsigned()
+            length = f.record_length(f.unsigned())
+            end = f.pos + length
+            if tag == TAG_FUNCTION:
+                ident, lineno_checksum, cfg_checksum = f.unsigned(), f.unsigned(), f.unsigned()
+                name = f.string()
+                artificial = f.unsigned() if f.gcc_major >= 8 else 0
+                source = f.string()
+                start_line = f.unsigned()
+                end_line = start_line
+                if f.gcc_major >= 8:
+                    f.unsigned()  # start column
+                    end_line = f.unsigned()
+                fn = GcovFunction(ident, lineno_checksum, cfg_checksum, name, artificial,
+                                  self._absolute(source), start_line, end_line)
+                self.functions.append(fn)
+            elif fn is None:
+                pass
+            elif tag == TAG_BLOCKS:
+                fn.num_blocks = f.unsigned() if f.gcc_major >= 8 else length // 4
+            elif tag == TAG_ARCS:
+                src = f.unsigned()
+                while f.pos < end:
+                    dst, flags = f.unsigned(), f.unsigned()
+                    fn.arcs.append(Arc(src, dst, flags))
+            elif tag == TAG_LINES:
+                block = f.unsigned()
+                locations = fn.block_lines.setdefault(block, [])
+                lines = None
+                while f.pos < end:
+                    line = f.unsigned()
+                    if line:
+                        if lines is None:
+                            lines = []
+                            locations.append((fn.source, lines))
+                        lines.append(line)
+                        continue
+                    source = f.string()
+                    if source is None:
+                        break
+                    lines = []
+                    locations.append((self._absolute(source), lines))
+                # gcov sorts the lines of every location, which decides the line a block is placed on
+                for _, lines in locations:
+                    lines.sort()
+            f.pos = end
+
+    def read_data(self):
+        f = _RecordFile(self.gcda_file, GCDA_MAGIC)
+        by_ident = {fn.ident: fn for fn in self.functions}
+        fn = None
+        while not f.at_end():
+            tag = f.unsigned()
+            raw_length = f.signed()
+            if tag == TAG_ARC_COUNTS and raw_length < 0:
+                # GCC 12+ writes all-zero counters as a negative length only
+                if fn is not None:
+                    fn.counts = [0] * (-raw_length // 8)
+                continue
+            length = f.record_length(raw_length)
+            end = f.pos + length
+            if tag == TAG_FUNCTION:
+                fn = None
+                if length:
+                    ident, lineno_checksum, cfg_checksum = f.unsigned(), f.unsigned(), f.unsigned()
+                    fn = by_ident.get(ident)
+                    if fn is not None and (fn.lineno_checksum != lineno_checksum
+                                           or fn.cfg_checksum != cfg_checksum):
+                        logging.warning("%s: profile mismatch for '%s'", self.gcda_file, fn.name)
+                        fn = None
+            elif tag == TAG_ARC_COUNTS and fn is not None:
+                counts = [f.counter() for _ in range(length // 8)]
+                if fn.counts is None:
+                    fn.counts = counts
+                else:
+                    fn.counts = [a + b for a, b in zip(fn.counts, counts)]
+            f.pos = end
+
+    def solve_flow_graph(self, fn):
+        """
+        Returns the execution count of every block and every arc of `fn`.
+
+        Only arcs off the spanning tree carry counters; the others are derived
+        from flow conservation (in-flow == count == out-flow) until every block
+        is known, as gcov's solve_flow_graph does.
+        """
+        n = fn.num_blocks
+        arc_counts = [None] * len(fn.arcs)
+        succ = [[] for _ in range(n)]
+        pred = [[] for _ in range(n)]
+        for i, arc in enumerate(fn.arcs):
+            succ[arc.src].append(i)
+            pred[arc.dst].append(i)
+        counts = fn.counts or []
+        next_counter = 0
+        for block in range(n):
+            for i in succ[block]:
+                if not fn.arcs[i].flags & ARC_ON_TREE:
+                    arc_counts[i] = counts[next_counter] if next_counter < len(counts) else 0
+                    next_counter += 1
+
+        block_counts = [None] * n
+        changed = True
+        while changed:
+            changed = False
+            for block in range(n):
+                out_unknown = [i for i in succ[block] if arc_counts[i] is None]
+                in_unknown = [i for i in pred[block] if arc_counts[i] is None]
+                if block_counts[block] is None:
+                    # The entry block's count can't be deduced from its (missing)
+                    # predecessors, nor the exit block's from its successors
+                    if not out_unknown and block != EXIT_BLOCK:
+                        block_counts[block] = sum(arc_counts[i] for i in succ[block])
+                    elif not in_unknown and block != ENTRY_BLOCK:
+                        block_counts[block] = sum(arc_counts[i] for i in pred[block])
+                    else:
+                        continue
+                    changed = True
+                total = block_counts[block]
+                if len(out_unknown) == 1:
+                    i = out_unknown[0]
+                    arc_counts[i] = total - sum(arc_counts[j] for j in succ[block] if j != i)
+                    changed = True
+                if len(in_unknown) == 1:
+                    i = in_unknown[0]
+                    if arc_counts[i] is None:
+                        arc_counts[i] = total - sum(arc_counts[j] for j in pred[block] if j != i)
+                        changed = True
+
+        if any(count is None for count in block_counts):
+            logging.warning("%s: graph is unsolvable for '%s'", self.gcno_file, fn.name)
+        return [count or 0 for count in block_counts], [count or 0 for count in arc_counts]
+
+    @staticmethod
+    def _line_count(blocks, graphs):
+        """
+        Returns how often a line was executed, given the (function, block) pairs on it.
+
+        As in gcov, this is the flow entering the line's blocks from elsewhere
+        plus the flow around every elementary cycle that stays on the line
+        (loops written on a single line), rather than the sum of block counts.
+        """
+        on_line = set(blocks)
+        count = 0
+        cycle_counts = {}
+        for fn_index, block in blocks:
+            arcs, arc_counts, succ, pred = graphs[fn_index]
+            for i in pred[block]:
+                if (fn_index, arcs[i].src) not in on_line:
+                    count += arc_counts[i]
+            for i in succ[block]:
+                cycle_counts[(fn_index, i)] = arc_counts[i]
+
+        def successors(fn_index, v, start):
+            arcs = graphs[fn_index][0]
+            for i in graphs[fn_index][2][v]:
+                w = arcs[i].dst
+                if w >= start and cycle_counts.get((fn_index, i), 0) > 0 and (fn_index, w) in on_line:
+                    yield i, w
+
+        def unblock(v, blocked):
+            if v in blocked:
+                for u in blocked.pop(v):
+                    unblock(u, blocked)
+
+        def circuit(fn_index, v, start, path, blocked):
+            nonlocal count
+            found = False
+            blocked[v] = []
+            for i, w in successors(fn_index, v, start):
+                path.append((fn_index, i))
+                if w == start:
+                    cycle = min(cycle_counts[arc] for arc in path)
+                    count += cycle
+                    for arc in path:
+                        cycle_counts[arc] -= cycle
+                    found = found or cycle > 0
+                elif w not in blocked:
+                    found = circuit(fn_index, w, start, path, blocked) or found
+                path.pop()
+            if found:
+                unblock(v, blocked)
+            else:
+                for _, w in successors(fn_index, v, start):
+                    if v not in blocked[w]:
+                        blocked[w].append(v)
+            return found
+
+        for fn_index, block in blocks:
+            circuit(fn_index, block, block, [], {})
+        return count
+
+    def summarize(self):
+        """
+        Counts executable and executed lines per function, and how often each line ran.
+
+        Like gcov, a line is attributed to the first function that covers it,
+        unless several functions start on the same line (template instances),
+        in which case each of them counts the line.
+        """
+        starts = {}
+        for fn in self.functions:
+            if not fn.artificial:
+                starts[(fn.source, fn.start_line)] = starts.get((fn.source, fn.start_line), 0) + 1
+
+        graphs = []
+        shared_lines = {}
+        # (function or source, line) -> [block count sum, [(function, block) on the line]]
+        line_info = {}
+        functions = []
+        touched = []
+        for fn in self.functions:
+            if fn.artificial:
+                continue
+            fn_index = len(graphs)
+            block_counts, arc_counts = self.solve_flow_graph(fn)
+            succ = [[] for _ in range(fn.num_blocks)]
+            pred = [[] for _ in range(fn.num_blocks)]
+            for i, arc in enumerate(fn.arcs):
+                succ[arc.src].append(i)
+                pred[arc.dst].append(i)
+            for arcs in succ:
+                arcs.sort(key=lambda i: fn.arcs[i].dst)
+            graphs.append((fn.arcs, arc_counts, succ, pred))
+
+            in_group = starts[(fn.source, fn.start_line)] > 1
+            own_lines = {}
+            executable = 0
+            executed = 0
+            fn_lines = {}
+            for block in range(fn.num_blocks):
+                count = block_counts[block]
+                info = None
+                for source, lines in fn.block_lines.get(block, []):
+                    own_source = in_group and source == fn.source
+                    source_lines = shared_lines.setdefault(source, {})
+                    for line in lines:
+                        if own_source and fn.start_line <= line <= fn.end_line:
+                            state, key = own_lines, (fn_index, line)
+                        else:
+                            state, key = source_lines, (source, line)
+                        previous = state.get(line)
+                        if previous is None:
+                            executable += 1
+                        if not previous and count:
+                            executed += 1
+                        state[line] = (previous or 0) + count
+                        info = line_info.setdefault(key, [0, []])
+                        info[0] += count
+                        fn_lines.setdefault(source, {})[line] = info
+                # gcov only places a block on the last of its lines, and never
+                # the entry block or the last (return) block
+                if info is not None and block != ENTRY_BLOCK and block != fn.num_blocks - 1:
+                    info[1].append((fn_index, block))
+            if executable:
+                functions.append([fn.name, fn.source, executed * 100.0 / executable, executable, executed])
+            touched.append((fn.name, fn_lines))
+
+        line_records = []
+        for name, fn_lines in touched:
+            for source, lines in fn_lines.items():
+                counts = []
+                for line, info in sorted(lines.items()):
+                    total, blocks = info
+                    counts.append([line, self._line_count(blocks, graphs) if blocks else total])
+                line_records.append([name, source, counts])
+        return {"log": None, "functions": functions, "lines": line_records}
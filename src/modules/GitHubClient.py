@@ -0,0 +1,135 @@
+import asyncio
+import random
+import time
+
+import httpx
+
+from modules.logging_config import logging
+
+# Responses worth retrying: server errors and rate limiting
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Methods that can be sent twice without doing twice as much. A POST that timed out or got a
+# server error may still have been carried out (e.g. created a check run), so it isn't resent
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "PATCH", "DELETE")
+# Failures before the request reached GitHub, which are safe to retry for any method
+UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class GitHubClient():
+    """
+    A shared asynchronous client for the GitHub REST API.
+
+    One `httpx.AsyncClient` is kept for the life of the server so TLS
+    connections are pooled and reused, at most `max_concurrency` requests are
+    in flight at a time, every request has a timeout, and requests failing
+    with a server error or a (secondary) rate limit are retried with
+    exponential backoff and jitter, honouring `Retry-After` and
+    `X-RateLimit-Reset` when GitHub sends them. Timeouts and server errors are
+    only retried for idempotent methods; a POST is only resent when it was
+    rate limited or never reached GitHub, so it can't create anything twice.
+
+    Requests made with an `installation_id` take its token from `tokens` (an
+    InstallationTokenCache). When GitHub answers one with a 401, because the
+    token was revoked or expired early, the token is invalidated and the
+    request is sent once more with a new one.
+
+    Usage:
+        client = GitHubClient("https://api.github.com")
+        client.tokens = InstallationTokenCache(app_id, private_key, client)
+        check_run = await client.post("/repos/o/r/check-runs", installation_id=installation_id, json=data)
+        await client.aclose()
+    """
+
+    def __init__(self, api_url="https://api.github.com", max_concurrency=20, timeout=10.0,
+                 max_retries=4, backoff=0.5, max_backoff=30.0, transport=None, tokens=None):
+        self.api_url = api_url.rstrip("/")
+        self.tokens = tokens
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client = httpx.AsyncClient(
+            base_url=self.api_url,
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+            headers={"Accept": "application/vnd.github.v3+json"},
+            transport=transport,
+        )
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    @staticmethod
+    def _is_rate_limited(response):
+        if response.status_code == 429:
+            return True
+        # GitHub reports primary and secondary rate limits as 403s
+        return response.status_code == 403 and (
+            response.headers.get("x-ratelimit-remaining") == "0" or "retry-after" in response.headers)
+
+    def _retry_delay(self, attempt, response=None):
+        if response is not None:
+            retry_after = response.headers.get("retry-after")
+            if retry_after is not None and retry_after.isdigit():
+                return min(float(retry_after), self.max_backoff)
+            reset = response.headers.get("x-ratelimit-reset")
+            if response.headers.get("x-ratelimit-remaining") == "0" and reset is not None and reset.isdigit():
+                return min(max(float(reset) - time.time(), 0.0), self.max_backoff)
+        delay = min(self.backoff * (2 ** attempt), self.max_backoff)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def request(self, method, path, token=None, installation_id=None, **kwargs):
+        """
+        Sends a request and returns the response, retrying transient failures.
+
+        Args:
+            token (str): The token to authenticate with.
+            installation_id (int): Authenticate with the cached token of this installation instead.
+
+        Raises:
+            httpx.HTTPStatusError: The final response was not successful.
+            httpx.TransportError: The request kept failing to connect or timing out, or timed out once
+                for a method that isn't idempotent.
+        """
+        headers = dict(kwargs.pop("headers", None) or {})
+        if installation_id is not None:
+            token = await self.tokens.get_token(installation_id)
+        if token is not None:
+            headers["Authorization"] = f"Bearer {token}"
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        attempt = 0
+        renewed = False
+        while True:
+            response = None
+            try:
+                async with self._semaphore:
+                    response = await self._client.request(method, path, headers=headers, **kwargs)
+            except httpx.TransportError as e:
+                if attempt >= self.max_retries or not (idempotent or isinstance(e, UNSENT_ERRORS)):
+                    raise
+                logging.warning("%s %s failed: %s, retrying", method, path, e)
+            else:
+                if response.status_code == 401 and installation_id is not None and not renewed:
+                    logging.warning("%s %s returned 401, renewing the token of installation %s",
+                                    method, path, installation_id)
+                    self.tokens.invalidate(installation_id, token)
+                    token = await self.tokens.get_token(installation_id)
+                    headers["Authorization"] = f"Bearer {token}"
+                    renewed = True
+                    continue
+                retry = self._is_rate_limited(response) or (idempotent and response.status_code in RETRY_STATUSES)
+                if not retry or attempt >= self.max_retries:
+                    response.raise_for_status()
+                    return response
+                logging.warning("%s %s returned %d, retrying", method, path, response.status_code)
+            await asyncio.sleep(self._retry_delay(attempt, response))
+            attempt += 1
+
+    async def get(self, path, token=None, installation_id=None, **kwargs):
+        return (await self.request("GET", path, token=token, installation_id=installation_id, **kwargs)).json()
+
+    async def post(self, path, token=None, installation_id=None, **kwargs):
+        return (await self.request("POST", path, token=token, installation_id=installation_id, **kwargs)).json()
+
+    async def patch(self, path, token=None, installation_id=None, **kwargs):
+        return (await self.request("PATCH", path, token=token, installation_id=installation_id, **kwargs)).json()
@@ -0,0 +1,96 @@
+import os
+import re
+import time
+
+from modules.logging_config import logging
+from modules.FileScanner import FileScanner
+
+
+class HeaderIndex():
+    """
+    An index of every identifier declared in the headers of an install directory.
+
+    The headers are read once and tokenized into identifiers so that checking
+    whether a symbol appears in a header is a dictionary lookup instead of a
+    `grep -rw` per (symbol, header) pair. For every identifier the first header
+    (in directory walk order) that contains it is remembered, which is the header
+    `grep_for_symbol` would have stopped at. Each header is read from disk once
+    while indexing and only its identifiers are kept; the rare symbol that isn't
+    a plain identifier is searched for by reading the headers again.
+    """
+
+    # grep -w treats letters, digits and underscores as word constituents
+    _TOKEN_RE = re.compile(r"\w+")
+    _IDENTIFIER_RE = re.compile(r"^\w+$")
+
+    def __init__(self, install_dir):
+        self._install_dir = os.path.abspath(install_dir)
+        self._tokens = {}
+        self.headers = []
+        self.index_time = 0.0
+
+    def build(self, headers=None):
+        """
+        Records which header declares each identifier.
+
+        Args:
+            headers (list): The headers of the install directory, in walk order, if
+                it was already scanned. Otherwise the install directory is scanned.
+        """
+        if headers is None:
+            headers = FileScanner(self._install_dir).scan().headers
+        start = time.perf_counter()
+        for header in headers:
+            self.add_header(header)
+        self.index_time = time.perf_counter() - start
+        logging.info("Indexed %d headers (%d identifiers) in %.2fs",
+                     len(self.headers), len(self._tokens), self.index_time)
+        return self
+
+    @staticmethod
+    def _read(header):
+        with open(header, "r", errors="replace") as fh:
+            return fh.read()
+
+    def add_header(self, header):
+        try:
+            data = self._read(header)
+        except OSError as e:
+            logging.warning("Failed to read header: %s. Error: %s", header, e)
+            return
+        self.headers.append(header)
+        tokens = self._tokens
+        for token in set(self._TOKEN_RE.findall(data)):
+            if token not in tokens:
+                tokens[token] = header
+
+    def _search_headers(self, symbol):
+        # Symbols that still aren't plain identifiers can't be in the token
+        # index, so fall back to a whole-word search of the header texts.
+        pattern = re.compile(r"(?<!\w)" + re.escape(symbol) + r"(?!\w)")
+        for header in self.headers:
+            try:
+                data = self._read(header)
+            except OSError as e:
+                logging.warning("Failed to read header: %s. Error: %s", header, e)
+                continue
+            if pattern.search(data):
+                return header
+        return None
+
+    def find_header(self, symbol):
+        """
+        Returns the first header that contains `symbol` as a whole word, or None.
+
+        The version of a versioned symbol (`foo@VERS`, `foo@@VERS`) is ignored,
+        headers only declare `foo`.
+        """
+        symbol = symbol.split("@", 1)[0]
+        if not symbol:
+            return None
+        if self._IDENTIFIER_RE.match(symbol):
+            return self._tokens.get(symbol)
+        return self._search_headers(symbol)
+
+    def __contains__(self, symbol):
+        return self.find_header(symbol) is not None
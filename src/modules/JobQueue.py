@@ -0,0 +1,315 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from modules.logging_config import logging
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+_COLUMNS = ("id", "kind", "payload", "priority", "status", "stage", "worker", "error", "result",
+            "created_at", "started_at", "finished_at", "coalesce_key", "branch", "head_sha",
+            "merged", "not_before", "cancel_requested")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    stage TEXT,
+    worker TEXT,
+    error TEXT,
+    result TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    coalesce_key TEXT,
+    branch TEXT,
+    head_sha TEXT,
+    merged TEXT,
+    not_before REAL NOT NULL DEFAULT 0,
+    cancel_requested INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS deliveries (
+    delivery_id TEXT PRIMARY KEY,
+    job_id INTEGER NOT NULL,
+    received_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, priority DESC, id);
+CREATE INDEX IF NOT EXISTS jobs_coalesce ON jobs (coalesce_key, status);
+CREATE INDEX IF NOT EXISTS jobs_branch ON jobs (branch, status);
+CREATE INDEX IF NOT EXISTS deliveries_received ON deliveries (received_at);
+"""
+
+# GitHub only redelivers recent events, delivery IDs are forgotten after this many seconds
+DELIVERY_RETENTION = 24 * 3600
+# Expired delivery IDs are deleted by submit() at most this often
+DELIVERY_PRUNE_INTERVAL = 60
+
+# What submit() did with an event
+CREATED = "created"
+MERGED = "merged"
+DUPLICATE = "duplicate"
+
+
+class JobQueue():
+    """
+    A persistent priority queue of background jobs backed by SQLite.
+
+    The webhook handler enqueues jobs and returns at once; worker processes
+    claim them one at a time. Claiming is a single write transaction, so any
+    number of processes can share the same database file. Higher priorities
+    are claimed first, and jobs of the same priority in the order they were
+    enqueued. `":memory:"` gives a private in-memory queue for one process.
+
+    Webhook events go through `submit`, which makes the queue idempotent:
+    a delivery ID seen before is dropped, an event with the same coalescing
+    key as a job that is still queued is merged into that job, and jobs can
+    be held back for a short window so that overlapping events arrive in
+    time to be merged. Jobs for a branch whose head has moved on can be
+    flagged with `cancel_superseded`; workers check `is_cancel_requested`.
+    Delivery IDs are remembered for `delivery_retention` seconds and then
+    deleted, so the table of them doesn't grow with the life of the server.
+    Every timestamp, including the coalescing window, comes from `clock`.
+
+    Usage:
+        queue = JobQueue("jobs.db")
+        job_id = queue.enqueue("check_run", payload, priority=10)
+        job = queue.claim("worker-1")
+    """
+
+    def __init__(self, db_path, delivery_retention=DELIVERY_RETENTION, clock=time.time):
+        self.db_path = db_path
+        self.delivery_retention = delivery_retention
+        self._clock = clock
+        self._last_prune = 0
+        self._local = threading.local()
+        self._memory = None
+        if db_path == ":memory:":
+            # Every connection to ":memory:" is a new database, so share one
+            self._memory = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        else:
+            directory = os.path.dirname(os.path.abspath(db_path))
+            os.makedirs(directory, exist_ok=True)
+        self._memory_lock = threading.Lock()
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self):
+        if self._memory is not None:
+            return self._memory
+        db = getattr(self._local, "db", None)
+        # Connections can't be shared with forked worker processes
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            # WAL with NORMAL sync is still crash-safe, without an fsync per commit
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def _connect(self):
+        return _Transaction(self._connection(), self._memory_lock if self._memory is not None else None)
+
+    @staticmethod
+    def _row_to_job(row):
+        if row is None:
+            return None
+        job = dict(zip(_COLUMNS, row))
+        job["payload"] = json.loads(job["payload"])
+        job["merged"] = json.loads(job["merged"]) if job["merged"] is not None else []
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        if job["result"] is not None:
+            job["result"] = json.loads(job["result"])
+        return job
+
+    def _select(self, db, job_id):
+        return self._row_to_job(
+            db.execute("SELECT %s FROM jobs WHERE id = ?" % ", ".join(_COLUMNS), (job_id,)).fetchone())
+
+    def enqueue(self, kind, payload, priority=0):
+        """
+        Adds a job and returns its ID.
+        """
+        with self._connect() as db:
+            cursor = db.execute(
+                "INSERT INTO jobs (kind, payload, priority, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                (kind, json.dumps(payload), priority, QUEUED, self._clock()))
+            job_id = cursor.lastrowid
+        logging.debug("Enqueued %s job %d with priority %d", kind, job_id, priority)
+        return job_id
+
+    def submit(self, kind, payload, priority=0, delivery_id=None, coalesce_key=None, branch=None,
+               head_sha=None, window=0):
+        """
+        Adds a job for a webhook event unless it is a redelivery or can be merged into a queued job.
+
+        Args:
+            kind: The event type.
+            payload: The event payload, stored as JSON.
+            priority: Higher priorities are claimed first.
+            delivery_id: Unique ID of the delivery; a later event with the same ID is dropped, whether
+                the first one got a job of its own or was merged, for `delivery_retention` seconds.
+            coalesce_key: Events with the same key are handled by one job; an event arriving while
+                such a job is still queued is appended to its `merged` list instead of adding a job.
+            branch: The repository and branch the event is for, e.g. "owner/repo:main", used by
+                `cancel_superseded`.
+            head_sha: The commit the event is for.
+            window: Seconds a new job is held back so that overlapping events can be merged into it.
+
+        Returns:
+            (job ID, CREATED | MERGED | DUPLICATE)
+        """
+        now = self._clock()
+        with self._connect() as db:
+            if now - self._last_prune >= DELIVERY_PRUNE_INTERVAL:
+                self._prune_deliveries(db, now)
+            if delivery_id is not None:
+                row = db.execute("SELECT job_id FROM deliveries WHERE delivery_id = ? AND received_at >= ?",
+                                 (delivery_id, now - self.delivery_retention)).fetchone()
+                if row is not None:
+                    logging.debug("Dropped redelivery %s of job %d", delivery_id, row[0])
+                    return row[0], DUPLICATE
+            if coalesce_key is not None:
+                row = db.execute(
+                    "SELECT id, merged FROM jobs WHERE coalesce_key = ? AND status = ? AND cancel_requested = 0 "
+                    "ORDER BY id LIMIT 1", (coalesce_key, QUEUED)).fetchone()
+                if row is not None:
+                    merged = json.loads(row[1]) if row[1] is not None else []
+                    merged.append(payload)
+                    db.execute("UPDATE jobs SET merged = ? WHERE id = ?", (json.dumps(merged), row[0]))
+                    self._record_delivery(db, delivery_id, row[0], now)
+                    logging.debug("Merged %s event into job %d", kind, row[0])
+                    return row[0], MERGED
+            cursor = db.execute(
+                "INSERT INTO jobs (kind, payload, priority, status, created_at, coalesce_key, branch, head_sha, "
+                "not_before) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (kind, json.dumps(payload), priority, QUEUED, now, coalesce_key, branch, head_sha, now + window))
+            job_id = cursor.lastrowid
+            self._record_delivery(db, delivery_id, job_id, now)
+        logging.debug("Enqueued %s job %d with priority %d", kind, job_id, priority)
+        return job_id, CREATED
+
+    @staticmethod
+    def _record_delivery(db, delivery_id, job_id, now):
+        if delivery_id is not None:
+            # An expired row with the same ID may not have been pruned yet
+            db.execute("INSERT OR REPLACE INTO deliveries (delivery_id, job_id, received_at) VALUES (?, ?, ?)",
+                       (delivery_id, job_id, now))
+
+    def _prune_deliveries(self, db, now):
+        cursor = db.execute("DELETE FROM deliveries WHERE received_at < ?", (now - self.delivery_retention,))
+        self._last_prune = now
+        if cursor.rowcount:
+            logging.debug("Forgot %d expired delivery IDs", cursor.rowcount)
+
+    def cancel_superseded(self, branch, head_sha):
+        """
+        Flags the unfinished jobs for `branch` that are for another commit than `head_sha`.
+
+        Returns the number of jobs flagged. Queued jobs are still claimed, so the worker can
+        wind them up (e.g. close their check runs), but should skip the work itself.
+        """
+        with self._connect() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE branch = ? AND head_sha != ? AND status IN (?, ?) "
+                "AND cancel_requested = 0", (branch, head_sha, QUEUED, RUNNING))
+            count = cursor.rowcount
+        if count:
+            logging.info("Cancelling %d jobs for %s superseded by %s", count, branch, head_sha)
+        return count
+
+    def is_cancel_requested(self, job_id):
+        with self._connect() as db:
+            row = db.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def claim(self, worker):
+        """
+        Marks the most urgent queued job as running by `worker` and returns it, or None if there is none.
+        """
+        with self._connect() as db:
+            now = self._clock()
+            row = db.execute(
+                "SELECT id FROM jobs WHERE status = ? AND not_before <= ? ORDER BY priority DESC, id LIMIT 1",
+                (QUEUED, now)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE jobs SET status = ?, worker = ?, started_at = ? WHERE id = ?",
+                       (RUNNING, worker, now, row[0]))
+            return self._select(db, row[0])
+
+    def set_stage(self, job_id, stage):
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET stage = ? WHERE id = ?", (stage, job_id))
+
+    def complete(self, job_id, result=None):
+        self._finish(job_id, DONE, result=result)
+
+    def fail(self, job_id, error):
+        self._finish(job_id, FAILED, error=error)
+
+    def cancel(self, job_id, result=None):
+        self._finish(job_id, CANCELLED, result=result)
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                       (status, json.dumps(result) if result is not None else None, error, self._clock(),
+                        job_id))
+
+    def requeue_running(self, worker=None):
+        """
+        Puts jobs left running (by `worker`, or by anyone) back in the queue, e.g. after a crash.
+        """
+        with self._connect() as db:
+            if worker is None:
+                cursor = db.execute("UPDATE jobs SET status = ?, worker = NULL WHERE status = ?", (QUEUED, RUNNING))
+            else:
+                cursor = db.execute("UPDATE jobs SET status = ?, worker = NULL WHERE status = ? AND worker = ?",
+                                    (QUEUED, RUNNING, worker))
+            return cursor.rowcount
+
+    def get(self, job_id):
+        """
+        Returns the job with `job_id` as a dict, or None.
+        """
+        with self._connect() as db:
+            return self._select(db, job_id)
+
+    def counts(self):
+        """
+        Returns {status: number of jobs}.
+        """
+        with self._connect() as db:
+            return dict(db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+
+class _Transaction():
+    """
+    Runs a block of statements as one immediate (write-locking) transaction.
+    """
+
+    def __init__(self, db, lock=None):
+        self._db = db
+        self._lock = lock
+
+    def __enter__(self):
+        if self._lock is not None:
+            self._lock.acquire()
+        self._db.execute("BEGIN IMMEDIATE")
+        return self._db
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self._db.execute("ROLLBACK" if exc_type is not None else "COMMIT")
+        finally:
+            if self._lock is not None:
+                self._lock.release()
@@ -0,0 +1,72 @@
+from modules.logging_config import logging
+
+
+class LineCoverage():
+    """
+    Exact line coverage of sets of functions, computed on source lines rather than per-function totals.
+
+    Every function's executable and executed lines are kept as one pair of
+    integer bitsets per source file (bit `n` is line `n`). The coverage of a
+    set of functions, such as an API's call-graph closure, is the OR of
+    those bitsets per file, so a line shared by several functions (a helper
+    reached through many paths, inline code reported by several objects)
+    is only counted once.
+
+    Requires per-line execution counts, i.e. the json or native gcov backend.
+    """
+
+    def __init__(self, coverage_index):
+        self._index = coverage_index
+        self._file_ids = {}
+        self._fn_bits = {}
+
+    def _file_id(self, source):
+        file_id = self._file_ids.get(source)
+        if file_id is None:
+            file_id = self._file_ids[source] = len(self._file_ids)
+        return file_id
+
+    def function_bits(self, function):
+        """
+        Returns {file ID: (executable line bitset, executed line bitset)} for `function`.
+        """
+        bits = self._fn_bits.get(function)
+        if bits is None:
+            bits = {}
+            for source, counts in self._index.get_line_counts(function).items():
+                executable = 0
+                executed = 0
+                for line, count in counts.items():
+                    executable |= 1 << line
+                    if count > 0:
+                        executed |= 1 << line
+                bits[self._file_id(source)] = (executable, executed)
+            self._fn_bits[function] = bits
+        return bits
+
+    def union(self, functions):
+        """
+        Returns {file ID: [executable bitset, executed bitset]} over all of `functions`.
+        """
+        merged = {}
+        for function in functions:
+            for file_id, (executable, executed) in self.function_bits(function).items():
+                lines = merged.get(file_id)
+                if lines is None:
+                    merged[file_id] = [executable, executed]
+                else:
+                    lines[0] |= executable
+                    lines[1] |= executed
+        return merged
+
+    def coverage(self, functions):
+        """
+        Returns (covered lines, executable lines) of the union of the lines of `functions`.
+        """
+        covered = 0
+        total = 0
+        for executable, executed in self.union(functions).values():
+            total += bin(executable).count("1")
+            covered += bin(executed).count("1")
+        logging.debug("%d of %d lines covered", covered, total)
+        return covered, total
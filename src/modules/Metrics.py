@@ -0,0 +1,215 @@
+import os
+import json
+import time
+import cProfile
+import resource
+import threading
+import subprocess
+import tracemalloc
+from contextlib import contextmanager
+
+from modules.logging_config import logging
+
+# Allocation sites listed per stage in the tracemalloc reports
+TRACEMALLOC_TOP = 30
+
+
+def _read_proc_io():
+    # Bytes passed to read() calls (rchar) and fetched from storage (read_bytes) by this process
+    try:
+        with open("/proc/self/io") as fh:
+            fields = dict(line.split(":", 1) for line in fh)
+        return int(fields["rchar"]), int(fields["read_bytes"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def reset_peak_rss():
+    # Linux resets VmHWM to the current RSS when "5" is written to clear_refs
+    try:
+        with open("/proc/self/clear_refs", "w") as fh:
+            fh.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss():
+    """
+    Returns the peak RSS in bytes since the last `reset_peak_rss`, or of the whole process where it can't be reset.
+    """
+    try:
+        with open("/proc/self/status") as fh:
+            for line in fh:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _ProcessCounter():
+    """
+    Counts the subprocesses ApiCov started, as reported by `run_process` and `record_processes`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = 0
+        self.wall = 0.0
+
+    def record(self, wall, count=1):
+        with self._lock:
+            self.started += count
+            self.wall += wall
+
+
+_processes = _ProcessCounter()
+
+
+def record_processes(wall, count=1):
+    """
+    Records `count` subprocesses (e.g. the workers of a process pool) that ran for `wall` seconds.
+    """
+    _processes.record(wall, count)
+
+
+def run_process(cmd, **kwargs):
+    """
+    `subprocess.run` that is counted in the stage that runs it.
+    """
+    start = time.perf_counter()
+    try:
+        return subprocess.run(cmd, **kwargs)
+    finally:
+        _processes.record(time.perf_counter() - start)
+
+
+def children_peak_rss():
+    """
+    Returns the peak RSS in bytes of the largest subprocess waited for so far.
+    """
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+
+
+class Metrics():
+    """
+    Per-stage instrumentation of a run: timings, resource use and counters, written out as JSON.
+
+    Every `stage` records its wall time, its CPU time and that of the
+    subprocesses it waited for, the number of subprocesses started and
+    their total wall time, the bytes read by the process and its peak RSS.
+    Subprocesses are only counted when they are started through `run_process`
+    or reported with `record_processes`. The peak RSS is reset when a
+    top-level stage starts, so a nested stage reports the peak of the stage
+    around it so far; `children_peak_rss` is the largest RSS of any
+    subprocess waited for since the start of the run, which can't be reset.
+    Counters (files scanned, cache hits, ...) are added with `count` and
+    belong to the stage they were counted in. With a `profile_dir`, every
+    stage is also run under cProfile and tracemalloc and the profile
+    (`<stage>.prof`, for `pstats` or snakeviz) and the top allocation sites
+    (`<stage>.memory.txt`) are written there. cProfile only sees the thread
+    that runs the stage.
+
+    Usage:
+        metrics = Metrics()
+        with metrics.stage("gcov"):
+            ...
+            metrics.count("gcov_cache_hits", cache.hits)
+        metrics.write("metrics.json")
+    """
+
+    def __init__(self, profile_dir=None):
+        self.profile_dir = profile_dir
+        self.stages = {}
+        self.counters = {}
+        self._current = None
+        self._top_level = set()
+        self._start = time.perf_counter()
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Measures the block as stage `name`. Stages with the same name add up; a stage inside
+        another is measured on its own and as part of the outer one.
+        """
+        outer = self._current
+        if outer is None:
+            # Resetting inside a stage would lose the peak of the stage around it
+            reset_peak_rss()
+            self._top_level.add(name)
+        self._current = self.stages.setdefault(name, {
+            "wall": 0.0, "cpu": 0.0, "subprocess_cpu": 0.0, "subprocesses": 0, "subprocess_wall": 0.0,
+            "bytes_read": 0, "storage_bytes_read": 0, "peak_rss": 0, "children_peak_rss": 0, "counters": {}})
+        profiler = None
+        # Profilers can't be nested, an inner stage is part of the outer one's profile
+        if self.profile_dir and outer is None:
+            tracemalloc.start()
+            profiler = cProfile.Profile()
+            profiler.enable()
+        started, waited = _processes.started, _processes.wall
+        io_before = _read_proc_io()
+        self_before = resource.getrusage(resource.RUSAGE_SELF)
+        children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            wall = time.perf_counter() - start
+            self_after = resource.getrusage(resource.RUSAGE_SELF)
+            children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+            io_after = _read_proc_io()
+            current = self._current
+            current["wall"] += wall
+            current["cpu"] += (self_after.ru_utime - self_before.ru_utime) + \
+                (self_after.ru_stime - self_before.ru_stime)
+            current["subprocess_cpu"] += (children_after.ru_utime - children_before.ru_utime) + \
+                (children_after.ru_stime - children_before.ru_stime)
+            current["subprocesses"] += _processes.started - started
+            current["subprocess_wall"] += _processes.wall - waited
+            if io_before is not None and io_after is not None:
+                current["bytes_read"] += io_after[0] - io_before[0]
+                current["storage_bytes_read"] += io_after[1] - io_before[1]
+            current["peak_rss"] = max(current["peak_rss"], peak_rss())
+            current["children_peak_rss"] = max(current["children_peak_rss"], children_peak_rss())
+            if profiler is not None:
+                profiler.disable()
+                self._write_profile(name, profiler)
+            self._current = outer
+            logging.debug("Stage %s took %.2fs", name, wall)
+
+    def _write_profile(self, name, profiler):
+        profiler.dump_stats(os.path.join(self.profile_dir, name + ".prof"))
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        with open(os.path.join(self.profile_dir, name + ".memory.txt"), "w") as fh:
+            fh.write("Peak traced memory: %d bytes\n" % peak)
+            for stat in snapshot.statistics("lineno")[:TRACEMALLOC_TOP]:
+                fh.write("%s\n" % stat)
+        logging.info("Wrote the profile of stage %s to %s", name, self.profile_dir)
+
+    def count(self, name, value=1):
+        """
+        Adds `value` to counter `name`, of the current stage and of the whole run.
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+        if self._current is not None:
+            counters = self._current["counters"]
+            counters[name] = counters.get(name, 0) + value
+
+    def to_dict(self):
+        top_level = [stage for name, stage in self.stages.items() if name in self._top_level]
+        totals = {key: sum(stage[key] for stage in top_level)
+                  for key in ("cpu", "subprocess_cpu", "subprocesses", "subprocess_wall", "bytes_read",
+                              "storage_bytes_read")}
+        totals["wall"] = time.perf_counter() - self._start
+        totals["peak_rss"] = max((stage["peak_rss"] for stage in self.stages.values()), default=0)
+        totals["children_peak_rss"] = children_peak_rss()
+        return {"stages": self.stages, "counters": self.counters, "totals": totals}
+
+    def write(self, path):
+        with open(path, "w") as fh:
+            json.dump(self.to_dict(), fh, indent=2)
+        logging.info("Wrote metrics to: %s", path)
@@ -0,0 +1,208 @@
+from array import array
+from collections import OrderedDict
+
+from modules.logging_config import logging
+from modules.CallGraph import CallGraph
+
+# Most component IDs kept in memoized reachable sets (8 bytes each), least recently used dropped first
+REACH_CACHE_SIZE = 1 << 21
+
+
+class ReachabilityIndex():
+    """
+    Answers "which functions can X reach" for every function of a call graph.
+
+    The call graph is converted to an interned CallGraph (if it isn't one
+    already) and condensed into its strongly connected components once
+    (iterative Tarjan, so deep graphs do not hit the recursion limit). The
+    edges between components are kept in CSR arrays like those of CallGraph.
+    A query walks the condensation from the component of the function, so it
+    costs time in the size of what it reaches.
+
+    Components reached by more than one query, e.g. a helper that many APIs
+    call, have their reachable set memoized as a sorted array in an LRU cache
+    of at most `cache_size` component IDs. A later walk that comes to such a
+    component merges its set instead of walking below it again. Components
+    reached by a single query cache nothing, so sparse graphs of disjoint
+    closures keep one flag per component and nothing per query.
+
+    Attributes:
+        callgraph: The mapping of function -> callees the index was built from.
+    """
+
+    def __init__(self, callgraph, cache_size=REACH_CACHE_SIZE):
+        self.callgraph = callgraph
+        self.cache_size = cache_size
+        if isinstance(callgraph, CallGraph):
+            self._graph = callgraph
+        else:
+            self._graph = CallGraph.from_mapping(callgraph)
+        self._compute_sccs()
+        # Components some walk has reached, and the memoized reachable sets of shared ones
+        self._reached = bytearray(len(self._scc_members))
+        self._cache = OrderedDict()
+        self._cached_ids = 0
+
+    def _compute_sccs(self):
+        graph = self._graph
+        n = graph.num_nodes
+        index = [-1] * n
+        low = [0] * n
+        on_stack = [False] * n
+        stack = []
+        scc_of = [-1] * n
+        members = []
+        counter = 0
+
+        for root in range(n):
+            if index[root] != -1:
+                continue
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = True
+            work = [(root, iter(graph.successor_ids(root)))]
+            while work:
+                v, successors = work[-1]
+                w = next(successors, None)
+                if w is not None:
+                    if index[w] == -1:
+                        index[w] = low[w] = counter
+                        counter += 1
+                        stack.append(w)
+                        on_stack[w] = True
+                        work.append((w, iter(graph.successor_ids(w))))
+                    elif on_stack[w] and index[w] < low[v]:
+                        low[v] = index[w]
+                    continue
+                work.pop()
+                if work:
+                    u = work[-1][0]
+                    if low[v] < low[u]:
+                        low[u] = low[v]
+                if low[v] == index[v]:
+                    scc = len(members)
+                    component = []
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = False
+                        scc_of[w] = scc
+                        component.append(w)
+                        if w == v:
+                            break
+                    members.append(component)
+
+        offsets = array("l", [0])
+        targets = array("l")
+        for scc, component in enumerate(members):
+            successors = set()
+            for v in component:
+                for w in graph.successor_ids(v):
+                    if scc_of[w] != scc:
+                        successors.add(scc_of[w])
+            targets.extend(successors)
+            offsets.append(len(targets))
+
+        self._scc_of = scc_of
+        self._scc_members = members
+        self._scc_offsets = offsets
+        self._scc_targets = targets
+        logging.debug("Call graph has %d functions in %d strongly connected components", n, len(members))
+
+    def _reach(self, root):
+        # Components reachable from `root`, in ascending order
+        result = self._cache.get(root)
+        if result is not None:
+            self._cache.move_to_end(root)
+        elif self._reached[root]:
+            result = self._walk(root, defer=False)
+            self._store(root, result)
+        else:
+            result = self._walk(root, defer=True)
+        return result
+
+    def _walk(self, root, defer):
+        # With `defer`, components an earlier walk reached are walked on their own afterwards and memoized
+        offsets = self._scc_offsets
+        targets = self._scc_targets
+        cache = self._cache
+        reached = self._reached
+        reached[root] = 1
+        seen = {root}
+        todo = [root]
+        deferred = []
+        while todo:
+            scc = todo.pop()
+            for s in targets[offsets[scc]:offsets[scc + 1]]:
+                if s in seen:
+                    continue
+                subset = cache.get(s)
+                if subset is not None:
+                    # Everything below `s` is found at once and never walked
+                    cache.move_to_end(s)
+                    seen.update(subset)
+                elif defer and reached[s]:
+                    seen.add(s)
+                    deferred.append(s)
+                else:
+                    reached[s] = 1
+                    seen.add(s)
+                    todo.append(s)
+        for s in deferred:
+            subset = self._walk(s, defer=False)
+            self._store(s, subset)
+            seen.update(subset)
+        return array("l", sorted(seen))
+
+    def _store(self, scc, result):
+        if scc in self._cache or len(result) > self.cache_size:
+            return
+        self._cache[scc] = result
+        self._cached_ids += len(result)
+        while self._cached_ids > self.cache_size:
+            _, evicted = self._cache.popitem(last=False)
+            self._cached_ids -= len(evicted)
+
+    @property
+    def function_names(self):
+        """
+        The name of every function, indexed by function ID.
+        """
+        return self._graph.names
+
+    def component_of(self, function):
+        """
+        Returns the ID of the strongly connected component of `function`, or None.
+
+        Functions in the same component reach exactly the same functions.
+        """
+        fn_id = self._graph.id_of(function)
+        if fn_id is None:
+            return None
+        return self._scc_of[fn_id]
+
+    def reachable_ids(self, function):
+        """
+        Returns the IDs of every function reachable from `function`, including itself.
+        """
+        fn_id = self._graph.id_of(function)
+        if fn_id is None:
+            return []
+        members = self._scc_members
+        ids = []
+        for scc in self._reach(self._scc_of[fn_id]):
+            ids.extend(members[scc])
+        return ids
+
+    def callees(self, function):
+        """
+        Returns the names of every function reachable from `function`, including itself.
+        """
+        names = self._graph.names
+        return [names[fn_id] for fn_id in self.reachable_ids(function)]
+
+    def name_of(self, fn_id):
+        return self._graph.name_of(fn_id)
+
+    def __contains__(self, function):
+        return self._graph.id_of(function) is not None
@@ -0,0 +1,102 @@
+from array import array
+
+from modules.logging_config import logging
+
+
+class ReachabilityMatrix():
+    """
+    A sparse 0/1 matrix of which rows reach which columns, in compressed sparse row (CSR) form.
+
+    Built with `from_reachability`, the rows are APIs and the columns are the
+    function IDs of the call graph, and row `i` has a 1 for every function
+    API `i` can reach. Per-API totals over the call-graph closure are then a
+    single sparse matrix-vector product with a per-function vector, and the
+    transpose answers "which APIs reach this function".
+
+    Attributes:
+        rows (list): The label of every row.
+        columns (list): The label of every column.
+    """
+
+    def __init__(self, rows, columns, offsets, indices):
+        self.rows = rows
+        self.columns = columns
+        self.offsets = offsets
+        self.indices = indices
+
+    @classmethod
+    def from_reachability(cls, reachability, apis):
+        """
+        Builds the API x function matrix of `apis` from a ReachabilityIndex.
+
+        APIs that are not defined in the call graph get an empty row.
+        """
+        graph = reachability.callgraph
+        offsets = array("q", [0])
+        indices = array("i")
+        rows_of_component = {}
+        for api in apis:
+            if api in graph:
+                component = reachability.component_of(api)
+                span = rows_of_component.get(component)
+                if span is None:
+                    start = len(indices)
+                    indices.extend(sorted(reachability.reachable_ids(api)))
+                    span = rows_of_component[component] = (start, len(indices))
+                else:
+                    # Same closure as an earlier API: repeat its row
+                    indices.extend(indices[span[0]:span[1]])
+            offsets.append(len(indices))
+        matrix = cls(list(apis), reachability.function_names, offsets, indices)
+        logging.debug("Built %d x %d reachability matrix with %d entries",
+                      len(matrix.rows), len(matrix.columns), matrix.nnz)
+        return matrix
+
+    @property
+    def nnz(self):
+        return len(self.indices)
+
+    def row(self, i):
+        """
+        Returns the column indexes set in row `i`.
+        """
+        return self.indices[self.offsets[i]:self.offsets[i + 1]]
+
+    def matvec(self, vector):
+        """
+        Returns the product of the matrix with `vector` (one value per column), one value per row.
+        """
+        result = []
+        offsets = self.offsets
+        indices = self.indices
+        for i in range(len(self.rows)):
+            total = 0
+            for j in indices[offsets[i]:offsets[i + 1]]:
+                total += vector[j]
+            result.append(total)
+        return result
+
+    def transpose(self):
+        """
+        Returns the column x row matrix, e.g. function x API for "which APIs reach this function".
+        """
+        counts = [0] * len(self.columns)
+        for j in self.indices:
+            counts[j] += 1
+        offsets = array("q", [0])
+        for count in counts:
+            offsets.append(offsets[-1] + count)
+        indices = array("i", [0]) * len(self.indices)
+        fill = array("q", offsets[:-1])
+        for i in range(len(self.rows)):
+            for j in self.row(i):
+                indices[fill[j]] = i
+                fill[j] += 1
+        return ReachabilityMatrix(self.columns, self.rows, offsets, indices)
+
+    def row_counts(self):
+        """
+        Returns {row label: number of columns set} for every non-empty row.
+        """
+        return {label: self.offsets[i + 1] - self.offsets[i]
+                for i, label in enumerate(self.rows) if self.offsets[i + 1] > self.offsets[i]}
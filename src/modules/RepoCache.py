@@ -0,0 +1,197 @@
+import os
+import time
+import fcntl
+import shutil
+
+import git
+
+from modules.logging_config import logging
+
+
+class RepoCache():
+    """
+    Bare mirrors of repositories with a cheap worktree per job instead of a full clone.
+
+    Each repository is kept as one bare repository under `mirrors/`. Checking
+    out a commit fetches just that ref into the mirror, which only transfers
+    the objects the mirror doesn't have yet, and adds a detached worktree for
+    it under `worktrees/`. Git always runs with the mirror as its working
+    directory, the process' own working directory is never changed.
+
+    Fetches and worktree changes take an exclusive lock on the mirror, so
+    worker processes can share the cache. A checkout holds a lock on its
+    worktree until it is released; worktrees nobody holds (left behind by a
+    crashed worker) and the least recently used mirrors are removed by
+    `cleanup` until the cache fits in `max_bytes`.
+
+    Usage:
+        cache = RepoCache("/var/cache/apicov/repos", max_bytes=10 * 2**30)
+        path = cache.checkout("owner/repo", url, head_sha, "job-12")
+        ...
+        cache.release(path)
+        cache.cleanup()
+    """
+
+    LAST_USED = "apicov-last-used"
+    FETCH_REF = "refs/apicov/latest"
+
+    def __init__(self, cache_dir, max_bytes=10 * 2**30):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.mirrors_dir = os.path.join(self.cache_dir, "mirrors")
+        self.worktrees_dir = os.path.join(self.cache_dir, "worktrees")
+        self.max_bytes = max_bytes
+        # Worktree path -> (mirror path, open lock file)
+        self._held = {}
+        os.makedirs(self.mirrors_dir, exist_ok=True)
+        os.makedirs(self.worktrees_dir, exist_ok=True)
+
+    def mirror_path(self, full_repo_name):
+        return os.path.join(self.mirrors_dir, full_repo_name + ".git")
+
+    @staticmethod
+    def _lock(path, blocking=True):
+        """
+        Returns the open lock file of `path` once it is locked, or None if it is taken and `blocking` is False.
+        """
+        fh = open(path + ".lock", "a")
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            fh.close()
+            return None
+        return fh
+
+    def _fetch(self, repo, url, ref):
+        # The credentials in `url` are only passed on the command line, never stored in the mirror
+        try:
+            repo.git.fetch("--no-tags", "--force", url, "+%s:%s" % (ref, self.FETCH_REF))
+            return repo.git.rev_parse("--verify", self.FETCH_REF + "^{commit}")
+        except git.GitCommandError:
+            # Servers that don't allow fetching a commit by SHA get all branches fetched instead
+            logging.debug("Fetching %s failed, fetching all branches", ref)
+            repo.git.fetch("--no-tags", "--force", "--prune", url, "+refs/heads/*:refs/heads/*")
+            return repo.git.rev_parse("--verify", ref + "^{commit}")
+
+    def checkout(self, full_repo_name, url, ref, name):
+        """
+        Checks out `ref` of the repository at `url` in a new worktree and returns its path.
+
+        Args:
+            full_repo_name: "owner/repo", names the mirror.
+            url: URL to fetch from, may include an access token.
+            ref: Commit SHA or ref to check out.
+            name: Name of the worktree, unique among the checkouts in use, e.g. the job.
+        """
+        mirror = self.mirror_path(full_repo_name)
+        path = os.path.join(self.worktrees_dir, name)
+        os.makedirs(os.path.dirname(mirror), exist_ok=True)
+        worktree_lock = self._lock(path)
+        try:
+            with self._lock(mirror):
+                if not os.path.isdir(mirror):
+                    logging.info("Creating mirror of %s", full_repo_name)
+                    git.Repo.init(mirror, bare=True)
+                repo = git.Repo(mirror)
+                start = time.time()
+                commit = self._fetch(repo, url, ref)
+                logging.debug("Fetched %s@%s in %.1fs", full_repo_name, ref, time.time() - start)
+                self._remove_worktree(repo, path)
+                repo.git.worktree("add", "--detach", "--force", path, commit)
+                with open(os.path.join(mirror, self.LAST_USED), "w"):
+                    pass
+        except BaseException:
+            worktree_lock.close()
+            raise
+        self._held[path] = (mirror, worktree_lock)
+        return path
+
+    @staticmethod
+    def _remove_worktree(repo, path):
+        if os.path.exists(path):
+            shutil.rmtree(path, ignore_errors=True)
+        repo.git.worktree("prune")
+
+    def release(self, path):
+        """
+        Removes the worktree at `path` returned by `checkout`.
+        """
+        mirror, worktree_lock = self._held.pop(path)
+        try:
+            with self._lock(mirror):
+                self._remove_worktree(git.Repo(mirror), path)
+        finally:
+            worktree_lock.close()
+            try:
+                os.remove(path + ".lock")
+            except OSError:
+                pass
+
+    @staticmethod
+    def _disk_usage(path):
+        total = 0
+        for root, dirs, files in os.walk(path):
+            for name in files:
+                try:
+                    total += os.lstat(os.path.join(root, name)).st_blocks * 512
+                except OSError:
+                    pass
+        return total
+
+    def _mirrors(self):
+        for owner in os.listdir(self.mirrors_dir):
+            owner_dir = os.path.join(self.mirrors_dir, owner)
+            if not os.path.isdir(owner_dir):
+                continue
+            for name in os.listdir(owner_dir):
+                path = os.path.join(owner_dir, name)
+                if name.endswith(".git") and os.path.isdir(path):
+                    yield path
+
+    def cleanup(self):
+        """
+        Removes abandoned worktrees, then the least recently used mirrors until the cache fits in `max_bytes`.
+
+        Returns the number of bytes freed.
+        """
+        freed = 0
+        # Worktrees whose lock nobody holds are left over from a worker that died
+        for name in os.listdir(self.worktrees_dir):
+            path = os.path.join(self.worktrees_dir, name)
+            if name.endswith(".lock") or path in self._held:
+                continue
+            worktree_lock = self._lock(path, blocking=False)
+            if worktree_lock is None:
+                continue
+            with worktree_lock:
+                logging.info("Removing abandoned worktree %s", path)
+                freed += self._disk_usage(path)
+                shutil.rmtree(path, ignore_errors=True)
+                os.remove(path + ".lock")
+        for mirror in self._mirrors():
+            with self._lock(mirror):
+                git.Repo(mirror).git.worktree("prune")
+
+        mirrors = []
+        for mirror in self._mirrors():
+            try:
+                last_used = os.path.getmtime(os.path.join(mirror, self.LAST_USED))
+            except OSError:
+                last_used = 0
+            mirrors.append((last_used, mirror, self._disk_usage(mirror)))
+        total = sum(size for _, _, size in mirrors) + self._disk_usage(self.worktrees_dir)
+        for _, mirror, size in sorted(mirrors):
+            if total <= self.max_bytes:
+                break
+            mirror_lock = self._lock(mirror, blocking=False)
+            if mirror_lock is None:
+                continue
+            with mirror_lock:
+                # Mirrors with worktrees in use stay
+                worktrees = os.path.join(mirror, "worktrees")
+                if os.path.isdir(worktrees) and os.listdir(worktrees):
+                    continue
+                logging.info("Removing least recently used mirror %s (%d bytes)", mirror, size)
+                shutil.rmtree(mirror, ignore_errors=True)
+            total -= size
+            freed += size
+        return freed
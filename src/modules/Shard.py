@@ -0,0 +1,108 @@
+import os
+import gzip
+import json
+
+from modules.logging_config import logging
+from modules.GcovIndex import GcovLogIndex
+
+SHARD_FORMAT = 1
+
+
+class ShardError(Exception):
+    pass
+
+
+def select_shard(gcno_files, root_dir, shard_index, shard_count):
+    """
+    Returns the `.gcno` files of shard `shard_index` of `shard_count`.
+
+    The files are sorted by their path relative to `root_dir` and dealt out
+    round robin, so every machine with the same tree gets the same split and
+    the shards differ by at most one file.
+    """
+    if not 0 <= shard_index < shard_count:
+        raise ValueError("shard index %d is not in 0..%d" % (shard_index, shard_count - 1))
+    ordered = sorted(gcno_files, key=lambda path: os.path.relpath(path, root_dir))
+    return ordered[shard_index::shard_count]
+
+
+def _open(path, mode):
+    return gzip.open(path, mode + "t") if path.endswith(".gz") else open(path, mode)
+
+
+def write_shard(path, apis, coverage_index, root_dir, shard_index=0, shard_count=1, gcno_files=0):
+    """
+    Writes the partial result of a shard: the APIs and the per-line execution counts of every function.
+
+    Sources under `root_dir` are stored relative to it, so shards from machines with
+    the workspace in different places still merge. A `.gz` path is gzip-compressed.
+    """
+    functions = {}
+    for function, sources in sorted(coverage_index.iter_line_counts()):
+        entry = functions[function] = {}
+        for source, counts in sorted(sources.items()):
+            relative = os.path.relpath(source, root_dir)
+            if relative.startswith(os.pardir + os.sep):
+                relative = source
+            lines = sorted(counts)
+            entry[relative] = [lines, [counts[line] for line in lines]]
+    shard = {"format": SHARD_FORMAT, "shard_index": shard_index, "shard_count": shard_count,
+             "gcno_files": gcno_files, "apis": apis, "functions": functions}
+    with _open(path, "w") as fh:
+        json.dump(shard, fh, separators=(",", ":"))
+    logging.info("Wrote shard %d/%d (%d functions) to: %s", shard_index, shard_count, len(functions), path)
+
+
+def read_shard(path):
+    try:
+        with _open(path, "r") as fh:
+            shard = json.load(fh)
+    except (OSError, ValueError, EOFError) as e:
+        raise ShardError("Failed to read shard %s: %s" % (path, e))
+    if not isinstance(shard, dict) or shard.get("format") != SHARD_FORMAT:
+        raise ShardError("%s is not an apicov shard of format %d" % (path, SHARD_FORMAT))
+    return shard
+
+
+def merge_shards(shards):
+    """
+    Combines shards (see `read_shard`) into (APIs, a GcovLogIndex of the union of their coverage).
+
+    Execution counts of the same line of the same function and source are added
+    up, so a line executed on any shard is executed in the result. An unsharded
+    run unions the objects of a function the same way (see `GcovLogIndex.get_union`),
+    so merging the shards gives the same coverage. The APIs are those of the shard
+    with the lowest index followed by any the others add, taken in shard index
+    order, so the result doesn't depend on the order the shards are passed in.
+    """
+    ordered = sorted(shards, key=lambda shard: (shard.get("shard_index", 0), shard["apis"]))
+    apis = []
+    known = set()
+    for shard in ordered:
+        apis.extend(api for api in shard["apis"] if api not in known)
+        known.update(shard["apis"])
+    merged = {}
+    for shard in shards:
+        for function, sources in shard["functions"].items():
+            entry = merged.setdefault(function, {})
+            for source, (lines, counts) in sources.items():
+                line_counts = entry.setdefault(source, {})
+                for line, count in zip(lines, counts):
+                    line_counts[line] = line_counts.get(line, 0) + count
+    common = set.intersection(*(set(shard["apis"]) for shard in shards)) if shards else set()
+    if len(common) != len(apis):
+        logging.warning("Shards disagree on the APIs, %d APIs are only in some of them", len(apis) - len(common))
+
+    result = {"log": None, "functions": [], "lines": []}
+    for function in sorted(merged):
+        for source in sorted(merged[function]):
+            counts = merged[function][source]
+            if not counts:
+                continue
+            executed = sum(1 for count in counts.values() if count > 0)
+            result["functions"].append([function, source, executed * 100.0 / len(counts), len(counts), executed])
+            result["lines"].append([function, source, sorted(counts.items())])
+    index = GcovLogIndex()
+    index.add_result(result)
+    logging.info("Merged %d shards: %d APIs, %d functions", len(shards), len(apis), len(merged))
+    return apis, index
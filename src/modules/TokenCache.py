@@ -0,0 +1,131 @@
+import asyncio
+import time
+from datetime import datetime
+
+import jwt
+
+from modules.logging_config import logging
+
+# Installation tokens live for an hour; refresh them this long before they expire
+REFRESH_MARGIN = 5 * 60
+# App JWTs may live at most 10 minutes; a new one is signed this long before expiry
+JWT_LIFETIME = 10 * 60
+JWT_MARGIN = 60
+
+
+class InstallationTokenCache():
+    """
+    Caches GitHub App installation access tokens per installation.
+
+    A token is handed out until it comes within `REFRESH_MARGIN` of its expiry.
+    From then on the cached token is still returned while a new one is fetched
+    in the background, and only an expired (or missing) token makes the caller
+    wait. Concurrent requests for the same installation share one fetch. The
+    app JWT used to create tokens is reused until shortly before it expires.
+    A token GitHub rejects is dropped with `invalidate` and fetched again on
+    the next request; GitHubClient does this for requests made with an
+    `installation_id`.
+
+    Requests go through the shared GitHubClient, whose API URL can point at a
+    local mock.
+
+    Usage:
+        tokens = InstallationTokenCache(app_id, private_key, client)
+        token = await tokens.get_token(payload["installation"]["id"])
+    """
+
+    def __init__(self, app_id, private_key, client, clock=time.time):
+        self.app_id = app_id
+        self.private_key = private_key
+        self.client = client
+        self._clock = clock
+        self._tokens = {}
+        self._locks = {}
+        self._refreshing = {}
+        self._jwt = None
+        self._jwt_expiry = 0
+        self._default_installation = None
+
+    def get_jwt(self):
+        now = self._clock()
+        if self._jwt is None or now >= self._jwt_expiry - JWT_MARGIN:
+            # Backdate iat a little to allow for clock drift with GitHub
+            payload = {
+                'iat': int(now) - 30,
+                'exp': int(now) + JWT_LIFETIME,
+                'iss': self.app_id
+            }
+            self._jwt = jwt.encode(payload, self.private_key, algorithm='RS256')
+            self._jwt_expiry = now + JWT_LIFETIME
+        return self._jwt
+
+    async def _request_default_installation(self):
+        installations = await self.client.get('/app/installations', token=self.get_jwt())
+        return installations[0]['id']
+
+    async def _request_token(self, installation_id):
+        data = await self.client.post(f'/app/installations/{installation_id}/access_tokens', token=self.get_jwt())
+        expires_at = datetime.fromisoformat(data['expires_at'].replace('Z', '+00:00'))
+        return data['token'], expires_at.timestamp()
+
+    async def _refresh(self, installation_id):
+        lock = self._locks.setdefault(installation_id, asyncio.Lock())
+        async with lock:
+            cached = self._tokens.get(installation_id)
+            if cached is not None and self._clock() < cached[1] - REFRESH_MARGIN:
+                # Someone else refreshed it while we waited
+                return cached[0]
+            logging.debug("Requesting access token for installation %s", installation_id)
+            token, expiry = await self._request_token(installation_id)
+            self._tokens[installation_id] = (token, expiry)
+            return token
+
+    def _refresh_in_background(self, installation_id):
+        task = self._refreshing.get(installation_id)
+        if task is not None and not task.done():
+            return
+        task = asyncio.get_running_loop().create_task(self._refresh(installation_id))
+        task.add_done_callback(self._log_refresh_error)
+        self._refreshing[installation_id] = task
+
+    @staticmethod
+    def _log_refresh_error(task):
+        if not task.cancelled() and task.exception() is not None:
+            logging.warning("Background token refresh failed: %s", task.exception())
+
+    async def resolve_installation(self, installation_id=None):
+        """
+        Returns `installation_id`, or the ID of the app's first installation if it is None.
+        """
+        if installation_id is None:
+            if self._default_installation is None:
+                self._default_installation = await self._request_default_installation()
+            installation_id = self._default_installation
+        return installation_id
+
+    async def get_token(self, installation_id=None):
+        """
+        Returns an access token for `installation_id`, or for the app's first installation if it is None.
+        """
+        installation_id = await self.resolve_installation(installation_id)
+        cached = self._tokens.get(installation_id)
+        now = self._clock()
+        if cached is not None and now < cached[1]:
+            if now >= cached[1] - REFRESH_MARGIN:
+                self._refresh_in_background(installation_id)
+            return cached[0]
+        return await self._refresh(installation_id)
+
+    def invalidate(self, installation_id, token=None):
+        """
+        Forgets the token of `installation_id`, e.g. after GitHub rejected it.
+
+        With `token`, the cached token is only forgotten if it is that one, so
+        a token already fetched to replace it is kept.
+        """
+        if installation_id is None:
+            installation_id = self._default_installation
+        cached = self._tokens.get(installation_id)
+        if cached is not None and (token is None or cached[0] == token):
+            logging.info("Dropping the access token of installation %s", installation_id)
+            del self._tokens[installation_id]
@@ -1,7 +1,10 @@
 import os
+import struct
 import logging
 
 from modules.logging_config import logging 
+from modules.FileScanner import FileScanner
+from modules.ElfReader import ElfReader, ElfError
 
 
 def identify_build_system(project_dir):
@@ -25,21 +28,47 @@ def identify_build_system(project_dir):
     else:
         return 'unknown'
 
-def find_shared_libraries(root_dir):
+def find_shared_libraries(root_dir, scanner=None):
     """
-    Finds all shared library files (.so) in the given root directory, including hidden folders.
+    Finds all shared library files in the given root directory, including hidden folders.
+
+    Versioned names (`libfoo.so.1.2.3`) are included, and every physical library
+    is returned once: symlink aliases (`libfoo.so` -> `libfoo.so.1` -> the real
+    file) and copies with the same ELF build ID are dropped after the first path
+    found for them.
 
     Args:
         root_dir (str): The path to the root directory.
+        scanner (FileScanner): A scan of `root_dir` to reuse, if there is one.
 
     Returns:
         list: A list of fully qualified paths to the shared library files.
     """
+    if scanner is None:
+        scanner = FileScanner(root_dir).scan()
     shared_libs = []
-    for dirpath, dirnames, filenames in os.walk(root_dir):
-        # Include hidden directories
-        dirnames[:] = [d for d in dirnames if not d.startswith('.')] + [d for d in dirnames if d.startswith('.')]
-        for filename in filenames:
-            if filename.endswith('.so'):
-                shared_libs.append(os.path.join(dirpath, filename))
+    seen_files = set()
+    seen_build_ids = set()
+    for path in scanner.shared_libs:
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            logging.debug("Skipping unreadable shared library: %s. Error: %s", path, e)
+            continue
+        if (st.st_dev, st.st_ino) in seen_files:
+            logging.debug("Skipping alias of an already found library: %s", path)
+            continue
+        seen_files.add((st.st_dev, st.st_ino))
+        try:
+            with ElfReader(path) as elf:
+                build_id = elf.get_build_id()
+        except (OSError, ElfError, struct.error):
+            # Not an ELF file (e.g. a linker script), let the export reader report it
+            build_id = None
+        if build_id is not None:
+            if build_id in seen_build_ids:
+                logging.debug("Skipping copy of an already found library: %s", path)
+                continue
+            seen_build_ids.add(build_id)
+        shared_libs.append(path)
     return shared_libs
\ No newline at end of file
@@ -0,0 +1,195 @@
+import os
+import json
+import random
+import shutil
+import subprocess
+
+from modules.logging_config import logging
+
+
+class SyntheticProjectError(Exception):
+    pass
+
+
+class SyntheticProject():
+    """
+    Generates a C project of a given size with everything ApiCov reads, for benchmarking.
+
+    The project has `libs` shared libraries built with `--coverage`. Each
+    library defines `exports` exported functions, of which about nine in ten
+    are declared in the installed headers (the rest are exports that aren't
+    APIs), and `depth - 1` further levels of `exports` hidden functions. Every
+    function calls `fanout` functions of the next level, so the call graph of
+    every API is `depth` levels deep. The functions are spread over
+    `gcov_sets` translation units, each giving one `.gcno`/`.gcda` pair once
+    a test driver calling every other API has run. The declarations are
+    spread over `headers` headers. A `<lib>_callgraph.txt` in the format of
+    LLVM's `opt -print-callgraph` is written next to the project for every
+    library.
+
+    Layout:
+        <root>/project/src/<lib>/*.c   sources
+        <root>/project/build/<lib>/    objects, .gcno and .gcda files
+        <root>/install/lib/            lib<lib>.so.1 and the lib<lib>.so symlink
+        <root>/install/include/<lib>/  headers
+
+    Generating again with the same parameters reuses the existing tree, with
+    other parameters it is replaced. Only a tree this class generated (it
+    writes a marker file into it first) is ever deleted; an existing
+    non-empty directory without the marker is refused.
+
+    Usage:
+        project = SyntheticProject("/tmp/bench", libs=4, exports=200).generate()
+        apicov(project.project_dir, project.install_dir)
+    """
+
+    PARAMS_FILE = "params.json"
+    MARKER_FILE = ".apicov-synthetic-project"
+
+    def __init__(self, root_dir, libs=4, exports=100, headers=8, gcov_sets=16, depth=3, fanout=2, seed=0):
+        self.root_dir = os.path.abspath(root_dir)
+        self.project_dir = os.path.join(self.root_dir, "project")
+        self.install_dir = os.path.join(self.root_dir, "install")
+        self.params = {"libs": libs, "exports": exports, "headers": headers, "gcov_sets": gcov_sets,
+                       "depth": depth, "fanout": fanout, "seed": seed}
+        self.lib_names = ["bench%d" % i for i in range(libs)]
+
+    def callgraph_file(self, lib_name):
+        return os.path.join(self.root_dir, "lib%s.so_callgraph.txt" % lib_name)
+
+    def _is_current(self):
+        try:
+            with open(os.path.join(self.root_dir, self.PARAMS_FILE)) as fh:
+                return json.load(fh) == self.params
+        except (OSError, ValueError):
+            return False
+
+    def generate(self):
+        """
+        Writes, builds and runs the project unless it already exists with the same parameters.
+
+        Raises:
+            SyntheticProjectError: If the root directory exists, isn't empty and wasn't generated here.
+        """
+        if self._is_current():
+            logging.info("Reusing synthetic project in %s", self.root_dir)
+            return self
+        if os.path.isdir(self.root_dir) and os.listdir(self.root_dir):
+            if not os.path.exists(os.path.join(self.root_dir, self.MARKER_FILE)):
+                raise SyntheticProjectError("%s is not empty and not a synthetic project, refusing to "
+                                            "overwrite it" % self.root_dir)
+            logging.info("Replacing synthetic project in %s", self.root_dir)
+            shutil.rmtree(self.root_dir)
+        elif os.path.exists(self.root_dir) and not os.path.isdir(self.root_dir):
+            raise SyntheticProjectError("%s is not a directory" % self.root_dir)
+        os.makedirs(self.root_dir, exist_ok=True)
+        # Written first, so a half generated tree is still recognised as ours
+        with open(os.path.join(self.root_dir, self.MARKER_FILE), "w") as fh:
+            fh.write("Generated by apicov's benchmark.py, deleted when it is regenerated\n")
+        os.makedirs(os.path.join(self.install_dir, "lib"))
+        rng = random.Random(self.params["seed"])
+        apis = []
+        for lib_name in self.lib_names:
+            apis.extend(self._generate_lib(lib_name, rng))
+        self._run_driver(apis)
+        with open(os.path.join(self.root_dir, self.PARAMS_FILE), "w") as fh:
+            json.dump(self.params, fh)
+        return self
+
+    def _generate_lib(self, lib_name, rng):
+        p = self.params
+        levels = [["%s_%s_%d" % (lib_name, "api" if level == 0 else "l%d" % level, i)
+                   for i in range(p["exports"])] for level in range(p["depth"])]
+        calls = {}
+        for level in range(p["depth"] - 1):
+            for function in levels[level]:
+                calls[function] = rng.sample(levels[level + 1], min(p["fanout"], len(levels[level + 1])))
+        exported = set(levels[0])
+        declared = [f for i, f in enumerate(levels[0]) if i % 10 != 9]
+
+        # Translation units take the functions round robin
+        units = max(1, p["gcov_sets"] // len(self.lib_names))
+        src_dir = os.path.join(self.project_dir, "src", lib_name)
+        build_dir = os.path.join(self.project_dir, "build", lib_name)
+        os.makedirs(src_dir)
+        os.makedirs(build_dir)
+        functions = [f for level in levels for f in level]
+        sources = []
+        for unit in range(units):
+            source = os.path.join(src_dir, "unit%d.c" % unit)
+            with open(source, "w") as fh:
+                for function in functions:
+                    if function not in exported:
+                        fh.write('__attribute__((visibility("hidden"))) ')
+                    fh.write("int %s(int x);\n" % function)
+                fh.write("\n")
+                for function in functions[unit::units]:
+                    self._write_function(fh, function, calls.get(function, []), function in exported)
+            sources.append(source)
+
+        objects = []
+        for source in sources:
+            obj = os.path.join(build_dir, os.path.basename(source)[:-2] + ".o")
+            self._run(["gcc", "-c", "--coverage", "-O0", "-fPIC", "-fvisibility=hidden", source, "-o", obj])
+            objects.append(obj)
+        soname = "lib%s.so.1" % lib_name
+        self._run(["gcc", "-shared", "--coverage", "-Wl,-soname," + soname, "-o",
+                   os.path.join(self.install_dir, "lib", soname)] + objects)
+        os.symlink(soname, os.path.join(self.install_dir, "lib", "lib%s.so" % lib_name))
+
+        include_dir = os.path.join(self.install_dir, "include", lib_name)
+        os.makedirs(include_dir)
+        headers = max(1, p["headers"] // len(self.lib_names))
+        for header in range(headers):
+            with open(os.path.join(include_dir, "%s_%d.h" % (lib_name, header)), "w") as fh:
+                for function in declared[header::headers]:
+                    fh.write("int %s(int x);\n" % function)
+
+        # Made-up but stable addresses, so the same parameters give the same file
+        address = {function: 0x1000 + 0x40 * i for i, function in enumerate(functions)}
+        with open(self.callgraph_file(lib_name), "w") as fh:
+            for function in functions:
+                fh.write("Call graph node for function: '%s'<<0x%x>>  #uses=1\n" % (function, address[function]))
+                for callee in calls.get(function, []):
+                    fh.write("  CS<0x%x> calls function '%s'\n" % (address[callee], callee))
+                fh.write("\n")
+        return levels[0]
+
+    @staticmethod
+    def _write_function(fh, function, callees, exported):
+        if exported:
+            fh.write('__attribute__((visibility("default")))\n')
+        fh.write("int %s(int x)\n{\n    int y = x;\n" % function)
+        fh.write("    for (int i = 0; i < 3; i++)\n        y += i * x;\n")
+        fh.write("    if (y > 1000)\n        y -= 1000;\n")
+        for callee in callees:
+            fh.write("    y += %s(x + 1);\n" % callee)
+        fh.write("    return y;\n}\n\n")
+
+    def _run_driver(self, apis):
+        # Every other API is called, so half of them are covered
+        driver = os.path.join(self.project_dir, "driver.c")
+        with open(driver, "w") as fh:
+            for api in apis:
+                fh.write("int %s(int x);\n" % api)
+            fh.write("int main(void)\n{\n    int total = 0;\n")
+            for api in apis[::2]:
+                fh.write("    total += %s(1);\n" % api)
+            fh.write("    return total == 42;\n}\n")
+        binary = os.path.join(self.project_dir, "driver")
+        lib_dir = os.path.join(self.install_dir, "lib")
+        self._run(["gcc", "--coverage", "-o", binary, driver, "-L" + lib_dir]
+                  + ["-l" + lib_name for lib_name in self.lib_names])
+        env = dict(os.environ, LD_LIBRARY_PATH=lib_dir)
+        subprocess.run([binary], env=env, check=False)
+        # The driver's own coverage files aren't part of any library
+        for ext in (".gcno", ".gcda"):
+            for name in os.listdir(self.project_dir):
+                if name.endswith(ext):
+                    os.remove(os.path.join(self.project_dir, name))
+
+    @staticmethod
+    def _run(cmd):
+        p = subprocess.run(cmd, capture_output=True, text=True)
+        if p.returncode != 0:
+            raise RuntimeError("%s failed: %s" % (cmd[0], p.stderr))
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules are imported as `modules.X` with src/ as the working directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
@@ -0,0 +1,73 @@
+import asyncio
+import hashlib
+import hmac
+import importlib
+import json
+import os
+import sys
+
+import httpx
+import pytest
+
+SECRET = "secret"
+
+
+@pytest.fixture
+def app_module(monkeypatch, tmp_path):
+    monkeypatch.setenv("GITHUB_WEBHOOK_SECRET", SECRET)
+    monkeypatch.setenv("GITHUB_APP_IDENTIFIER", "1")
+    monkeypatch.setenv("APICOV_JOB_DB", str(tmp_path / "jobs.db"))
+    monkeypatch.setenv("APICOV_COALESCE_WINDOW", "0")
+    sys.modules.pop("app", None)
+    app = importlib.import_module("app")
+    yield app
+    sys.modules.pop("app", None)
+
+
+def test_import_does_not_create_the_job_database(app_module, tmp_path):
+    assert not os.path.exists(str(tmp_path / "jobs.db"))
+    app_module.get_job_queue()
+    assert os.path.exists(str(tmp_path / "jobs.db"))
+
+
+def deliver(client, event, payload, delivery_id):
+    body = json.dumps(payload).encode()
+    signature = "sha256=" + hmac.new(SECRET.encode(), body, hashlib.sha256).hexdigest()
+    return client.post("/webhook", content=body, headers={
+        "Content-Type": "application/json",
+        "X-GitHub-Event": event,
+        "X-GitHub-Delivery": delivery_id,
+        "X-Hub-Signature-256": signature,
+    })
+
+
+def test_job_status_endpoints(app_module):
+    async def run():
+        # The startup hook isn't run, so no worker processes take the jobs
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://apicov.test") as client:
+            assert (await client.get("/jobs")).json() == {}
+            payload = {
+                "action": "requested",
+                "repository": {"full_name": "o/r"},
+                "check_suite": {"id": 9, "head_sha": "abc", "head_branch": "main"},
+            }
+            response = await deliver(client, "check_suite", payload, "delivery-1")
+            assert response.status_code == 202
+            job_id = response.json()["job_id"]
+            assert response.json() == {"status": "queued", "job_id": job_id}
+            response = await deliver(client, "check_suite", payload, "delivery-1")
+            assert response.json() == {"status": "duplicate", "job_id": job_id}
+
+            job = (await client.get("/jobs/%d" % job_id)).json()
+            assert (job["id"], job["kind"], job["status"], job["branch"], job["head_sha"]) == \
+                (job_id, "check_suite", "queued", "o/r:main", "abc")
+            assert "payload" not in job
+            assert (await client.get("/jobs")).json() == {"queued": 1}
+
+            app_module.get_job_queue().claim("worker-0")
+            assert (await client.get("/jobs/%d" % job_id)).json()["status"] == "running"
+            assert (await client.get("/jobs")).json() == {"running": 1}
+            assert (await client.get("/jobs/%d" % (job_id + 1))).status_code == 404
+
+    asyncio.run(run())
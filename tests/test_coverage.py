@@ -0,0 +1,82 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from modules.Coverage import LibCoverage, split_gcno_dirs
+
+needs_gcc = pytest.mark.skipif(not (shutil.which("gcc") and shutil.which("gcov")), reason="gcc and gcov are needed")
+
+
+def test_large_directories_are_split_between_jobs():
+    gcno_dirs = {"/b/target.dir": ["f%d.gcno" % i for i in range(10)], "/b/small": ["a.gcno", "b.gcno"]}
+    assert split_gcno_dirs(gcno_dirs, 1) == [("/b/target.dir", gcno_dirs["/b/target.dir"], False),
+                                             ("/b/small", ["a.gcno", "b.gcno"], False)]
+    tasks = split_gcno_dirs(gcno_dirs, 4)
+    assert tasks == [
+        ("/b/target.dir", ["f0.gcno", "f1.gcno", "f2.gcno"], True),
+        ("/b/target.dir", ["f3.gcno", "f4.gcno", "f5.gcno"], True),
+        ("/b/target.dir", ["f6.gcno", "f7.gcno", "f8.gcno"], True),
+        ("/b/target.dir", ["f9.gcno"], True),
+        ("/b/small", ["a.gcno", "b.gcno"], False),
+    ]
+
+
+@pytest.fixture(scope="module")
+def project(tmp_path_factory):
+    # All objects of the library in one directory, like CMakeFiles/<target>.dir
+    root = tmp_path_factory.mktemp("project")
+    src = root / "src"
+    objs = root / "build" / "lib.dir"
+    main_dir = root / "build" / "main.dir"
+    for directory in (src, objs, main_dir):
+        directory.mkdir(parents=True)
+    calls = []
+    for i in range(8):
+        (src / ("f%d.c" % i)).write_text(
+            "int f%d(int x)\n{\n    if (x > %d)\n        return x;\n    return -x;\n}\n" % (i, i))
+        calls.append("f%d(%d)" % (i, i * 2 % 5))
+    (src / "main.c").write_text("".join("int f%d(int x);\n" % i for i in range(8)) +
+                                "int main(void)\n{\n    return (%s) & 0;\n}\n" % " + ".join(calls))
+    objects = []
+    for name in ["f%d" % i for i in range(8)] + ["main"]:
+        out_dir = main_dir if name == "main" else objs
+        subprocess.run(["gcc", "-c", "--coverage", "-O0", str(src / (name + ".c")), "-o", name + ".o"],
+                       cwd=str(out_dir), check=True)
+        objects.append(str(out_dir / (name + ".o")))
+    subprocess.run(["gcc", "--coverage", "-o", str(root / "prog")] + objects, check=True)
+    subprocess.run([str(root / "prog")], cwd=str(root), check=True)
+    return str(root)
+
+
+def gcov_logs(root):
+    logs = {}
+    for directory, _, files in os.walk(root):
+        for name in files:
+            if name.endswith(".gcov_log"):
+                path = os.path.join(directory, name)
+                with open(path) as fh:
+                    logs[os.path.relpath(path, root)] = fh.read()
+                os.remove(path)
+    return logs
+
+
+@needs_gcc
+@pytest.mark.parametrize("backend", ["text", "json", "native"])
+def test_parallel_run_matches_serial_run(project, backend):
+    apis = ["f%d" % i for i in range(8)] + ["main"]
+    runs = []
+    for jobs in (1, 4):
+        coverage = LibCoverage(apis, project, gcov_backend=backend)
+        coverage.run_gcov_on_gcno_files(jobs=jobs)
+        assert coverage.gcov_failures == []
+        coverage.populate_entry_api_cov()
+        index = coverage.coverage_index
+        runs.append((gcov_logs(project), dict(index._records), dict(index._line_counts), coverage.api_coverage))
+    assert runs[0] == runs[1]
+    logs, records, _, api_coverage = runs[0]
+    if backend == "text":
+        assert len(logs) == 9
+    assert set(records) >= set(apis)
+    assert len(api_coverage) == len(apis)
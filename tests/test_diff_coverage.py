@@ -0,0 +1,118 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from modules.DiffCoverage import (DiffError, get_changed_lines, find_changed_functions, find_affected_apis,
+                                  select_delta_apis)
+from modules.Reachability import ReachabilityIndex
+from modules.ReachabilityMatrix import ReachabilityMatrix
+
+
+def git(repo, *args):
+    subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@example.com"] + list(args),
+                   cwd=repo, check=True, capture_output=True)
+
+
+def write_lines(path, lines):
+    with open(path, "w") as fh:
+        fh.write("\n".join(lines) + "\n")
+
+
+@pytest.fixture
+def repo(tmp_path):
+    if not shutil.which("git"):
+        pytest.skip("git is needed")
+    root = os.path.realpath(str(tmp_path))
+    git(root, "init", "-q")
+    write_lines(os.path.join(root, "a.c"), [str(i) for i in range(1, 11)])
+    write_lines(os.path.join(root, "gone.c"), ["int gone(void);"])
+    git(root, "add", ".")
+    git(root, "commit", "-q", "-m", "base")
+    return root
+
+
+def test_changed_lines_of_each_hunk_kind(repo):
+    lines = [str(i) for i in range(1, 11)]
+    lines[2] = "three"              # "@@ -3 +3 @@": one line, the count is left out
+    lines[5:5] = ["new 1", "new 2"]  # "@@ -5,0 +6,2 @@": two added lines
+    del lines[10]                   # "@@ -9 +10,0 @@": a pure deletion after new line 10
+    write_lines(os.path.join(repo, "a.c"), lines)
+    os.remove(os.path.join(repo, "gone.c"))  # "+++ /dev/null"
+    write_lines(os.path.join(repo, "added.c"), ["int added(void)", "{", "    return 1;", "}"])
+    git(repo, "add", "-N", "added.c")
+
+    changes = get_changed_lines(repo, "HEAD")
+    assert changes == {
+        os.path.join(repo, "a.c"): [(3, 3), (6, 7), (10, 11)],
+        os.path.join(repo, "added.c"): [(1, 4)],
+    }
+
+
+def test_changed_lines_from_a_subdirectory(repo):
+    os.mkdir(os.path.join(repo, "sub"))
+    write_lines(os.path.join(repo, "a.c"), ["1", "2", "changed"] + [str(i) for i in range(4, 11)])
+    # Paths are resolved against the top of the repository, not the directory diffed from
+    assert get_changed_lines(os.path.join(repo, "sub"), "HEAD") == {os.path.join(repo, "a.c"): [(3, 3)]}
+
+
+def test_unknown_ref(repo):
+    with pytest.raises(DiffError):
+        get_changed_lines(repo, "no-such-ref")
+
+
+class FakeIndex(object):
+    def __init__(self, extents):
+        self._extents = extents
+
+    def function_extents(self):
+        return iter(self._extents)
+
+
+def test_changed_functions_overlap():
+    index = FakeIndex([
+        ("first", "/src/a.c", 1, 5),
+        ("second", "/src/a.c", 8, 12),
+        ("third", "/src/a.c", 20, 30),
+        ("elsewhere", "/src/b.c", 1, 100),
+    ])
+    assert find_changed_functions({}, index) == set()
+    # Between functions, and after the last one
+    assert find_changed_functions({"/src/a.c": [(6, 7), (31, 40)]}, index) == set()
+    # The first and last lines of a function count
+    assert find_changed_functions({"/src/a.c": [(5, 5)]}, index) == {"first"}
+    assert find_changed_functions({"/src/a.c": [(13, 20)]}, index) == {"third"}
+    # A change spanning several functions
+    assert find_changed_functions({"/src/a.c": [(4, 9)]}, index) == {"first", "second"}
+    # A change inside a function, only in its own file
+    assert find_changed_functions({"/src/a.c": [(25, 25)], "/src/c.c": [(1, 1)]}, index) == {"third"}
+
+
+def test_changed_functions_nested_extents():
+    # A function defined within the extent of another, e.g. a lambda
+    index = FakeIndex([("outer", "/src/a.c", 1, 50), ("inner", "/src/a.c", 10, 12)])
+    assert find_changed_functions({"/src/a.c": [(30, 30)]}, index) == {"outer"}
+    assert find_changed_functions({"/src/a.c": [(11, 11)]}, index) == {"outer", "inner"}
+
+
+def test_affected_apis_through_the_call_graph():
+    callgraph = {"api_a": ["helper"], "api_b": ["api_a"], "api_c": ["other"]}
+    matrix = ReachabilityMatrix.from_reachability(ReachabilityIndex(callgraph), ["api_a", "api_b", "api_c"])
+    apis = ["api_c", "api_b", "api_a"]
+    assert find_affected_apis(apis, {"helper"}) == []
+    assert find_affected_apis(apis, {"helper"}, matrix) == ["api_b", "api_a"]
+    assert find_affected_apis(apis, {"api_c"}, matrix) == ["api_c"]
+
+
+def test_delta_apis():
+    def entry(cov, size):
+        return {"Size": size, "Cov": [cov, size]}
+    baseline = {"same": entry(50.0, 4), "moved": entry(50.0, 4), "grown": entry(50.0, 4),
+                "touched": entry(50.0, 4), "dropped": entry(0.0, 2)}
+    current = {"same": entry(50.0, 4), "moved": entry(75.0, 4), "grown": entry(50.0, 6),
+               "touched": entry(50.0, 4), "added": entry(100.0, 1)}
+    apis = ["same", "moved", "grown", "touched", "added", "failed"]
+    assert select_delta_apis(apis, baseline, current, ["touched"]) == \
+        ["moved", "grown", "touched", "added", "failed", "dropped"]
+    assert select_delta_apis(apis, baseline, current) == apis + ["dropped"]
@@ -0,0 +1,173 @@
+import os
+import shutil
+import struct
+import subprocess
+
+import pytest
+
+from modules.ElfReader import (ElfReader, ElfError, SHT_DYNSYM, SHT_GNU_VERDEF, SHT_GNU_VERSYM, SHF_EXECINSTR,
+                               STB_GLOBAL, VERSYM_HIDDEN)
+from modules.ExportFetcher import read_exports
+
+needs_gcc = pytest.mark.skipif(not (shutil.which("gcc") and shutil.which("nm")), reason="gcc and nm are needed")
+
+SOURCE = """
+int api_plain(int x) { return x + 1; }
+static int helper(int x) { return x * 2; }
+int api_uses_helper(int x) { return helper(x); }
+int api_data = 3;
+__attribute__((weak)) int api_weak(void) { return 0; }
+int api_old(void) { return 1; }
+int api_new(void) { return 2; }
+#ifdef VERSIONED
+__asm__(".symver api_old, api_versioned@LIB_1.0");
+__asm__(".symver api_new, api_versioned@@LIB_2.0");
+#endif
+int api_v2_only(void) { return 3; }
+int mangle_path_fn(void) { return 4; }
+static int resolve_impl(void) { return 5; }
+static void *resolve(void) { return (void *)resolve_impl; }
+int api_ifunc(void) __attribute__((ifunc("resolve")));
+"""
+
+VERSION_SCRIPT = """
+LIB_1.0 { global: api_plain; api_uses_helper; api_data; api_weak; api_versioned; api_ifunc; mangle_path_fn;
+          local: *; };
+LIB_2.0 { global: api_v2_only; } LIB_1.0;
+"""
+
+
+def nm_exports(path):
+    """
+    The exports as the `nm -D --defined-only | grep " T "` pipeline that ElfReader replaced listed them.
+    """
+    output = subprocess.run(["nm", "-D", "--defined-only", path], capture_output=True, text=True, check=True,
+                            env=dict(os.environ, LC_ALL="C")).stdout
+    symbols = []
+    for line in output.splitlines():
+        if " T " not in line or "operator" in line or "mangle_path" in line:
+            continue
+        symbols.append(line.split()[-1].split("@@")[0])
+    return symbols
+
+
+@pytest.fixture(scope="module")
+def libraries(tmp_path_factory):
+    root = tmp_path_factory.mktemp("elf")
+    (root / "lib.c").write_text(SOURCE)
+    (root / "lib.map").write_text(VERSION_SCRIPT)
+    libs = {}
+    libs["versioned"] = str(root / "libversioned.so")
+    subprocess.run(["gcc", "-shared", "-fPIC", "--coverage", "-DVERSIONED", "-Wl,--version-script=lib.map", "-o",
+                    libs["versioned"], "lib.c"], cwd=str(root), check=True)
+    libs["plain"] = str(root / "libplain.so")
+    subprocess.run(["gcc", "-shared", "-fPIC", "--coverage", "-o", libs["plain"], "lib.c"], cwd=str(root), check=True)
+    # A 32-bit object linked without the C library, where a 32-bit one isn't installed
+    if subprocess.run(["gcc", "-m32", "-c", "-fPIC", "-DVERSIONED", "-o", "lib32.o", "lib.c"], cwd=str(root),
+                      capture_output=True).returncode == 0:
+        libs["32-bit"] = str(root / "lib32.so")
+        subprocess.run(["ld", "-m", "elf_i386", "-shared", "--version-script=lib.map", "-o", libs["32-bit"],
+                        "lib32.o"], cwd=str(root), check=True)
+    return libs
+
+
+@needs_gcc
+@pytest.mark.parametrize("kind", ["versioned", "plain", "32-bit"])
+def test_exports_match_nm(libraries, kind):
+    if kind not in libraries:
+        pytest.skip("gcc can't build 32-bit objects")
+    symbols, error = read_exports(libraries[kind])
+    assert error is None
+    assert symbols == nm_exports(libraries[kind])
+    if kind != "plain":
+        # The default version is dropped and the hidden one kept, as nm printed them
+        assert "api_versioned" in symbols and "api_versioned@LIB_1.0" in symbols
+    for excluded in ("helper", "api_data", "api_weak", "api_ifunc", "mangle_path_fn"):
+        assert excluded not in symbols
+
+
+def build_elf(is64, big_endian, symbols, versions):
+    """
+    Returns a minimal shared object with a .text section, a .dynsym of `symbols` ((name, version
+    index, hidden) each, all global functions in .text) and the version definitions `versions`.
+    """
+    e = ">" if big_endian else "<"
+    dynstr = b"\0"
+    offsets = {}
+    for name in [name for name, _, _ in symbols] + list(versions.values()):
+        offsets[name] = len(dynstr)
+        dynstr += name.encode() + b"\0"
+
+    sym_fmt = e + ("IBBHQQ" if is64 else "IIIBBH")
+    dynsym = b"\0" * struct.calcsize(sym_fmt)
+    versym = struct.pack(e + "H", 0)
+    for name, version, hidden in symbols:
+        info = (STB_GLOBAL << 4) | 2
+        if is64:
+            dynsym += struct.pack(sym_fmt, offsets[name], info, 0, 1, 0x1000, 8)
+        else:
+            dynsym += struct.pack(sym_fmt, offsets[name], 0x1000, 8, info, 0, 1)
+        versym += struct.pack(e + "H", version | (VERSYM_HIDDEN if hidden else 0))
+
+    verdef = b""
+    for i, (ndx, name) in enumerate(sorted(versions.items())):
+        last = i == len(versions) - 1
+        verdef += struct.pack(e + "HHHHIII", 1, 0, ndx, 1, 0, 20, 0 if last else 28)
+        verdef += struct.pack(e + "II", offsets[name], 0)
+
+    # Sections: null, .text, .dynstr, .dynsym, .gnu.version, .gnu.version_d
+    header_size = 64 if is64 else 52
+    contents = [b"\x90" * 16, dynstr, dynsym, versym, verdef]
+    data = b""
+    placed = []
+    for content in contents:
+        placed.append((header_size + len(data), len(content)))
+        data += content + b"\0" * (-len(content) % 8)
+    shoff = header_size + len(data)
+    shdr_fmt = e + ("IIQQQQIIQQ" if is64 else "IIIIIIIIII")
+    sections = [struct.pack(shdr_fmt, *[0] * 10)]
+    specs = [(1, SHF_EXECINSTR, 0, 0), (3, 0, 0, 0), (SHT_DYNSYM, 0, 2, struct.calcsize(sym_fmt)),
+             (SHT_GNU_VERSYM, 0, 3, 2), (SHT_GNU_VERDEF, 0, 2, 0)]
+    for (sh_type, flags, link, entsize), (offset, size) in zip(specs, placed):
+        sections.append(struct.pack(shdr_fmt, 0, sh_type, flags, 0, offset, size, link, 0, 8, entsize))
+
+    ident = b"\x7fELF" + bytes([2 if is64 else 1, 2 if big_endian else 1, 1]) + b"\0" * 9
+    shentsize = struct.calcsize(shdr_fmt)
+    if is64:
+        header = ident + struct.pack(e + "HHIQQQIHHHHHH", 3, 62, 1, 0, 0, shoff, 0, header_size, 0, 0,
+                                     shentsize, len(sections), 0)
+    else:
+        header = ident + struct.pack(e + "HHIIIIIHHHHHH", 3, 3, 1, 0, 0, shoff, 0, header_size, 0, 0,
+                                     shentsize, len(sections), 0)
+    return header + data + b"".join(sections)
+
+
+@pytest.mark.parametrize("is64", [True, False])
+@pytest.mark.parametrize("big_endian", [False, True])
+def test_layouts(tmp_path, is64, big_endian):
+    path = str(tmp_path / "lib.so")
+    symbols = [("zeta", 1, False), ("alpha", 2, False), ("alpha", 3, True), ("beta", 3, False)]
+    with open(path, "wb") as fh:
+        fh.write(build_elf(is64, big_endian, symbols, {1: "lib.so", 2: "V_1", 3: "V_2"}))
+    with ElfReader(path) as elf:
+        assert list(elf.iter_exported_functions()) == [
+            ("zeta", None, False), ("alpha", "V_1", False), ("alpha", "V_2", True), ("beta", "V_2", False)]
+    assert read_exports(path) == (["alpha", "alpha@V_2", "beta", "zeta"], None)
+
+
+def test_truncated_and_invalid_files(tmp_path):
+    path = str(tmp_path / "lib.so")
+    data = build_elf(True, False, [("fn", 1, False)], {1: "lib.so"})
+    with open(path, "wb") as fh:
+        fh.write(data[:-10])
+    with pytest.raises(ElfError):
+        with ElfReader(path) as elf:
+            list(elf.iter_exported_functions())
+    symbols, error = read_exports(path)
+    assert symbols is None and "truncated" in error
+
+    for content in (b"", b"not an ELF file", b"\x7fELF\x03\x01" + b"\0" * 58):
+        with open(path, "wb") as fh:
+            fh.write(content)
+        symbols, error = read_exports(path)
+        assert symbols is None and error
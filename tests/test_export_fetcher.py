@@ -0,0 +1,59 @@
+import shutil
+import subprocess
+
+import pytest
+
+import modules.ExportFetcher as export_fetcher
+from modules.ExportFetcher import ExportFetcher
+
+pytestmark = pytest.mark.skipif(not shutil.which("gcc"), reason="gcc is needed")
+
+
+@pytest.fixture(scope="module")
+def shared_libs(tmp_path_factory):
+    root = tmp_path_factory.mktemp("libs")
+    libs = []
+    for lib in range(3):
+        source = root / ("lib%d.c" % lib)
+        # Every library exports a symbol of its own and one they all share
+        source.write_text("".join("int lib%d_fn%d(void) { return %d; }\n" % (lib, i, i) for i in range(20))
+                          + "int shared_fn(void) { return %d; }\n" % lib)
+        path = str(root / ("lib%d.so" % lib))
+        subprocess.run(["gcc", "-shared", "-fPIC", "-o", path, str(source)], check=True)
+        libs.append(path)
+    libs.append(str(root / "missing.so"))
+    return libs
+
+
+def read(shared_libs, jobs):
+    fetcher = ExportFetcher(".")
+    status = fetcher.get_exports_from_libs(shared_libs, jobs=jobs)
+    return status, fetcher.symbols, fetcher.symbol_libraries
+
+
+def test_process_pool_gives_the_same_exports(monkeypatch, shared_libs):
+    serial = read(shared_libs, jobs=1)
+    assert serial[0] == [0, 0, 0, 1]
+
+    pools = []
+    pool = export_fetcher.ProcessPoolExecutor
+
+    def counting_pool(*args, **kwargs):
+        pools.append(args)
+        return pool(*args, **kwargs)
+
+    monkeypatch.setattr(export_fetcher, "PARALLEL_MIN_BYTES", 0)
+    monkeypatch.setattr(export_fetcher, "ProcessPoolExecutor", counting_pool)
+    assert read(shared_libs, jobs=2) == serial
+    assert len(pools) == 1
+
+
+def test_one_job_never_uses_the_process_pool(monkeypatch, shared_libs):
+    def no_pool(*args, **kwargs):
+        raise AssertionError("the process pool was used with jobs=1")
+
+    monkeypatch.setattr(export_fetcher, "PARALLEL_MIN_BYTES", 0)
+    monkeypatch.setattr(export_fetcher, "ProcessPoolExecutor", no_pool)
+    status, symbols, _ = read(shared_libs, jobs=1)
+    assert status == [0, 0, 0, 1]
+    assert "shared_fn" in symbols
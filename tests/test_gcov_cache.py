@@ -0,0 +1,58 @@
+import json
+import os
+
+from modules.GcovCache import GcovCache
+
+
+def make_object(directory, name):
+    gcno_file = os.path.join(directory, name + ".gcno")
+    for path in (gcno_file, gcno_file[:-len(".gcno")] + ".gcda"):
+        with open(path, "wb") as fh:
+            fh.write(name.encode())
+    return gcno_file
+
+
+def result_of(name):
+    return {"log": None, "functions": [[name, name + ".c", 50.0, 2, 1]], "lines": [[name, name + ".c", [[1, 1], [2, 0]]]]}
+
+
+def test_hit_after_reload(tmp_path):
+    gcno_file = make_object(str(tmp_path), "a")
+    cache = GcovCache(str(tmp_path / "cache"), gcov_version="test")
+    assert cache.lookup(gcno_file) is None
+    cache.store(gcno_file, result_of("a"))
+    cache.save()
+
+    cache = GcovCache(str(tmp_path / "cache"), gcov_version="test")
+    assert cache.lookup(gcno_file) == result_of("a")
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_objects_not_used_by_the_last_run_are_dropped(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    gcno_a = make_object(str(tmp_path), "a")
+    gcno_b = make_object(str(tmp_path), "b")
+    cache = GcovCache(cache_dir, gcov_version="test")
+    cache.store(gcno_a, result_of("a"))
+    cache.store(gcno_b, result_of("b"))
+    cache.save()
+    assert len(os.listdir(os.path.join(cache_dir, GcovCache.OBJECTS_DIR))) == 2
+
+    # b.gcno is no longer built
+    os.remove(gcno_b)
+    cache = GcovCache(cache_dir, gcov_version="test")
+    assert cache.lookup(gcno_a) == result_of("a")
+    cache.save()
+
+    with open(os.path.join(cache_dir, GcovCache.MANIFEST)) as fh:
+        assert list(json.load(fh)["entries"]) == [gcno_a]
+    assert os.listdir(os.path.join(cache_dir, GcovCache.OBJECTS_DIR)) == [GcovCache._object_name(gcno_a)]
+
+
+def test_changed_gcda_is_a_miss(tmp_path):
+    gcno_file = make_object(str(tmp_path), "a")
+    cache = GcovCache(str(tmp_path / "cache"), gcov_version="test")
+    cache.store(gcno_file, result_of("a"))
+    with open(gcno_file[:-len(".gcno")] + ".gcda", "ab") as fh:
+        fh.write(b"more")
+    assert cache.lookup(gcno_file) is None
@@ -0,0 +1,145 @@
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from modules.GcovIndex import parse_gcov_json
+from modules.GcovReader import GcovReader
+
+pytestmark = pytest.mark.skipif(not (shutil.which("gcc") and shutil.which("g++") and shutil.which("gcov")),
+                                reason="gcc, g++ and gcov are needed")
+
+C_SAMPLE = r"""
+#include <stdio.h>
+
+static int square(int x) { return x * x; }
+
+int classify(int x)
+{
+    if (x < 0)
+        return -1;
+    else if (x == 0)
+        return 0;
+    switch (x % 3) {
+    case 0:
+        return 3;
+    case 1:
+        return 1;
+    default:
+        break;
+    }
+    return 2;
+}
+
+int never_called(int x)
+{
+    int y = 0;
+    for (int i = 0; i < x; i++)
+        y += i;
+    return y;
+}
+
+int main(int argc, char **argv)
+{
+    int total = 0;
+    for (int i = -2; i < 10; i++) {
+        total += classify(i);
+        if (i > 5 && argc > 1)
+            total += square(i);
+    }
+    while (total > 100)
+        total /= 2;
+    printf("%d\n", total);
+    return 0;
+}
+"""
+
+CXX_SAMPLE = r"""
+#include <stdexcept>
+#include <vector>
+
+template <typename T>
+T sum(const std::vector<T> &values)
+{
+    T total = T();
+    for (const T &value : values)
+        total += value;
+    return total;
+}
+
+class Counter {
+public:
+    explicit Counter(int start) : count_(start) {}
+    void add(int n)
+    {
+        if (n < 0)
+            throw std::invalid_argument("negative");
+        count_ += n;
+    }
+    int count() const { return count_; }
+private:
+    int count_;
+};
+
+int main()
+{
+    Counter counter(1);
+    std::vector<int> values = {1, 2, 3};
+    counter.add(sum(values));
+    try {
+        counter.add(-1);
+    } catch (const std::invalid_argument &) {
+        counter.add(1);
+    }
+    auto twice = [](int x) { return 2 * x; };
+    return twice(counter.count()) == 16 ? 0 : 1;
+}
+"""
+
+
+def build_and_run(tmp_path, compiler, source_name, source):
+    source_file = tmp_path / source_name
+    source_file.write_text(source)
+    binary = str(tmp_path / "sample")
+    subprocess.run([compiler, "--coverage", "-O0", "-o", binary, str(source_file)], cwd=str(tmp_path), check=True)
+    subprocess.run([binary], cwd=str(tmp_path), check=False)
+    gcno_files = [name for name in os.listdir(str(tmp_path)) if name.endswith(".gcno")]
+    assert len(gcno_files) == 1
+    return gcno_files[0]
+
+
+def gcov_json_result(file_dir, gcno_name):
+    p = subprocess.run(["gcov", "--json-format", "--stdout", gcno_name], cwd=file_dir,
+                       capture_output=True, text=True, check=True)
+    docs = [json.loads(line) for line in p.stdout.splitlines() if line.strip()]
+    assert len(docs) == 1
+    return parse_gcov_json(docs[0], file_dir)
+
+
+def normalized(result):
+    functions = sorted(tuple(function) for function in result["functions"])
+    lines = sorted((function, source, tuple(tuple(line) for line in line_counts))
+                   for function, source, line_counts in result["lines"])
+    return functions, lines
+
+
+@pytest.mark.parametrize("compiler, source_name, source", [
+    ("gcc", "sample.c", C_SAMPLE),
+    ("g++", "sample.cpp", CXX_SAMPLE),
+])
+def test_native_reader_matches_gcov(tmp_path, compiler, source_name, source):
+    gcno_name = build_and_run(tmp_path, compiler, source_name, source)
+    expected = gcov_json_result(str(tmp_path), gcno_name)
+    actual = GcovReader(os.path.join(str(tmp_path), gcno_name)).read()
+    assert expected["functions"]
+    assert normalized(actual) == normalized(expected)
+
+
+def test_native_reader_without_data_file(tmp_path):
+    gcno_name = build_and_run(tmp_path, "gcc", "sample.c", C_SAMPLE)
+    os.remove(str(tmp_path / gcno_name.replace(".gcno", ".gcda")))
+    expected = gcov_json_result(str(tmp_path), gcno_name)
+    actual = GcovReader(os.path.join(str(tmp_path), gcno_name)).read()
+    assert normalized(actual) == normalized(expected)
@@ -0,0 +1,67 @@
+import asyncio
+
+import httpx
+import pytest
+
+from modules.GitHubClient import GitHubClient
+
+
+class StubGitHub():
+    """
+    Answers each request with the next of `responses`; an exception is raised instead of answering.
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def __call__(self, request):
+        self.requests.append(request.method)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def send(github, method):
+    async def run():
+        client = GitHubClient("https://api.github.test", transport=httpx.MockTransport(github), backoff=0)
+        try:
+            return await client.request(method, "/repos/o/r/check-runs", json={"name": "run"})
+        finally:
+            await client.aclose()
+
+    return asyncio.run(run())
+
+
+def test_idempotent_requests_are_retried():
+    github = StubGitHub(httpx.ReadTimeout("timed out"), httpx.Response(502), httpx.Response(200, json={}))
+    assert send(github, "PATCH").status_code == 200
+    assert github.requests == ["PATCH"] * 3
+
+
+@pytest.mark.parametrize("failure", [httpx.Response(502), httpx.Response(500)])
+def test_post_with_a_server_error_is_not_resent(failure):
+    github = StubGitHub(failure, httpx.Response(201, json={}))
+    with pytest.raises(httpx.HTTPStatusError):
+        send(github, "POST")
+    assert github.requests == ["POST"]
+
+
+def test_post_that_timed_out_is_not_resent():
+    github = StubGitHub(httpx.ReadTimeout("timed out"), httpx.Response(201, json={}))
+    with pytest.raises(httpx.ReadTimeout):
+        send(github, "POST")
+    assert github.requests == ["POST"]
+
+
+@pytest.mark.parametrize("failure", [
+    httpx.Response(429, headers={"Retry-After": "0"}),
+    # A secondary rate limit
+    httpx.Response(403, headers={"Retry-After": "0"}),
+    httpx.ConnectError("connection refused"),
+])
+def test_post_is_resent_when_nothing_was_created(failure):
+    github = StubGitHub(failure, httpx.Response(201, json={"id": 1}))
+    assert send(github, "POST").json() == {"id": 1}
+    assert github.requests == ["POST", "POST"]
@@ -0,0 +1,98 @@
+import os
+import shutil
+import subprocess
+import tracemalloc
+
+import pytest
+
+from modules.HeaderIndex import HeaderIndex
+
+needs_grep = pytest.mark.skipif(not shutil.which("grep"), reason="grep is needed")
+
+HEADERS = {
+    "a.h": "int foobar(void);\nint foo_bar(int x);\nint my_foo;\n#define ab$c 1\n",
+    "b.h": "/* foo() is declared here */\nint foo(void);\nint api_v2(void);\nint ab$c(void);\n",
+    "c.h": "int foo(void);\nint bar(void);\nint x.cold;\nint only_c(long);\n",
+}
+SYMBOLS = ["foo", "foobar", "foo_bar", "my_foo", "bar", "only_c", "api_v2", "ab$c", "x.cold", "fo", "missing",
+           "long"]
+
+
+def grep_for_symbol(symbol, headers):
+    """
+    The header the per-header `grep -rw` that HeaderIndex replaced found `symbol` in first.
+    """
+    for header in headers:
+        if subprocess.run(["grep", "-rwF", symbol, header], capture_output=True).returncode == 0:
+            return header
+    return None
+
+
+def build_index(headers):
+    return HeaderIndex(os.path.dirname(headers[0])).build(headers)
+
+
+@pytest.fixture
+def headers(tmp_path):
+    paths = []
+    for name, text in HEADERS.items():
+        path = tmp_path / name
+        path.write_text(text)
+        paths.append(str(path))
+    return paths
+
+
+@needs_grep
+@pytest.mark.parametrize("order", [(0, 1, 2), (2, 1, 0), (1, 0, 2)])
+def test_matches_grep(headers, order):
+    ordered = [headers[i] for i in order]
+    index = build_index(ordered)
+    for symbol in SYMBOLS:
+        assert index.find_header(symbol) == grep_for_symbol(symbol, ordered), symbol
+
+
+def test_word_boundaries_and_order(headers):
+    index = build_index(headers)
+    a, b, c = headers
+    # Only whole words match, and the first header in the given order wins
+    assert index.find_header("foo") == b
+    assert index.find_header("foobar") == a
+    assert index.find_header("fo") is None
+    assert index.find_header("bar") == c
+    assert build_index([c, b, a]).find_header("foo") == c
+    # Symbols that aren't plain identifiers are searched for in the text
+    assert index.find_header("ab$c") == a
+    assert index.find_header("x.cold") == c
+    assert index.find_header("x.col") is None
+
+
+def test_version_suffix_is_stripped(headers):
+    index = build_index(headers)
+    assert index.find_header("api_v2@LIB_1.0") == headers[1]
+    assert index.find_header("api_v2@@LIB_2.0") == headers[1]
+    assert index.find_header("ab$c@LIB_1.0") == headers[0]
+    assert index.find_header("missing@LIB_1.0") is None
+    assert index.find_header("@LIB_1.0") is None
+    assert index.find_header("") is None
+    assert "foo@LIB_1.0" in index and "missing" not in index
+
+
+def test_header_texts_are_not_kept(tmp_path):
+    # 500 headers of 20 KB sharing their identifiers, about 10 MB of text
+    line = "int shared_%d(int x, int y);\n"
+    text = "".join(line % (i % 50) for i in range(700))
+    paths = []
+    for i in range(500):
+        path = tmp_path / ("h%d.h" % i)
+        path.write_text(text + "int only_%d(void);\n" % i)
+        paths.append(str(path))
+
+    tracemalloc.start()
+    try:
+        index = build_index(paths)
+        retained, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert retained < len(text) * len(paths) / 10
+    assert index.find_header("only_499") == paths[-1]
+    assert index.find_header("shared_3@V1") == paths[0]
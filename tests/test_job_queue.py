@@ -0,0 +1,136 @@
+import multiprocessing
+import os
+import sqlite3
+
+from modules.JobQueue import JobQueue, QUEUED, RUNNING, CREATED, MERGED, DUPLICATE, DELIVERY_PRUNE_INTERVAL
+
+
+class Clock():
+    def __init__(self, now=1_700_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def delivery_ids(db_path):
+    with sqlite3.connect(db_path) as db:
+        return sorted(row[0] for row in db.execute("SELECT delivery_id FROM deliveries"))
+
+
+def test_redelivery_is_dropped_within_the_retention(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"), delivery_retention=3600, clock=Clock())
+    job_id, outcome = queue.submit("check_suite", {"n": 1}, delivery_id="a")
+    assert outcome == CREATED
+    assert queue.submit("check_suite", {"n": 1}, delivery_id="a") == (job_id, DUPLICATE)
+
+
+def test_expired_deliveries_are_deleted(tmp_path):
+    db_path = str(tmp_path / "jobs.db")
+    clock = Clock()
+    queue = JobQueue(db_path, delivery_retention=3600, clock=clock)
+    queue.submit("check_suite", {"n": 1}, delivery_id="old")
+    clock.now += 1800
+    queue.submit("check_suite", {"n": 2}, delivery_id="recent")
+    assert delivery_ids(db_path) == ["old", "recent"]
+
+    clock.now += 1800 + DELIVERY_PRUNE_INTERVAL
+    queue.submit("check_suite", {"n": 3}, delivery_id="new")
+    assert delivery_ids(db_path) == ["new", "recent"]
+
+    # An expired ID is a new delivery again, even before it is pruned
+    clock.now += 3600
+    job_id, outcome = queue.submit("check_suite", {"n": 4}, delivery_id="recent")
+    assert outcome == CREATED
+    assert queue.submit("check_suite", {"n": 4}, delivery_id="recent") == (job_id, DUPLICATE)
+
+
+def test_events_within_the_window_are_merged_into_one_job(tmp_path):
+    clock = Clock()
+    queue = JobQueue(str(tmp_path / "jobs.db"), clock=clock)
+    job_id, outcome = queue.submit("check_suite", {"n": 1}, delivery_id="a", coalesce_key="repo@sha", window=10)
+    assert outcome == CREATED
+    # The job is held back for the window, and later events for the same key join it
+    assert queue.claim("worker") is None
+    clock.now += 5
+    assert queue.submit("pull_request", {"n": 2}, delivery_id="b", coalesce_key="repo@sha", window=10) == \
+        (job_id, MERGED)
+    assert queue.submit("pull_request", {"n": 2}, delivery_id="b", coalesce_key="repo@sha", window=10) == \
+        (job_id, DUPLICATE)
+    other_id, outcome = queue.submit("check_suite", {"n": 3}, coalesce_key="repo@other", window=10)
+    assert outcome == CREATED
+
+    clock.now += 5
+    job = queue.claim("worker")
+    assert job["id"] == job_id
+    assert job["payload"] == {"n": 1}
+    assert job["merged"] == [{"n": 2}]
+    assert queue.claim("worker") is None
+
+    # Once the job is running, a new event for the key gets a job of its own
+    new_id, outcome = queue.submit("check_suite", {"n": 4}, coalesce_key="repo@sha", window=10)
+    assert outcome == CREATED
+    clock.now += 10
+    assert [queue.claim("worker")["id"], queue.claim("worker")["id"]] == [other_id, new_id]
+
+
+def test_new_head_cancels_superseded_jobs(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"), clock=Clock())
+    running_id, _ = queue.submit("check_suite", {}, coalesce_key="repo@old1", branch="repo:main", head_sha="old1")
+    assert queue.claim("worker")["id"] == running_id
+    queued_id, _ = queue.submit("check_suite", {}, coalesce_key="repo@old2", branch="repo:main", head_sha="old2")
+    other_branch_id, _ = queue.submit("check_suite", {}, coalesce_key="repo@feat", branch="repo:feature",
+                                      head_sha="feat")
+    head_id, _ = queue.submit("check_suite", {}, coalesce_key="repo@new", branch="repo:main", head_sha="new")
+
+    assert queue.cancel_superseded("repo:main", "new") == 2
+    assert queue.is_cancel_requested(running_id)
+    assert queue.is_cancel_requested(queued_id)
+    assert not queue.is_cancel_requested(other_branch_id)
+    assert not queue.is_cancel_requested(head_id)
+    # Already flagged jobs aren't counted again
+    assert queue.cancel_superseded("repo:main", "new") == 0
+
+    # A cancelled job no longer takes in events for its key
+    job_id, outcome = queue.submit("check_suite", {}, coalesce_key="repo@old2", branch="repo:main", head_sha="old2")
+    assert outcome == CREATED
+    assert job_id != queued_id
+
+
+def test_higher_priorities_are_claimed_first(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"), clock=Clock())
+    low = queue.enqueue("check_run", {}, priority=0)
+    high = queue.enqueue("check_suite", {}, priority=10)
+    low_2 = queue.enqueue("check_run", {}, priority=0)
+    high_2 = queue.enqueue("check_suite", {}, priority=10)
+    claimed = [queue.claim("worker")["id"] for _ in range(4)]
+    assert claimed == [high, high_2, low, low_2]
+    assert queue.claim("worker") is None
+    assert queue.counts() == {RUNNING: 4}
+
+
+def _claim_and_die(db_path, worker):
+    JobQueue(db_path).claim(worker)
+    os._exit(1)
+
+
+def test_job_of_a_dead_worker_is_requeued(tmp_path):
+    db_path = str(tmp_path / "jobs.db")
+    queue = JobQueue(db_path)
+    job_id = queue.enqueue("check_run", {"n": 1})
+    other_id = queue.enqueue("check_run", {"n": 2})
+    assert queue.claim("worker-0")["id"] == job_id
+
+    # Another worker process claims a job and dies before finishing it
+    process = multiprocessing.get_context("spawn").Process(target=_claim_and_die, args=(db_path, "worker-1"))
+    process.start()
+    process.join()
+    assert process.exitcode == 1
+    assert queue.get(other_id)["status"] == RUNNING
+
+    assert queue.requeue_running("worker-1") == 1
+    job = queue.get(other_id)
+    assert (job["status"], job["worker"]) == (QUEUED, None)
+    assert queue.get(job_id)["status"] == RUNNING
+    job = queue.claim("worker-2")
+    assert (job["id"], job["worker"], job["payload"]) == (other_id, "worker-2", {"n": 2})
@@ -0,0 +1,38 @@
+import subprocess
+import sys
+
+from modules.Metrics import Metrics, run_process, record_processes
+
+
+def test_subprocesses_are_counted_without_patching_popen():
+    popen_init, popen_wait = subprocess.Popen.__init__, subprocess.Popen.wait
+    metrics = Metrics()
+    with metrics.stage("outer"):
+        run_process([sys.executable, "-c", "pass"], check=True)
+        with metrics.stage("inner"):
+            record_processes(1.5, count=3)
+    assert subprocess.Popen.__init__ is popen_init
+    assert subprocess.Popen.wait is popen_wait
+    assert metrics.stages["outer"]["subprocesses"] == 4
+    assert metrics.stages["inner"]["subprocesses"] == 3
+    assert metrics.stages["inner"]["subprocess_wall"] == 1.5
+    assert metrics.to_dict()["totals"]["subprocesses"] == 4
+
+
+def test_nested_stage_keeps_the_peak_rss_of_the_outer_stage():
+    metrics = Metrics()
+    with metrics.stage("outer"):
+        block = bytearray(64 << 20)
+        block[::4096] = b"x" * len(block[::4096])
+        del block
+        with metrics.stage("inner"):
+            pass
+    assert metrics.stages["outer"]["peak_rss"] >= 64 << 20
+
+
+def test_children_peak_rss_is_reported():
+    metrics = Metrics()
+    with metrics.stage("child"):
+        run_process([sys.executable, "-c", "b = bytearray(32 << 20); b[::4096] = b'x' * len(b[::4096])"],
+                    check=True)
+    assert metrics.stages["child"]["children_peak_rss"] >= 32 << 20
@@ -0,0 +1,88 @@
+import random
+import tracemalloc
+
+from modules.Reachability import ReachabilityIndex
+
+
+def naive_reach(callgraph, function):
+    seen = {function}
+    todo = [function]
+    while todo:
+        for callee in callgraph.get(todo.pop(), []):
+            if callee not in seen:
+                seen.add(callee)
+                todo.append(callee)
+    return seen
+
+
+def test_matches_naive_search_with_cycles():
+    rng = random.Random(0)
+    n = 500
+    callgraph = {"f%d" % i: ["f%d" % rng.randrange(n) for _ in range(rng.randrange(4))] for i in range(n)}
+    index = ReachabilityIndex(callgraph)
+    for function in callgraph:
+        assert set(index.callees(function)) == naive_reach(callgraph, function)
+        assert len(index.callees(function)) == len(naive_reach(callgraph, function))
+    assert index.callees("missing") == []
+
+
+def test_large_sparse_graph_keeps_no_per_query_state():
+    # 200k functions in pairs: every closure has two functions
+    n = 200000
+    callgraph = {"f%d" % i: ["f%d" % (i + 1)] if i % 2 == 0 else [] for i in range(n)}
+    index = ReachabilityIndex(callgraph)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(0, n, 10):
+        assert len(index.reachable_ids("f%d" % i)) == 2
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert after - before < 1 << 20
+    assert peak - before < 1 << 20
+
+
+def test_shared_closures_are_memoized():
+    # Every API calls into the same deep chain of helpers
+    depth = 5000
+    callgraph = {"h%d" % i: ["h%d" % (i + 1)] for i in range(depth)}
+    callgraph.update({"api%d" % i: ["h0", "own%d" % i] for i in range(50)})
+    index = ReachabilityIndex(callgraph)
+    helper = index.component_of("h0")
+
+    assert len(index.callees("api0")) == depth + 3
+    assert helper not in index._cache
+    # The second API to reach the chain walks it once on its own and memoizes it
+    assert len(index.callees("api1")) == depth + 3
+    assert helper in index._cache
+    assert index.component_of("api1") not in index._cache
+
+    # Later walks stop at the helper and take its memoized set: only api2 and own2 are expanded
+    targets = index._scc_targets
+    expanded = []
+
+    class RecordingTargets(object):
+        def __getitem__(self, item):
+            expanded.append(item)
+            return targets[item]
+
+    index._scc_targets = RecordingTargets()
+    try:
+        assert set(index.callees("api2")) == naive_reach(callgraph, "api2")
+    finally:
+        index._scc_targets = targets
+    assert len(expanded) == 2
+
+
+def test_memoized_sets_are_bounded_and_correct():
+    rng = random.Random(1)
+    n = 400
+    callgraph = {"f%d" % i: ["f%d" % rng.randrange(n) for _ in range(rng.randrange(3))] for i in range(n)}
+    index = ReachabilityIndex(callgraph, cache_size=200)
+    for _ in range(3):
+        for i in rng.sample(range(n), n):
+            function = "f%d" % i
+            assert set(index.callees(function)) == naive_reach(callgraph, function)
+            assert len(index.callees(function)) == len(naive_reach(callgraph, function))
+            assert index._cached_ids <= 200
+    assert index._cache
@@ -0,0 +1,89 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from modules.Coverage import LibCoverage
+from modules.GcovIndex import FunctionRecord
+from modules.Shard import write_shard, read_shard, merge_shards
+
+needs_gcc = pytest.mark.skipif(not (shutil.which("gcc") and shutil.which("gcov")), reason="gcc and gcov are needed")
+
+# A static function of a header is compiled into every object including it
+HEADER = """
+static int helper(int x)
+{
+    if (x > 0)
+        return 1;
+    return 0;
+}
+"""
+
+SOURCES = {
+    "a.c": '#include "helper.h"\nint run_a(void)\n{\n    return helper(1);\n}\n',
+    "b.c": '#include "helper.h"\nint run_b(void)\n{\n    return helper(0);\n}\n',
+    "main.c": "int run_a(void);\nint run_b(void);\nint main(void)\n{\n    return run_a() + run_b() - 1;\n}\n",
+}
+
+
+@pytest.fixture(scope="module")
+def project(tmp_path_factory):
+    root = tmp_path_factory.mktemp("project")
+    (root / "helper.h").write_text(HEADER)
+    objects = []
+    for name, source in SOURCES.items():
+        (root / name).write_text(source)
+        obj = name[:-2] + ".o"
+        subprocess.run(["gcc", "-c", "--coverage", "-O0", name, "-o", obj], cwd=str(root), check=True)
+        objects.append(obj)
+    subprocess.run(["gcc", "--coverage", "-o", "prog"] + objects, cwd=str(root), check=True)
+    subprocess.run(["./prog"], cwd=str(root), check=True)
+    return str(root)
+
+
+def api_coverage(coverage):
+    coverage.populate_entry_api_cov()
+    return {api: (coverage.api_coverage[api], coverage.api_sizes[api]) for api in coverage.api_coverage}
+
+
+@needs_gcc
+@pytest.mark.parametrize("backend", ["json", "native"])
+def test_function_in_two_objects_is_unioned(project, backend):
+    coverage = LibCoverage(["helper"], project, gcov_backend=backend)
+    coverage.run_gcov_on_gcno_files()
+    # Each object executes a different branch of the helper, together all of it
+    assert len(coverage.coverage_index.get("helper")) == 2
+    assert api_coverage(coverage) == {"helper": ((100.0, 4), 4)}
+
+
+@needs_gcc
+@pytest.mark.parametrize("backend", ["json", "native"])
+def test_merged_shards_match_the_unsharded_run(project, tmp_path, backend):
+    apis = ["helper", "run_a", "run_b", "main"]
+    unsharded = LibCoverage(apis, project, gcov_backend=backend)
+    unsharded.run_gcov_on_gcno_files()
+
+    shard_files = []
+    for shard_index in range(3):
+        coverage = LibCoverage(apis, project, gcov_backend=backend)
+        coverage.run_gcov_on_gcno_files(shard_index=shard_index, shard_count=3)
+        path = str(tmp_path / ("shard%d.json.gz" % shard_index))
+        write_shard(path, apis, coverage.coverage_index, project, shard_index, 3, coverage.gcno_files_processed)
+        shard_files.append(path)
+
+    for order in (shard_files, shard_files[::-1]):
+        merged_apis, index = merge_shards([read_shard(path) for path in order])
+        assert merged_apis == apis
+        merged = LibCoverage(merged_apis, project, coverage_index=index)
+        assert api_coverage(merged) == api_coverage(unsharded)
+
+
+def test_api_order_does_not_depend_on_the_shard_order():
+    def shard(index, apis):
+        return {"shard_index": index, "apis": apis, "functions": {"f": {"a.c": [[1, 2], [index, 0]]}}}
+    shards = [shard(0, ["b", "a", "c"]), shard(1, ["b", "a", "d", "c"]), shard(2, ["e", "b", "a", "c"])]
+    results = [merge_shards(order) for order in (shards, shards[::-1], shards[1:] + shards[:1])]
+    for apis, index in results:
+        assert apis == ["b", "a", "c", "d", "e"]
+        assert index.get_union("f") == [FunctionRecord("a.c", 50.0, 2, 1)]
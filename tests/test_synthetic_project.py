@@ -0,0 +1,27 @@
+import os
+import shutil
+
+import pytest
+
+from synthetic_project import SyntheticProject, SyntheticProjectError
+
+
+def test_refuses_a_directory_it_did_not_generate(tmp_path):
+    (tmp_path / "notes.txt").write_text("keep me")
+    with pytest.raises(SyntheticProjectError):
+        SyntheticProject(str(tmp_path), libs=1, exports=2).generate()
+    assert os.listdir(str(tmp_path)) == ["notes.txt"]
+
+
+@pytest.mark.skipif(not shutil.which("gcc"), reason="gcc is needed")
+def test_replaces_its_own_tree(tmp_path):
+    root = str(tmp_path / "bench")
+    project = SyntheticProject(root, libs=1, exports=2, gcov_sets=1).generate()
+    assert os.path.exists(os.path.join(root, SyntheticProject.MARKER_FILE))
+    stale = os.path.join(project.project_dir, "stale.txt")
+    with open(stale, "w") as fh:
+        fh.write("left over")
+
+    SyntheticProject(root, libs=1, exports=3, gcov_sets=1).generate()
+    assert not os.path.exists(stale)
+    assert os.path.exists(os.path.join(root, SyntheticProject.MARKER_FILE))
@@ -0,0 +1,170 @@
+import asyncio
+import importlib
+import sys
+from datetime import datetime, timezone
+
+import httpx
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from modules.GitHubClient import GitHubClient
+from modules.TokenCache import InstallationTokenCache, REFRESH_MARGIN
+
+TOKEN_LIFETIME = 3600
+
+
+@pytest.fixture(scope="module")
+def private_key():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                             serialization.NoEncryption()).decode()
+
+
+class Clock():
+    def __init__(self, now=1_700_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class MockGitHub():
+    """
+    Answers the token endpoints of the GitHub API and records every request.
+    """
+
+    def __init__(self, clock, default_installation=7):
+        self.clock = clock
+        self.default_installation = default_installation
+        self.requests = []
+        self.issued = 0
+        self.revoked = set()
+
+    async def __call__(self, request):
+        self.requests.append(request)
+        path = request.url.path
+        # Give concurrent callers a chance to run into each other
+        await asyncio.sleep(0.01)
+        if path == "/app/installations":
+            return httpx.Response(200, json=[{"id": self.default_installation}])
+        if path.startswith("/app/installations/") and path.endswith("/access_tokens"):
+            installation_id = path.split("/")[3]
+            self.issued += 1
+            expires_at = datetime.fromtimestamp(self.clock() + TOKEN_LIFETIME, timezone.utc)
+            return httpx.Response(201, json={"token": "token-%s-%d" % (installation_id, self.issued),
+                                             "expires_at": expires_at.isoformat().replace("+00:00", "Z")})
+        if request.headers.get("authorization", "").split(" ")[-1] in self.revoked:
+            return httpx.Response(401, json={"message": "Bad credentials"})
+        return httpx.Response(200, json={"id": 1, "authorization": request.headers.get("authorization")})
+
+    def token_requests(self):
+        return [r.url.path for r in self.requests if r.url.path.endswith("/access_tokens")]
+
+
+def make_cache(private_key, clock, github):
+    client = GitHubClient("https://api.github.test", transport=httpx.MockTransport(github), backoff=0)
+    tokens = InstallationTokenCache("1", private_key, client, clock=clock)
+    client.tokens = tokens
+    return client, tokens
+
+
+def test_refreshes_inside_the_expiry_window(private_key):
+    async def run():
+        clock = Clock()
+        github = MockGitHub(clock)
+        client, tokens = make_cache(private_key, clock, github)
+        first = await tokens.get_token(3)
+        assert await tokens.get_token(3) == first
+        assert len(github.token_requests()) == 1
+
+        # Close to expiry the cached token is still handed out while a new one is fetched
+        clock.now += TOKEN_LIFETIME - REFRESH_MARGIN + 1
+        assert await tokens.get_token(3) == first
+        await asyncio.wait_for(tokens._refreshing[3], 5)
+        second = await tokens.get_token(3)
+        assert second != first
+        assert len(github.token_requests()) == 2
+
+        # An expired token is never returned
+        clock.now += TOKEN_LIFETIME + 1
+        third = await tokens.get_token(3)
+        assert third not in (first, second)
+        await client.aclose()
+
+    asyncio.run(run())
+
+
+def test_concurrent_requests_share_one_fetch(private_key):
+    async def run():
+        clock = Clock()
+        github = MockGitHub(clock)
+        client, tokens = make_cache(private_key, clock, github)
+        results = await asyncio.gather(*(tokens.get_token(5) for _ in range(20)))
+        assert len(set(results)) == 1
+        assert github.token_requests() == ["/app/installations/5/access_tokens"]
+        await client.aclose()
+
+    asyncio.run(run())
+
+
+def test_rejected_token_is_renewed_once(private_key):
+    async def run():
+        clock = Clock()
+        github = MockGitHub(clock)
+        client, tokens = make_cache(private_key, clock, github)
+        revoked = await tokens.get_token(3)
+        github.revoked.add(revoked)
+        response = await client.get("/repos/o/r", installation_id=3)
+        assert response["authorization"] != "Bearer " + revoked
+        assert len(github.token_requests()) == 2
+
+        # A request that keeps being rejected fails after one renewal
+        github.revoked.add(await tokens.get_token(3))
+        github.revoked.add("token-3-3")
+        with pytest.raises(httpx.HTTPStatusError):
+            await client.get("/repos/o/r", installation_id=3)
+        assert len(github.token_requests()) == 3
+        await client.aclose()
+
+    asyncio.run(run())
+
+
+@pytest.fixture
+def app_module(monkeypatch, tmp_path, private_key):
+    monkeypatch.setenv("GITHUB_WEBHOOK_SECRET", "secret")
+    monkeypatch.setenv("GITHUB_APP_IDENTIFIER", "1")
+    monkeypatch.setenv("GITHUB_PRIVATE_KEY", private_key)
+    monkeypatch.setenv("GITHUB_API_URL", "https://api.github.test")
+    monkeypatch.setenv("APICOV_JOB_DB", str(tmp_path / "jobs.db"))
+    sys.modules.pop("app", None)
+    app = importlib.import_module("app")
+    yield app
+    sys.modules.pop("app", None)
+
+
+def test_installation_id_comes_from_the_webhook_payload(app_module):
+    async def run():
+        clock = Clock()
+        github = MockGitHub(clock)
+        app_module.github_client = GitHubClient(app_module.GITHUB_API_URL,
+                                                transport=httpx.MockTransport(github))
+        app_module.token_cache = None
+        payload = {
+            "action": "requested",
+            "installation": {"id": 42},
+            "repository": {"full_name": "o/r"},
+            "check_suite": {"id": 9, "head_sha": "abc", "head_branch": "main"},
+        }
+        assert await app_module.process_event("check_suite", payload) == {"check_run_id": 1}
+        assert github.token_requests() == ["/app/installations/42/access_tokens"]
+        check_run = [r for r in github.requests if r.url.path == "/repos/o/r/check-runs"][0]
+        assert check_run.headers["authorization"] == "Bearer token-42-1"
+
+        # Without an installation in the payload the app's first installation is used
+        del payload["installation"]
+        await app_module.process_event("check_suite", payload)
+        assert github.token_requests()[-1] == "/app/installations/7/access_tokens"
+        await app_module.github_client.aclose()
+
+    asyncio.run(run())